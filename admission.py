@@ -0,0 +1,200 @@
+# ============================================
+# ADMISSION CONTROL AND LOAD SHEDDING
+# Requests take a slot before their handler runs:
+#   - each endpoint class has its own concurrency limit and queue
+#   - all classes share one total limit; when a slot frees up, the
+#     waiting request with the lowest priority value goes first
+#     (predict = 0, generate_image = 2), so slow image calls cannot
+#     starve predictions
+#   - `reserved` of the total slots are kept for priority-0 classes, so
+#     the slower classes together cannot take every thread
+#   - a request waits at most queue_slo_ms for a slot, and never past
+#     its deadline (X-Request-Timeout-Ms or the class default): work the
+#     client has already given up on is dropped, not started
+#   - rejections are immediate, with a Retry-After estimated from the
+#     class's recent service time
+# Health, readiness and metrics bypass admission entirely (see app.py).
+#
+#   classes = parse_classes('predict=32:256:0,generate_image=8:32:2,default=8:32:1')
+# ============================================
+import bisect
+import itertools
+import math
+import threading
+import time
+
+from metrics import Histogram, LATENCY_MS_BUCKETS
+
+REJECT_REASONS = ('queue_full', 'queue_timeout', 'expired')
+
+
+class Rejected(Exception):
+    def __init__(self, reason, endpoint_class, retry_after):
+        super().__init__(f"{endpoint_class} is overloaded ({reason})")
+        self.reason = reason
+        self.endpoint_class = endpoint_class
+        self.retry_after = retry_after
+
+
+class EndpointClass:
+    def __init__(self, name, limit, max_queue, priority=1, deadline_ms=None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.priority = priority
+        self.deadline_ms = deadline_ms
+        self.active = 0
+        self.queued = 0
+        self.service_ms = None  # EWMA of handler time, for Retry-After
+        self.counters = {'admitted': 0, **{reason: 0 for reason in REJECT_REASONS}}
+        self.wait_hist = Histogram(LATENCY_MS_BUCKETS)
+
+    def stats(self):
+        return {'limit': self.limit, 'max_queue': self.max_queue, 'priority': self.priority,
+                'active': self.active, 'queued': self.queued,
+                'service_ms': round(self.service_ms, 2) if self.service_ms is not None else None,
+                **self.counters}
+
+
+def parse_classes(spec):
+    """'name=limit:queue[:priority[:deadline_ms]],...' -> [EndpointClass]"""
+    classes = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, values = item.partition('=')
+        fields = values.split(':')
+        if len(fields) < 2:
+            raise ValueError(f"Admission class {item!r} needs at least limit:queue")
+        classes.append(EndpointClass(name.strip(), int(fields[0]), int(fields[1]),
+                                     int(fields[2]) if len(fields) > 2 else 1,
+                                     float(fields[3]) if len(fields) > 3 else None))
+    return classes
+
+
+class _Waiter:
+    __slots__ = ('cls', 'deadline', 'queued_at', 'event', 'granted', 'removed')
+
+    def __init__(self, cls, deadline, queued_at):
+        self.cls = cls
+        self.deadline = deadline
+        self.queued_at = queued_at
+        self.event = threading.Event()
+        self.granted = False
+        self.removed = False
+
+
+class Ticket:
+    def __init__(self, controller, cls, deadline, started):
+        self.controller = controller
+        self.cls = cls
+        self.deadline = deadline
+        self.started = started
+        self._released = False
+
+    def remaining(self):
+        """Seconds left before the request's deadline."""
+        return self.deadline - time.monotonic()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, classes, max_concurrency=32, queue_slo_ms=250.0, default_deadline_ms=30000.0,
+                 max_retry_after=30, reserved=0):
+        self.classes = {c.name: c for c in classes}
+        if 'default' not in self.classes:
+            self.classes['default'] = EndpointClass('default', max_concurrency, max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.reserved = min(reserved, max_concurrency - 1)
+        self.queue_slo_ms = queue_slo_ms
+        self.default_deadline_ms = default_deadline_ms
+        self.max_retry_after = max_retry_after
+        self.active = 0
+        # Sorted (priority, seq, waiter): lowest priority value, then FIFO
+        self._waiting = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def admit(self, name, timeout_ms=None):
+        """Block until a slot is free; returns a Ticket or raises Rejected."""
+        cls = self.classes.get(name) or self.classes['default']
+        now = time.monotonic()
+        deadline = now + (timeout_ms or cls.deadline_ms or self.default_deadline_ms) / 1000.0
+        with self._lock:
+            if self._has_room(cls):
+                return self._grant(cls, deadline, now, now)
+            if cls.queued >= cls.max_queue:
+                cls.counters['queue_full'] += 1
+                raise Rejected('queue_full', cls.name, self._retry_after(cls))
+            waiter = _Waiter(cls, deadline, now)
+            bisect.insort(self._waiting, (cls.priority, next(self._seq), waiter))
+            cls.queued += 1
+
+        waiter.event.wait(max(0.0, min(self.queue_slo_ms / 1000.0, deadline - now)))
+        with self._lock:
+            if waiter.granted:
+                return Ticket(self, cls, deadline, time.monotonic())
+            if not waiter.removed:
+                self._remove(waiter)
+            reason = 'expired' if time.monotonic() >= deadline else 'queue_timeout'
+            cls.counters[reason] += 1
+            raise Rejected(reason, cls.name, self._retry_after(cls))
+
+    def _has_room(self, cls):
+        total = self.max_concurrency if cls.priority <= 0 else self.max_concurrency - self.reserved
+        return cls.active < cls.limit and self.active < total
+
+    def _grant(self, cls, deadline, queued_at, now):
+        cls.active += 1
+        self.active += 1
+        cls.counters['admitted'] += 1
+        cls.wait_hist.observe((now - queued_at) * 1000.0)
+        return Ticket(self, cls, deadline, now)
+
+    def _remove(self, waiter):
+        for i, entry in enumerate(self._waiting):
+            if entry[2] is waiter:
+                del self._waiting[i]
+                break
+        waiter.removed = True
+        waiter.cls.queued -= 1
+
+    def _release(self, ticket):
+        now = time.monotonic()
+        with self._lock:
+            cls = ticket.cls
+            cls.active -= 1
+            self.active -= 1
+            elapsed = (now - ticket.started) * 1000.0
+            cls.service_ms = elapsed if cls.service_ms is None else 0.8 * cls.service_ms + 0.2 * elapsed
+            self._dispatch(now)
+
+    def _dispatch(self, now):
+        # Hand free slots to waiters in priority order; a waiter whose class
+        # is at its limit does not block lower-priority classes behind it
+        i = 0
+        while i < len(self._waiting) and self.active < self.max_concurrency:
+            waiter = self._waiting[i][2]
+            if now >= waiter.deadline:
+                self._remove(waiter)
+                waiter.event.set()  # wakes up as expired
+            elif self._has_room(waiter.cls):
+                self._remove(waiter)
+                self._grant(waiter.cls, waiter.deadline, waiter.queued_at, now)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                i += 1
+
+    def _retry_after(self, cls):
+        # Time for the current queue to drain at the class's concurrency
+        service_s = (cls.service_ms or self.queue_slo_ms) / 1000.0
+        return int(min(self.max_retry_after, max(1, math.ceil(service_s * (cls.queued + 1) / cls.limit))))
+
+    def stats(self):
+        with self._lock:
+            return {'active': self.active, 'max_concurrency': self.max_concurrency, 'reserved': self.reserved,
+                    'queued': len(self._waiting), 'queue_slo_ms': self.queue_slo_ms,
+                    'classes': {name: cls.stats() for name, cls in self.classes.items()}}
@@ -1,19 +1,45 @@
 # ============================================
 # IMPORTS FIRST - BEFORE ANYTHING ELSE
 # ============================================
-from flask import Flask, request, jsonify, send_file
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
 from PIL import Image
 import base64
-from io import BytesIO
 from datetime import datetime
-import requests
 import os
 import json
-import time
+import hmac
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as ResultTimeout
+from contextlib import nullcontext
+from functools import partial
+
+import config
+from batching import MicroBatcher
+from inference import load_backend
+from prediction_cache import PredictionCache
+from canvas_decode import decode_input, decode_png, decode_png_bytes, decode_bitmaps, strip_data_url
+from image_gen import ImageGenerator
+from model_loader import ModelLoader, ModelNotReady, StartupTimer
+from model_registry import ModelRegistry, ModelVersion, UnknownModelVersion, version_file
+from similarity import embedder_for, load_index
+from admission import AdmissionController, Rejected, parse_classes, REJECT_REASONS
+from worker_pool import InferencePool, PoolSaturated, forking_pool_worker
+from streaming import SessionManager, event_stream
+from response_format import (MSGPACK, FLOAT16, negotiate, parse_top_k, parse_bool,
+                             categories_etag, top_k_indices, prediction_fields,
+                             encode_msgpack, encode_float16)
+import metrics
+from metrics import REGISTRY, REQUEST_LATENCY, REQUESTS, STAGE_LATENCY
+import request_log
+from profiling import ProfileSession, sample_stacks
+import atexit
+
+startup = StartupTimer()
+startup.record('imports', IMPORT_STARTED)
 
 # ============================================
 # CREATE APP IMMEDIATELY AFTER IMPORTS
@@ -23,34 +49,296 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 
 print("✅ Flask app created")
 
+# Request-path logging goes through a background thread (see request_log.py)
+log = request_log.setup(config.LOG_SAMPLE_RATE, config.LOG_LEVEL)
+profile_session = ProfileSession()
+
 # ============================================
 # LOAD MODEL AFTER APP IS CREATED
+# Model versions are loaded, swapped and released by model_registry.py;
+# the first load happens when SKETCH_STARTUP says (see model_loader.py).
+# The globals below mirror the active version for code that just needs
+# "the" model; request handlers pin a version with model_registry.acquire().
 # ============================================
-print("Loading model...")
+backend = None
+inference_pool = None
+batcher = None
+CATEGORIES = []
+NUM_CLASSES = 0
+test_accuracy = 0.0
 
-if not os.path.exists('sketch_model.h5'):
-    print("❌ Model not found! Run train_model.py first.")
-    exit()
+def model_files_present(kind, path=None):
+    if kind == 'cascade':
+        return (os.path.exists(version_file(path, config.FAST_WEIGHTS_PATH))
+                and model_files_present(config.BASE_BACKEND, path))
+    if kind == 'centroid':
+        return (os.path.exists(version_file(path, config.CENTROIDS_PATH))
+                and model_files_present(config.BASE_BACKEND, path))
+    return os.path.exists(version_file(path, config.MODEL_PATH)) or (
+        kind == 'numpy' and os.path.exists(version_file(path, config.NUMPY_WEIGHTS_PATH))) or (
+        kind == 'tflite' and os.path.exists(version_file(path, config.TFLITE_PATH)))
 
-model = keras.models.load_model('sketch_model.h5')
+def build_model(version, path, serving):
+    if not model_files_present(config.INFERENCE_BACKEND, path):
+        raise FileNotFoundError("Model not found! Run train_model.py first.")
 
-with open('categories.json', 'r') as f:
-    CATEGORIES = json.load(f)
+    # Startup phases describe the first load only
+    phase = startup.phase if model_registry.active is None else (lambda name: nullcontext())
 
-NUM_CLASSES = len(CATEGORIES)
+    # TensorFlow is only imported when the keras backend is selected
+    with phase('backend_load'):
+        loaded_backend = load_backend(config.INFERENCE_BACKEND,
+                                      version_file(path, config.MODEL_PATH),
+                                      version_file(path, config.NUMPY_WEIGHTS_PATH),
+                                      version_file(path, config.TFLITE_PATH),
+                                      fast_weights_path=version_file(path, config.FAST_WEIGHTS_PATH),
+                                      centroids_path=version_file(path, config.CENTROIDS_PATH),
+                                      cascade_threshold=config.CASCADE_THRESHOLD,
+                                      base_kind=config.BASE_BACKEND)
 
-try:
-    with open('model_accuracy.txt', 'r') as f:
-        test_accuracy = float(f.read())
-except:
-    test_accuracy = 0.0
+    with phase('categories_load'):
+        # A centroid index carries its own (growable) category list
+        categories = getattr(loaded_backend, 'categories', None)
+        if categories is None:
+            with open(version_file(path, 'categories.json'), 'r') as f:
+                categories = json.load(f)
+
+    try:
+        with open(version_file(path, 'model_accuracy.txt'), 'r') as f:
+            accuracy = float(f.read())
+    except:
+        accuracy = 0.0
+
+    # Warm up: the first call pays for tracing / allocation
+    with phase('warmup'):
+        loaded_backend.predict(np.zeros((1, 28, 28, 1), dtype='float32'))
+
+    model = ModelVersion(version, path, loaded_backend, categories, accuracy)
+    # Optional similar-sketch index built from this model's embeddings
+    index_dir = version_file(path, config.SIMILAR_INDEX_DIR)
+    if os.path.isdir(index_dir):
+        try:
+            model.similar = load_index(index_dir, embedder_for(loaded_backend))
+        except (ValueError, OSError) as e:
+            print(f"⚠️  Similar-sketch search disabled for {version}: {e}")
+    with phase('worker_pool_start'):
+        attach_runtime(model, serving)
+    return model
+
+def attach_runtime(model, serving):
+    # Concurrent /api/predict calls share one batched forward pass per version;
+    # only the active version gets worker processes. Called again when a
+    # version loaded next to the active one is activated, so only missing
+    # pieces are started.
+    if model.batcher is None and config.BATCHING_ENABLED:
+        model.batcher = MicroBatcher(
+            model.predict,
+            max_batch_size=config.BATCH_MAX_SIZE,
+            max_wait_ms=config.BATCH_MAX_WAIT_MS,
+            name=f'predict-batcher-{model.version}',
+        )
+    if serving and model.pool is None and config.WORKER_PROCESSES > 0:
+        model.pool = start_inference_pool(model)
+
+def attach_serving_runtime(model):
+    attach_runtime(model, serving=True)
+
+def start_inference_pool(model):
+    # Worker processes always run the NumPy backend over shared-memory weights
+    if model.backend.name in ('cascade', 'centroid'):
+        print(f"⚠️  Inference pool does not support the {model.backend.name} backend; serving in-process")
+        return None
+    numpy_backend = model.backend
+    if numpy_backend.name != 'numpy':
+        numpy_backend = load_backend('numpy', version_file(model.path, config.MODEL_PATH),
+                                     version_file(model.path, config.NUMPY_WEIGHTS_PATH))
+    pool = InferencePool(
+        numpy_backend,
+        num_workers=config.WORKER_PROCESSES,
+        slots=config.WORKER_SLOTS,
+        max_payload=config.WORKER_MAX_PAYLOAD_BYTES,
+        max_batch=config.WORKER_MAX_BATCH,
+        cpu_affinity=config.WORKER_CPU_AFFINITY,
+        result_timeout=config.WORKER_RESULT_TIMEOUT,
+        max_request_slots=config.WORKER_MAX_REQUEST_SLOTS,
+    )
+    print(f"✅ Inference pool started with {config.WORKER_PROCESSES} worker processes")
+    return pool
+
+def mirror_active(model):
+    global backend, inference_pool, batcher, CATEGORIES, NUM_CLASSES, test_accuracy
+    backend, inference_pool, batcher = model.backend, model.pool, model.batcher
+    CATEGORIES, NUM_CLASSES, test_accuracy = model.categories, model.num_classes, model.accuracy
+
+def on_model_activated(model):
+    mirror_active(model)
+    print(f"✅ Model {model.version} loaded ({backend.name} backend)! Categories: {CATEGORIES}")
+
+def load_model():
+    print("Loading model...")
+    model_registry.activate(config.MODEL_VERSION or None)
+    model_registry.start_watcher()
+
+def start_workers():
+    global prediction_cache, image_generator, decode_pool
+
+    # Repeat submissions of the same sketch skip the forward pass
+    prediction_cache = None
+    if config.CACHE_ENABLED:
+        prediction_cache = PredictionCache(
+            max_entries=config.CACHE_MAX_ENTRIES,
+            ttl_seconds=config.CACHE_TTL_SECONDS,
+            quantize_bits=config.CACHE_QUANTIZE_BITS,
+            watch_files=[config.MODEL_PATH, config.NUMPY_WEIGHTS_PATH, config.TFLITE_PATH, 'categories.json',
+                         config.FAST_WEIGHTS_PATH, config.CENTROIDS_PATH],
+        )
+
+    # Pooled, coalescing, cached Pollinations client
+    image_generator = ImageGenerator(
+        base_url=config.POLLINATIONS_BASE_URL,
+        timeout=config.IMAGE_GEN_TIMEOUT,
+        max_concurrency=config.IMAGE_GEN_MAX_CONCURRENCY,
+        cache_ttl=config.IMAGE_GEN_CACHE_TTL_SECONDS,
+        upstream_histogram=STAGE_LATENCY.labels('generate_image', 'upstream'),
+    )
+
+    # PIL releases the GIL while decoding, so batch canvases decode in parallel
+    decode_pool = ThreadPoolExecutor(max_workers=config.DECODE_WORKERS, thread_name_prefix='decode')
+
+def restart_after_fork():
+    # Threads, locks and pooled sockets do not survive fork(); model weights
+    # loaded in the parent (gunicorn preload_app) are shared copy-on-write
+    if forking_pool_worker():
+        return  # inference pool workers only run worker_pool._worker_main
+    model_loader.after_fork()
+    request_log.restart()
+    start_workers()
+    model_registry.after_fork()
+    # New batcher threads per version; the parent's pool belongs to the
+    # parent, so each serving process starts its own
+    for model in model_registry.loaded():
+        model.batcher = model.pool = None
+        attach_runtime(model, serving=model is model_registry.active)
+    if model_registry.active is not None:
+        mirror_active(model_registry.active)
+
+def stop_inference_pool():
+    model_registry.stop_watcher()
+    for model in model_registry.loaded():
+        if model.pool is not None:
+            model.pool.close()
+
+model_registry = ModelRegistry(
+    build_model,
+    root=config.MODELS_DIR,
+    max_loaded=config.MAX_LOADED_MODELS,
+    watch_interval=config.MODEL_WATCH_INTERVAL,
+    legacy_files=[config.MODEL_PATH, config.NUMPY_WEIGHTS_PATH, config.TFLITE_PATH, 'categories.json',
+                  config.FAST_WEIGHTS_PATH, config.CENTROIDS_PATH],
+    on_activate=on_model_activated,
+    attach_fn=attach_serving_runtime,
+)
+
+# Per-endpoint concurrency limits, queues and deadlines (see admission.py)
+admission = None
+if config.ADMISSION_ENABLED:
+    admission = AdmissionController(parse_classes(config.ADMISSION_CLASSES),
+                                    max_concurrency=config.ADMISSION_MAX_CONCURRENCY,
+                                    reserved=config.ADMISSION_RESERVED,
+                                    queue_slo_ms=config.ADMISSION_QUEUE_SLO_MS,
+                                    default_deadline_ms=config.ADMISSION_DEADLINE_MS)
+# Always answered: probes, metrics, and SSE streams (which hold a thread for
+# the whole session and are capped by STREAM_MAX_OPEN instead)
+ADMISSION_EXEMPT = {'index', 'health', 'liveness', 'readiness', 'metrics_endpoint', 'profile_endpoint',
+                    'stream_events', None}
+ADMISSION_CLASS = {
+    'predict': 'predict',
+    'predict_batch_endpoint': 'batch',
+    'similar_sketches': 'similar',
+    'create_stream_session': 'stream',
+    'stream_strokes': 'stream',
+    'generate_image': 'generate_image',
+    'reload_model': 'admin',
+    'load_model_version': 'admin',
+    'unload_model_version': 'admin',
+}
 
-print(f"✅ Model loaded! Categories: {CATEGORIES}")
 os.makedirs('static', exist_ok=True)
+stream_sessions = SessionManager(max_sessions=config.STREAM_MAX_SESSIONS, idle_ttl=config.STREAM_IDLE_TTL,
+                                 max_streams=config.STREAM_MAX_OPEN)
+start_workers()
+if config.BATCHING_ENABLED:
+    print(f"✅ Micro-batching enabled (max batch {config.BATCH_MAX_SIZE}, max wait {config.BATCH_MAX_WAIT_MS}ms)")
+
+model_loader = ModelLoader(load_model, mode=config.STARTUP_MODE, timer=startup)
+try:
+    model_loader.start()
+except FileNotFoundError:
+    # Stay up: liveness keeps answering, readiness reports the error, and
+    # the next request that needs the model tries loading it again
+    print("⚠️ Serving without a model until one is available")
+os.register_at_fork(after_in_child=restart_after_fork)
+atexit.register(stop_inference_pool)
+atexit.register(request_log.stop)
+startup.record('app_import', IMPORT_STARTED)
 
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
+def format_prediction(predictions, model):
+    predicted_idx = np.argmax(predictions)
+    return {
+        'prediction': model.categories[predicted_idx],
+        'confidence': float(predictions[predicted_idx]),
+        'all_predictions': {model.categories[i]: float(predictions[i]) for i in range(model.num_classes)}
+    }
+
+def predict_probabilities(img_array, model, timeout=None):
+    # uint8 28x28 bitmap -> class probabilities, via cache, pool or batcher.
+    # Waits at most `timeout` (default WORKER_RESULT_TIMEOUT), and never past
+    # the request's deadline when called from a Flask request
+    if timeout is None:
+        timeout = config.WORKER_RESULT_TIMEOUT
+    cache_key = None
+    if prediction_cache is not None:
+        cache_key = prediction_cache.key(img_array, model.cache_namespace)
+        predictions = prediction_cache.get(cache_key)
+        if predictions is not None:
+            return predictions
+
+    if model.pool is not None:
+        future = model.pool.submit_bitmap(img_array, timeout=time_left(timeout))
+        predictions = future.result(timeout=time_left(timeout))
+    elif model.batcher is not None:
+        img_array = img_array.reshape(28, 28, 1).astype('float32') / 255.0
+        predictions = model.batcher.submit(img_array, timeout=time_left(timeout))
+    else:
+        img_array = img_array.reshape(1, 28, 28, 1).astype('float32') / 255.0
+        predictions = model.predict(img_array)[0]
+
+    if cache_key is not None:
+        prediction_cache.put(cache_key, predictions)
+    return predictions
+
+def predict_png(png_bytes, model, timeout=None):
+    # PNG canvas -> class probabilities on the worker pool, which decodes it
+    # too; the bitmap never exists here, so the cache is keyed on the bytes
+    cache_key = None
+    if prediction_cache is not None:
+        cache_key = prediction_cache.encoded_key(png_bytes, model.cache_namespace)
+        predictions = prediction_cache.get(cache_key)
+        if predictions is not None:
+            return predictions
+
+    if timeout is None:
+        timeout = config.WORKER_RESULT_TIMEOUT
+    future = model.pool.submit_png(png_bytes, timeout=time_left(timeout))
+    predictions = future.result(timeout=time_left(timeout))
+
+    if cache_key is not None:
+        prediction_cache.put(cache_key, predictions)
+    return predictions
+
 def predict_drawing(image_data):
     if isinstance(image_data, Image.Image):
         img = image_data.convert('L').resize((28, 28))
@@ -58,28 +346,169 @@ def predict_drawing(image_data):
     else:
         img_array = image_data
     
-    img_array = img_array.reshape(1, 28, 28, 1).astype('float32') / 255.0
-    predictions = model.predict(img_array, verbose=0)[0]
-    predicted_idx = np.argmax(predictions)
-    
-    return {
-        'prediction': CATEGORIES[predicted_idx],
-        'confidence': float(predictions[predicted_idx]),
-        'all_predictions': {CATEGORIES[i]: float(predictions[i]) for i in range(NUM_CLASSES)}
-    }
+    with model_registry.acquire() as model:
+        return format_prediction(predict_probabilities(img_array, model), model)
+
+def predict_many(bitmaps, model):
+    if model.pool is not None:
+        return model.pool.predict_bitmaps(bitmaps, timeout=time_left(config.WORKER_RESULT_TIMEOUT))
+
+    # One vectorized forward pass per chunk, bypassing the micro-batcher
+    x = bitmaps.reshape(-1, 28, 28, 1).astype('float32') / 255.0
+    chunk = config.BATCH_ENDPOINT_CHUNK
+    return np.concatenate([model.predict(x[i:i + chunk]) for i in range(0, len(x), chunk)])
+
+def time_left(default=None):
+    # How long a blocking call may wait: at most `default`, and never past
+    # the admitted request's deadline (X-Request-Timeout-Ms or class default)
+    ticket = g.get('admission_ticket') if has_request_context() else None
+    if ticket is None:
+        return default
+    remaining = max(0.0, ticket.remaining())
+    return remaining if default is None else min(default, remaining)
+
+def requested_version(data=None):
+    # Per-request A/B selection: body field, query parameter or header
+    return ((data or {}).get('model_version') or request.args.get('model_version')
+            or request.headers.get('X-Model-Version') or None)
+
+def overloaded(message, reason, retry_after):
+    # Same 503 shape for admission rejections and a saturated worker pool
+    response = jsonify({'error': message, 'reason': reason, 'success': False, 'retry_after': retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def unknown_version(e):
+    return jsonify({'error': f"Model version {e.args[0]} is not loaded", 'success': False,
+                    'loaded_versions': [m.version for m in model_registry.loaded()]}), 404
+
+def require_model():
+    # Returns an error response while the model is not loaded yet
+    try:
+        model_loader.ensure_ready(config.READY_TIMEOUT)
+    except ModelNotReady as e:
+        return jsonify({'error': str(e), 'success': False, 'ready': False}), 503
+    return None
+
+def encoded_response(payload, encoding, predictions=None, top_k=None, status=200, model=None):
+    # JSON by default; msgpack or raw float16 when the client asks for it
+    if encoding == FLOAT16 and predictions is not None:
+        body, headers = encode_float16(predictions, top_k)
+        headers['X-Categories-ETag'] = f'"{categories_etag(model.categories if model else CATEGORIES)}"'
+        response = Response(body, status=status, mimetype=FLOAT16, headers=headers)
+    elif encoding == MSGPACK:
+        response = Response(encode_msgpack(payload), status=status, mimetype=MSGPACK)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+    response.headers['Vary'] = 'Accept'
+    if model is not None:
+        response.headers['X-Model-Version'] = model.version
+    return response
 
 def generate_with_pollinations(prompt):
+    return image_generator.generate(prompt, timeout=time_left(config.IMAGE_GEN_TIMEOUT))
+
+IMAGE_PROMPTS = {
+    'realistic': "photorealistic {prediction}, 4k, professional photography",
+    'artistic': "artistic painting of {prediction}, vibrant colors",
+    'cartoon': "cute cartoon {prediction}, colorful, child-friendly",
+    'sketch': "pencil sketch of {prediction}, detailed shading"
+}
+
+def build_prompt(prediction, style):
+    template = IMAGE_PROMPTS.get(style, IMAGE_PROMPTS['realistic'])
+    return template.format(prediction=prediction)
+
+# ============================================
+# REQUEST INSTRUMENTATION (see metrics.py, request_log.py, profiling.py)
+# ============================================
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler = profile_session.begin_request()
+
+@app.before_request
+def admit_request():
+    if admission is None or request.endpoint in ADMISSION_EXEMPT:
+        return None
     try:
-        encoded_prompt = requests.utils.quote(prompt)
-        image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=512&height=512&nologo=true&timestamp={int(time.time())}"
-        test = requests.get(image_url, timeout=15)
-        if test.status_code == 200:
-            return image_url
-        raise Exception(f"Pollinations returned {test.status_code}")
-    except requests.exceptions.Timeout:
-        raise Exception("Image generation timed out")
-    except Exception as e:
-        raise Exception(f"Generation failed: {str(e)}")
+        timeout_ms = float(request.headers.get('X-Request-Timeout-Ms', 0)) or None
+    except ValueError:
+        timeout_ms = None
+    try:
+        g.admission_ticket = admission.admit(ADMISSION_CLASS.get(request.endpoint, 'default'), timeout_ms)
+    except Rejected as e:
+        return overloaded(str(e), e.reason, e.retry_after)
+    return None
+
+@app.teardown_request
+def release_admission(exc):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        ticket.release()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        endpoint = request.endpoint or 'unmatched'
+        status = str(response.status_code)
+        REQUEST_LATENCY.labels(endpoint, status).observe(elapsed_ms)
+        REQUESTS.labels(endpoint, status).inc()
+        request_log.request(endpoint, status, elapsed_ms, path=request.path)
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    profile_session.end_request(g.pop('profiler', None))
+
+def component_metrics():
+    # State owned by the batcher, caches and pool, read at scrape time
+    yield 'model_ready', 'gauge', 'Whether the model is loaded', [({}, int(model_loader.ready))]
+    if batcher is not None:
+        yield 'batch_size', 'histogram', 'Micro-batch sizes', [({}, batcher.batch_size_hist)]
+        yield ('batch_queue_wait_milliseconds', 'histogram', 'Time requests wait for a micro-batch',
+               [({}, batcher.queue_wait_hist)])
+        yield 'batch_queue_depth', 'gauge', 'Requests waiting for a micro-batch', [({}, batcher.stats()['queue_depth'])]
+    if prediction_cache is not None:
+        cache = prediction_cache.stats()
+        yield 'prediction_cache_entries', 'gauge', 'Cached predictions', [({}, cache['entries'])]
+        yield ('prediction_cache_events_total', 'counter', 'Prediction cache lookups and removals',
+               [({'event': k}, cache[k]) for k in ('hits', 'misses', 'evictions', 'expirations', 'invalidations')])
+    gen = image_generator.stats()
+    yield ('image_generation_events_total', 'counter', 'Image generation requests by outcome',
+           [({'event': k}, gen[k]) for k in ('requests', 'cache_hits', 'coalesced', 'upstream_calls',
+                                              'upstream_errors', 'jobs_submitted')])
+    yield 'image_generation_inflight', 'gauge', 'Upstream image calls in flight', [({}, gen['inflight'])]
+    if inference_pool is not None:
+        pool = inference_pool.stats()
+        yield 'worker_pool_alive', 'gauge', 'Live inference worker processes', [({}, pool['alive'])]
+        yield 'worker_pool_free_slots', 'gauge', 'Free shared-memory request slots', [({}, pool['free_slots'])]
+        yield 'worker_pool_respawns_total', 'counter', 'Inference workers restarted after dying', [({}, pool['respawns'])]
+    yield 'stream_sessions', 'gauge', 'Open live prediction sessions', [({}, len(stream_sessions))]
+    yield 'stream_open_events', 'gauge', 'Open live prediction event streams', [({}, stream_sessions.open_streams)]
+    if admission is not None:
+        classes = admission.classes.values()
+        yield ('admission_in_flight', 'gauge', 'Requests holding an admission slot',
+               [({'class': c.name}, c.active) for c in classes])
+        yield ('admission_queued', 'gauge', 'Requests waiting for an admission slot',
+               [({'class': c.name}, c.queued) for c in classes])
+        yield ('admission_queue_wait_milliseconds', 'histogram', 'Time admitted requests waited for a slot',
+               [({'class': c.name}, c.wait_hist) for c in classes])
+        yield ('admission_rejected_total', 'counter', 'Requests shed with a 503, by reason',
+               [({'class': c.name, 'reason': r}, c.counters[r]) for c in classes for r in REJECT_REASONS])
+    loaded = model_registry.loaded()
+    yield ('model_weights_bytes', 'gauge', 'Weight memory per loaded model version',
+           [({'version': m.version}, m.weights_bytes) for m in loaded])
+    yield ('model_in_flight', 'gauge', 'Requests currently pinned to each model version',
+           [({'version': m.version}, m.refs) for m in loaded])
+    yield ('model_registry_events_total', 'counter', 'Model activations, releases and failed loads',
+           [({'event': k}, model_registry.counters[k]) for k in ('activations', 'releases', 'load_failures')])
+
+REGISTRY.register_collector(component_metrics)
 
 # ============================================
 # ROUTES - DEFINED AFTER APP IS CREATED
@@ -91,26 +520,77 @@ def index():
         'status': 'online',
         'endpoints': {
             '/api/health': 'GET - Health check',
+            '/api/health/live': 'GET - Liveness probe',
+            '/api/health/ready': 'GET - Readiness probe (503 until the model is loaded)',
             '/api/predict': 'POST - Submit drawing',
+            '/api/predict/batch': 'POST - Submit many drawings at once',
             '/api/categories': 'GET - Get categories',
-            '/api/generate-image': 'POST - Generate image'
+            '/api/similar': 'POST - Training drawings most similar to a sketch',
+            '/api/stream/sessions': 'POST - Start a live prediction session (SSE)',
+            '/api/generate-image': 'POST - Generate image',
+            '/api/generate-image/jobs/<job_id>': 'GET - Poll an async image job',
+            '/api/models': 'GET - Available and loaded model versions',
+            '/api/admin/models/reload': 'POST - Load and swap in a model version (admin)',
+            '/metrics': 'GET - Prometheus metrics'
         }
     }), 200
 
-@app.route('/api/health', methods=['GET'])
-def health():
-    return jsonify({
+def health_status():
+    # Shared with asgi_app.py
+    return {
         'status': 'Server is running',
+        'ready': model_loader.ready,
         'model': 'Sketch Recognition Model',
+        'model_version': model_registry.active.version if model_registry.active is not None else None,
+        'backend': backend.name if backend is not None else None,
+        'cascade': backend.stats() if backend is not None and backend.name == 'cascade' else None,
         'categories': CATEGORIES,
         'num_categories': NUM_CLASSES,
         'test_accuracy': f"{test_accuracy*100:.2f}%",
+        'batching': batcher.stats() if batcher is not None else None,
+        'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None,
+        'image_generation': image_generator.stats(),
+        'worker_pool': inference_pool.stats() if inference_pool is not None else None,
+        'models': model_registry.stats(),
+        'admission': admission.stats() if admission is not None else None,
         'timestamp': datetime.now().isoformat()
-    }), 200
+    }
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    return jsonify(health_status()), 200
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    return jsonify({'status': 'alive', 'pid': os.getpid()}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    status = model_loader.status()
+    return jsonify(status), 200 if status['ready'] else 503
 
 @app.route('/api/categories', methods=['GET'])
 def get_categories():
-    return jsonify({'categories': CATEGORIES, 'count': NUM_CLASSES}), 200
+    not_ready = require_model()
+    if not_ready:
+        return not_ready
+
+    try:
+        with model_registry.acquire(requested_version()) as model:
+            categories, version = model.categories, model.version
+    except UnknownModelVersion as e:
+        return unknown_version(e)
+
+    # Static per model: clients cache it and revalidate with If-None-Match
+    etag = categories_etag(categories)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({'categories': categories, 'count': len(categories), 'model_version': version})
+    response.set_etag(etag)
+    response.headers['X-Model-Version'] = version
+    response.headers['Cache-Control'] = 'public, max-age=300, must-revalidate'
+    return response
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
@@ -119,35 +599,273 @@ def predict():
         if not data:
             return jsonify({'error': 'No data provided', 'success': False}), 400
         
-        canvas_data = data.get('canvas_data')
         description = data.get('description', '')
+
+        # Payload shaping: top_k, include_categories and the Accept header
+        try:
+            top_k = parse_top_k(data.get('top_k', request.args.get('top_k')))
+        except ValueError as e:
+            return jsonify({'error': str(e), 'success': False}), 400
+        include_categories = parse_bool(data.get('include_categories', request.args.get('include_categories')))
+        encoding = negotiate(request.accept_mimetypes)
+
+        not_ready = require_model()
+        if not_ready:
+            return not_ready
         
-        if not canvas_data:
-            return jsonify({'error': 'No canvas data', 'success': False}), 400
-        
-        if 'base64,' in canvas_data:
-            canvas_data = canvas_data.split('base64,')[1]
-        
-        image_data = base64.b64decode(canvas_data)
-        image = Image.open(BytesIO(image_data)).convert('L').resize((28, 28))
-        img_array = 255 - np.array(image)
-        
-        result = predict_drawing(img_array)
-        
-        return jsonify({
-            'success': True,
-            'prediction': result['prediction'],
-            'confidence': f"{result['confidence']:.1%}",
-            'confidence_value': result['confidence'],
-            'all_predictions': {k: f"{v:.1%}" for k, v in result['all_predictions'].items()},
-            'timestamp': datetime.now().isoformat(),
-            'categories': CATEGORIES
-        }), 200
+        # The whole request runs on one model version, even across a hot swap
+        with model_registry.acquire(requested_version(data)) as model:
+            # 'format' selects png (default), raw 28x28 bytes or strokes
+            is_png = data.get('format', 'png') == 'png' and data.get('canvas_data')
+            try:
+                if is_png:
+                    with metrics.stage('predict', 'base64'):
+                        png_bytes = base64.b64decode(strip_data_url(data['canvas_data']))
+                    # PNG canvases go straight to the worker pool, which decodes them too
+                    if model.pool is not None:
+                        with metrics.stage('predict', 'inference'):
+                            predictions = predict_png(png_bytes, model)
+                    else:
+                        img_array = decode_png_bytes(png_bytes, partial(metrics.stage, 'predict'))
+                else:
+                    with metrics.stage('predict', 'decode'):
+                        img_array = decode_input(data)
+            except ValueError as e:
+                return jsonify({'error': str(e), 'success': False}), 400
+
+            if not (is_png and model.pool is not None):
+                with metrics.stage('predict', 'inference'):
+                    predictions = predict_probabilities(img_array, model)
+            
+            with metrics.stage('predict', 'serialize'):
+                payload = {'success': True, **prediction_fields(predictions, model.categories, top_k),
+                           'model_version': model.version,
+                           'timestamp': datetime.now().isoformat()}
+                if top_k is not None:
+                    payload['top_k'] = top_k
+                if include_categories:
+                    payload['categories'] = model.categories
+                return encoded_response(payload, encoding, predictions, top_k, model=model)
     
+    except UnknownModelVersion as e:
+        return unknown_version(e)
+    except PoolSaturated as e:
+        return overloaded(str(e), 'pool_saturated', config.WORKER_SATURATED_RETRY_AFTER)
+    except ResultTimeout:
+        return jsonify({'error': 'Prediction timed out', 'success': False}), 504
+    except Exception as e:
+        log.exception(f"❌ Error: {str(e)}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch_endpoint():
+    not_ready = require_model()
+    if not_ready:
+        return not_ready
+
+    options = request.args
+    try:
+        top_k = parse_top_k(options.get('top_k'))
+        # Raw N x 784 uint8 body, or JSON with 'canvases' (base64 PNGs) or 'bitmaps'
+        if request.mimetype == 'application/octet-stream':
+            bitmaps = decode_bitmaps(request.get_data())
+        else:
+            data = request.get_json(silent=True)
+            if not data:
+                return jsonify({'error': 'No data provided', 'success': False}), 400
+            options = {**request.args.to_dict(), **data}
+            top_k = parse_top_k(options.get('top_k'))
+
+            if data.get('bitmaps') is not None:
+                bitmaps = decode_bitmaps(data['bitmaps'])
+            elif data.get('canvases'):
+                canvases = data['canvases']
+                if not isinstance(canvases, list):
+                    return jsonify({'error': 'canvases must be a list', 'success': False}), 400
+                if len(canvases) > config.BATCH_ENDPOINT_MAX_ITEMS:
+                    return jsonify({'error': f'At most {config.BATCH_ENDPOINT_MAX_ITEMS} drawings per batch', 'success': False}), 413
+                with metrics.stage('predict_batch', 'decode'):
+                    bitmaps = np.stack(list(decode_pool.map(decode_png, canvases)))
+            else:
+                return jsonify({'error': 'Provide canvases or bitmaps', 'success': False}), 400
+    except Exception as e:
+        return jsonify({'error': f'Invalid batch data: {str(e)}', 'success': False}), 400
+
+    if len(bitmaps) == 0:
+        return jsonify({'error': 'Empty batch', 'success': False}), 400
+    if len(bitmaps) > config.BATCH_ENDPOINT_MAX_ITEMS:
+        return jsonify({'error': f'At most {config.BATCH_ENDPOINT_MAX_ITEMS} drawings per batch', 'success': False}), 413
+
+    try:
+        with model_registry.acquire(requested_version(options)) as model:
+            with metrics.stage('predict_batch', 'inference'):
+                predictions = predict_many(bitmaps, model)
+            encoding = negotiate(request.accept_mimetypes)
+            with metrics.stage('predict_batch', 'serialize'):
+                if encoding == FLOAT16:
+                    return encoded_response(None, encoding, predictions, top_k, model=model)
+
+                results = [prediction_fields(row, model.categories, top_k) for row in predictions]
+                payload = {
+                    'success': True,
+                    'count': len(results),
+                    'results': results,
+                    'model_version': model.version,
+                    'timestamp': datetime.now().isoformat()
+                }
+                if top_k is not None:
+                    payload['top_k'] = top_k
+                if parse_bool(options.get('include_categories')):
+                    payload['categories'] = model.categories
+                return encoded_response(payload, encoding, model=model)
+
+    except UnknownModelVersion as e:
+        return unknown_version(e)
+    except PoolSaturated as e:
+        return overloaded(str(e), 'pool_saturated', config.WORKER_SATURATED_RETRY_AFTER)
+    except ResultTimeout:
+        return jsonify({'error': 'Prediction timed out', 'success': False}), 504
+    except Exception as e:
+        log.exception(f"❌ Error: {str(e)}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+# ============================================
+# SIMILAR SKETCHES (see similarity.py)
+# ============================================
+@app.route('/api/similar', methods=['POST'])
+def similar_sketches():
+    not_ready = require_model()
+    if not_ready:
+        return not_ready
+
+    data = request.json
+    if not data:
+        return jsonify({'error': 'No data provided', 'success': False}), 400
+    try:
+        k = int(data.get('k', request.args.get('k', config.SIMILAR_DEFAULT_K)))
+    except (TypeError, ValueError):
+        k = 0
+    if not 1 <= k <= config.SIMILAR_MAX_K:
+        return jsonify({'error': f'k must be between 1 and {config.SIMILAR_MAX_K}', 'success': False}), 400
+    category = data.get('category')
+    exact = parse_bool(data.get('exact'), default=False)
+    include_images = parse_bool(data.get('include_images'))
+
+    try:
+        with model_registry.acquire(requested_version(data)) as model:
+            index = model.similar
+            if index is None:
+                return jsonify({'error': f"No similarity index for model version {model.version} "
+                                         f"(python similarity.py --build)", 'success': False}), 404
+            if category is not None and category not in index.categories:
+                return jsonify({'error': f"Unknown category '{category}'", 'success': False}), 400
+            try:
+                with metrics.stage('similar', 'decode'):
+                    img_array = decode_input(data)
+            except ValueError as e:
+                return jsonify({'error': str(e), 'success': False}), 400
+
+            with metrics.stage('similar', 'embed'):
+                x = img_array.reshape(1, 28, 28, 1).astype('float32') / 255.0
+                embedding = embedder_for(model.backend).embed(x)
+            with metrics.stage('similar', 'search'):
+                indices, scores, searched_exact = index.search(embedding, k, category, config.SIMILAR_NPROBE,
+                                                               exact)
+            with metrics.stage('similar', 'serialize'):
+                return jsonify({
+                    'success': True,
+                    'results': index.hits(indices[0], scores[0], include_images),
+                    'exact': searched_exact,
+                    'model_version': model.version,
+                    'timestamp': datetime.now().isoformat()
+                }), 200
+
+    except UnknownModelVersion as e:
+        return unknown_version(e)
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        log.exception(f"❌ Error: {str(e)}")
         return jsonify({'error': str(e), 'success': False}), 500
 
+# ============================================
+# LIVE STREAMING (see streaming.py)
+# Stroke POSTs are parsed regardless of Content-Type so clients can send
+# text/plain and skip the CORS preflight on every delta.
+# ============================================
+def stream_prediction(raster, top_k):
+    # Each update uses whichever version is active at the time
+    with model_registry.acquire() as model:
+        predictions = predict_probabilities(raster, model)
+        return {
+            'top_k': [{'category': model.categories[i], 'confidence': float(predictions[i])}
+                      for i in top_k_indices(predictions, top_k)],
+            'model_version': model.version,
+            'timestamp': datetime.now().isoformat()
+        }
+
+@app.route('/api/stream/sessions', methods=['POST'])
+def create_stream_session():
+    not_ready = require_model()
+    if not_ready:
+        return not_ready
+
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        session = stream_sessions.create(
+            width=float(data.get('width', 280)),
+            height=float(data.get('height', 280)),
+            line_width=float(data.get('line_width', 1.8)),
+            top_k=int(data.get('top_k', 3)),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e), 'success': False}), 503
+
+    return jsonify({
+        'success': True,
+        'session_id': session.session_id,
+        'events_url': f"/api/stream/{session.session_id}/events",
+        'strokes_url': f"/api/stream/{session.session_id}/strokes"
+    }), 201
+
+@app.route('/api/stream/<session_id>/events', methods=['GET'])
+def stream_events(session_id):
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Session not found', 'success': False}), 404
+    # Leave serving threads for ordinary requests
+    if not stream_sessions.open_stream():
+        return jsonify({'error': 'Too many open live streams', 'success': False}), 503
+
+    stream = event_stream(session, stream_prediction,
+                          debounce=config.STREAM_DEBOUNCE_MS / 1000.0,
+                          keepalive=config.STREAM_KEEPALIVE_SECONDS)
+    response = Response(stream_with_context(stream), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(stream_sessions.close_stream)
+    return response
+
+@app.route('/api/stream/<session_id>/strokes', methods=['POST'])
+def stream_strokes(session_id):
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Session not found', 'success': False}), 404
+
+    data = request.get_json(force=True, silent=True)
+    if data is None:
+        return jsonify({'error': 'No data provided', 'success': False}), 400
+    try:
+        version = session.apply(data.get('strokes') or [], clear=bool(data.get('clear')))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    return jsonify({'success': True, 'version': version}), 200
+
+@app.route('/api/stream/<session_id>', methods=['DELETE'])
+def close_stream_session(session_id):
+    if not stream_sessions.close(session_id):
+        return jsonify({'error': 'Session not found', 'success': False}), 404
+    return jsonify({'success': True}), 200
+
 @app.route('/api/generate-image', methods=['POST'])
 def generate_image():
     try:
@@ -158,14 +876,22 @@ def generate_image():
         if not prediction:
             return jsonify({'error': 'No prediction', 'success': False}), 400
         
-        prompts = {
-            'realistic': f"photorealistic {prediction}, 4k, professional photography",
-            'artistic': f"artistic painting of {prediction}, vibrant colors",
-            'cartoon': f"cute cartoon {prediction}, colorful, child-friendly",
-            'sketch': f"pencil sketch of {prediction}, detailed shading"
-        }
-        
-        prompt = prompts.get(style, prompts['realistic'])
+        prompt = build_prompt(prediction, style)
+
+        # Fire-and-poll: return immediately, client polls the job URL
+        if data.get('async'):
+            job_id = image_generator.submit_job(prompt)
+            return jsonify({
+                'success': True,
+                'status': 'pending',
+                'job_id': job_id,
+                'status_url': f"/api/generate-image/jobs/{job_id}",
+                'prompt': prompt,
+                'prediction': prediction,
+                'style': style,
+                'method': 'pollinations'
+            }), 202
+
         image_url = generate_with_pollinations(prompt)
         
         return jsonify({
@@ -178,8 +904,114 @@ def generate_image():
         }), 200
     
     except Exception as e:
+        log.error(f"❌ Image generation error: {str(e)}")
         return jsonify({'error': str(e), 'success': False}), 500
 
+@app.route('/api/generate-image/jobs/<job_id>', methods=['GET'])
+def generate_image_job(job_id):
+    job = image_generator.job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found', 'success': False}), 404
+
+    return jsonify({
+        'success': job['status'] != 'failed',
+        'job_id': job_id,
+        'status': job['status'],
+        'image_url': job['image_url'],
+        'prompt': job['prompt'],
+        'error': job['error'],
+        'method': 'pollinations'
+    }), 200
+
+# ============================================
+# MODEL VERSIONS (see model_registry.py)
+# Admin endpoints need SKETCH_ADMIN_TOKEN, sent as X-Admin-Token
+# ============================================
+def require_admin():
+    if not config.ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled', 'success': False}), 404
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Invalid admin token', 'success': False}), 403
+    return None
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    return jsonify({'success': True, **model_registry.stats()}), 200
+
+def start_model_load(version, activate):
+    try:
+        pending = model_registry.reload_async(version, activate=activate)
+    except UnknownModelVersion as e:
+        return jsonify({'error': f"Unknown model version {e.args[0]}", 'success': False,
+                        'available': model_registry.available()}), 404
+    except RuntimeError as e:
+        return jsonify({'error': str(e), 'success': False}), 409
+    return jsonify({'success': True, 'status_url': '/api/models', **pending}), 202
+
+@app.route('/api/admin/models/reload', methods=['POST'])
+def reload_model():
+    # Load + warm in the background, then swap; defaults to CURRENT / newest
+    denied = require_admin()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    return start_model_load(data.get('version'), activate=True)
+
+@app.route('/api/admin/models/<version>', methods=['POST'])
+def load_model_version(version):
+    # Keep another version loaded next to the active one for A/B requests
+    denied = require_admin()
+    if denied:
+        return denied
+    return start_model_load(version, activate=False)
+
+@app.route('/api/admin/models/<version>', methods=['DELETE'])
+def unload_model_version(version):
+    denied = require_admin()
+    if denied:
+        return denied
+    try:
+        model_registry.unload(version)
+    except UnknownModelVersion:
+        return jsonify({'error': f"Model version {version} is not loaded", 'success': False}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 409
+    return jsonify({'success': True, 'version': version}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not config.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled', 'success': False}), 404
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/debug/profile', methods=['GET'])
+def profile_endpoint():
+    # Opt-in (SKETCH_PROFILING): 'stacks' samples every thread into collapsed
+    # stacks for a flame graph; 'cprofile' profiles requests for the window
+    if not config.PROFILING_ENABLED:
+        return jsonify({'error': 'Profiling is disabled', 'success': False}), 404
+    try:
+        seconds = min(float(request.args.get('seconds', 5)), config.PROFILING_MAX_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number', 'success': False}), 400
+    mode = request.args.get('mode', 'stacks')
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+        return jsonify({'error': 'sort must be cumulative, tottime, calls or ncalls', 'success': False}), 400
+
+    if mode == 'stacks':
+        stacks, samples = sample_stacks(seconds)
+        return Response(stacks, mimetype='text/plain', headers={'X-Samples': str(samples)})
+    if mode == 'cprofile':
+        try:
+            profile_session.start(seconds)
+        except RuntimeError as e:
+            return jsonify({'error': str(e), 'success': False}), 409
+        report, profiled = profile_session.report(sort=sort)
+        return Response(report, mimetype='text/plain', headers={'X-Profiled-Requests': str(profiled)})
+    return jsonify({'error': "mode must be 'stacks' or 'cprofile'", 'success': False}), 400
+
 # ============================================
 # RUN SERVER
 # ============================================
@@ -0,0 +1,337 @@
+# ============================================
+# ASGI ENTRY POINT (Starlette + uvicorn)
+# Same models, payloads and headers as app.py for
+#   /api/predict, /api/generate-image (+ /jobs/<id>), /api/health,
+#   /api/categories and /metrics
+# but on one event loop instead of one thread per request:
+#   - Pollinations calls are awaited (image_gen.AsyncImageGenerator), so a
+#     slow upstream holds a coroutine, not a thread and its stack
+#   - PNG decode and inference, the only blocking work, run on a bounded
+#     thread pool (SKETCH_ASYNC_CPU_WORKERS); NumPy, PIL and the backends
+#     release the GIL for the heavy parts
+# The model registry, loader, prediction cache and metrics are app.py's
+# own objects, so every SKETCH_* setting applies unchanged.
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+#   python bench_async.py                   # vs Flask under slow upstreams
+# ============================================
+import asyncio
+import base64
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as ResultTimeout
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+import app as core
+import config
+import metrics
+import request_log
+from canvas_decode import decode_input, decode_png_bytes, strip_data_url
+from image_gen import AsyncImageGenerator
+from metrics import REGISTRY, REQUEST_LATENCY, REQUESTS, STAGE_LATENCY
+from model_loader import ModelNotReady
+from model_registry import UnknownModelVersion
+from worker_pool import PoolSaturated
+from response_format import (FLOAT16, MSGPACK, categories_etag, encode_float16, encode_msgpack, negotiate,
+                             parse_bool, parse_top_k, prediction_fields)
+
+log = core.log
+cpu_executor = ThreadPoolExecutor(max_workers=config.ASYNC_CPU_WORKERS, thread_name_prefix='asgi-cpu')
+image_generator = AsyncImageGenerator(
+    base_url=config.POLLINATIONS_BASE_URL,
+    timeout=config.IMAGE_GEN_TIMEOUT,
+    max_concurrency=config.IMAGE_GEN_MAX_CONCURRENCY,
+    cache_ttl=config.IMAGE_GEN_CACHE_TTL_SECONDS,
+    upstream_histogram=STAGE_LATENCY.labels('generate_image', 'upstream'),
+)
+
+
+class BadInput(ValueError):
+    pass
+
+
+# ============================================
+# HELPERS
+# ============================================
+def run_cpu(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(cpu_executor, fn, *args)
+
+
+def json_response(payload, status=200, headers=None):
+    # Flask's JSON provider with jsonify's compact separators, so bodies match app.py
+    body = core.app.json.dumps(payload, separators=(',', ':')) + '\n'
+    return Response(body, status_code=status, headers=headers, media_type='application/json')
+
+
+def error(message, status, **extra):
+    return json_response({'error': message, 'success': False, **extra}, status)
+
+
+def requested_version(request, data=None):
+    return ((data or {}).get('model_version') or request.query_params.get('model_version')
+            or request.headers.get('x-model-version') or None)
+
+
+def result_timeout(request):
+    # There is no request context off the event loop for app.time_left() to
+    # read, so pass the wait explicitly: X-Request-Timeout-Ms, capped at
+    # WORKER_RESULT_TIMEOUT
+    try:
+        timeout_ms = float(request.headers.get('x-request-timeout-ms', 0))
+    except ValueError:
+        timeout_ms = 0
+    if timeout_ms > 0:
+        return min(config.WORKER_RESULT_TIMEOUT, timeout_ms / 1000.0)
+    return config.WORKER_RESULT_TIMEOUT
+
+
+def unknown_version(e):
+    return error(f"Model version {e.args[0]} is not loaded", 404,
+                 loaded_versions=[m.version for m in core.model_registry.loaded()])
+
+
+async def require_model():
+    if core.model_loader.ready:
+        return None
+    # Waiting for a lazy load is not CPU work: keep it off cpu_executor
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, core.model_loader.ensure_ready,
+                                                         config.READY_TIMEOUT)
+    except ModelNotReady as e:
+        return error(str(e), 503, ready=False)
+    return None
+
+
+def encoded_response(payload, encoding, predictions=None, top_k=None, status=200, version=None,
+                     categories=None):
+    if encoding == FLOAT16 and predictions is not None:
+        body, headers = encode_float16(predictions, top_k)
+        headers['X-Categories-ETag'] = f'"{categories_etag(categories)}"'
+        response = Response(body, status_code=status, media_type=FLOAT16, headers=headers)
+    elif encoding == MSGPACK:
+        response = Response(encode_msgpack(payload), status_code=status, media_type=MSGPACK)
+    else:
+        response = json_response(payload, status)
+    response.headers['Vary'] = 'Accept'
+    if version is not None:
+        response.headers['X-Model-Version'] = version
+    return response
+
+
+def instrumented(endpoint):
+    # Same request metrics and log lines as app.py's after_request hook
+    def wrap(handler):
+        async def timed(request):
+            started = time.perf_counter()
+            response = await handler(request)
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            status = str(response.status_code)
+            REQUEST_LATENCY.labels(endpoint, status).observe(elapsed_ms)
+            REQUESTS.labels(endpoint, status).inc()
+            request_log.request(endpoint, status, elapsed_ms, path=request.url.path)
+            return response
+        return timed
+    return wrap
+
+
+# ============================================
+# ROUTES
+# ============================================
+@instrumented('health')
+async def health(request):
+    return json_response({**core.health_status(), 'image_generation': image_generator.stats()})
+
+
+@instrumented('get_categories')
+async def get_categories(request):
+    not_ready = await require_model()
+    if not_ready:
+        return not_ready
+
+    try:
+        with core.model_registry.acquire(requested_version(request)) as model:
+            categories, version = model.categories, model.version
+    except UnknownModelVersion as e:
+        return unknown_version(e)
+
+    etag = categories_etag(categories)
+    headers = {'ETag': f'"{etag}"', 'X-Model-Version': version,
+               'Cache-Control': 'public, max-age=300, must-revalidate'}
+    if parse_etags(request.headers.get('if-none-match')).contains(etag):
+        return Response(status_code=304, headers=headers)
+    return json_response({'categories': categories, 'count': len(categories), 'model_version': version},
+                         headers=headers)
+
+
+def predict_sync(data, version, top_k, include_categories, timeout):
+    # Runs on cpu_executor: the same steps as app.predict
+    with core.model_registry.acquire(version) as model:
+        is_png = data.get('format', 'png') == 'png' and data.get('canvas_data')
+        try:
+            if is_png:
+                with metrics.stage('predict', 'base64'):
+                    png_bytes = base64.b64decode(strip_data_url(data['canvas_data']))
+                if model.pool is not None:
+                    with metrics.stage('predict', 'inference'):
+                        predictions = core.predict_png(png_bytes, model, timeout)
+                else:
+                    img_array = decode_png_bytes(png_bytes, partial(metrics.stage, 'predict'))
+            else:
+                with metrics.stage('predict', 'decode'):
+                    img_array = decode_input(data)
+        except ValueError as e:
+            raise BadInput(str(e))
+
+        if not (is_png and model.pool is not None):
+            with metrics.stage('predict', 'inference'):
+                predictions = core.predict_probabilities(img_array, model, timeout)
+
+        payload = {'success': True, **prediction_fields(predictions, model.categories, top_k),
+                   'model_version': model.version,
+                   'timestamp': datetime.now().isoformat()}
+        if top_k is not None:
+            payload['top_k'] = top_k
+        if include_categories:
+            payload['categories'] = model.categories
+        return payload, predictions, model.version, model.categories
+
+
+@instrumented('predict')
+async def predict(request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            return error('No data provided', 400)
+
+        try:
+            top_k = parse_top_k(data.get('top_k', request.query_params.get('top_k')))
+        except ValueError as e:
+            return error(str(e), 400)
+        include_categories = parse_bool(data.get('include_categories',
+                                                 request.query_params.get('include_categories')))
+        encoding = negotiate(parse_accept_header(request.headers.get('accept'), MIMEAccept))
+
+        not_ready = await require_model()
+        if not_ready:
+            return not_ready
+
+        payload, predictions, version, categories = await run_cpu(
+            predict_sync, data, requested_version(request, data), top_k, include_categories,
+            result_timeout(request))
+        with metrics.stage('predict', 'serialize'):
+            return encoded_response(payload, encoding, predictions, top_k, version=version,
+                                    categories=categories)
+
+    except BadInput as e:
+        return error(str(e), 400)
+    except UnknownModelVersion as e:
+        return unknown_version(e)
+    except PoolSaturated as e:
+        retry_after = config.WORKER_SATURATED_RETRY_AFTER
+        response = error(str(e), 503, reason='pool_saturated', retry_after=retry_after)
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    except ResultTimeout:
+        return error('Prediction timed out', 504)
+    except Exception as e:
+        log.exception(f"❌ Error: {str(e)}")
+        return error(str(e), 500)
+
+
+@instrumented('generate_image')
+async def generate_image(request):
+    try:
+        data = await request.json()
+        prediction = data.get('prediction', '')
+        style = data.get('style', 'realistic')
+
+        if not prediction:
+            return error('No prediction', 400)
+
+        prompt = core.build_prompt(prediction, style)
+
+        if data.get('async'):
+            job_id = image_generator.submit_job(prompt)
+            return json_response({
+                'success': True,
+                'status': 'pending',
+                'job_id': job_id,
+                'status_url': f"/api/generate-image/jobs/{job_id}",
+                'prompt': prompt,
+                'prediction': prediction,
+                'style': style,
+                'method': 'pollinations'
+            }, 202)
+
+        image_url = await image_generator.agenerate(prompt)
+
+        return json_response({
+            'success': True,
+            'image_url': image_url,
+            'prompt': prompt,
+            'prediction': prediction,
+            'style': style,
+            'method': 'pollinations'
+        })
+
+    except Exception as e:
+        log.error(f"❌ Image generation error: {str(e)}")
+        return error(str(e), 500)
+
+
+@instrumented('generate_image_job')
+async def generate_image_job(request):
+    job_id = request.path_params['job_id']
+    job = image_generator.job_status(job_id)
+    if job is None:
+        return error('Job not found', 404)
+
+    return json_response({
+        'success': job['status'] != 'failed',
+        'job_id': job_id,
+        'status': job['status'],
+        'image_url': job['image_url'],
+        'prompt': job['prompt'],
+        'error': job['error'],
+        'method': 'pollinations'
+    })
+
+
+async def metrics_endpoint(request):
+    if not config.METRICS_ENABLED:
+        return error('Metrics are disabled', 404)
+    return Response(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    print(f"✅ ASGI app serving with {config.ASYNC_CPU_WORKERS} CPU worker threads")
+    yield
+    await image_generator.aclose()
+    cpu_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/health', health, methods=['GET']),
+        Route('/api/categories', get_categories, methods=['GET']),
+        Route('/api/predict', predict, methods=['POST']),
+        Route('/api/generate-image', generate_image, methods=['POST']),
+        Route('/api/generate-image/jobs/{job_id}', generate_image_job, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
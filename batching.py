@@ -0,0 +1,105 @@
+# ============================================
+# DYNAMIC MICRO-BATCHING FOR MODEL INFERENCE
+# Concurrent /api/predict requests are gathered into a single forward
+# pass. A batch is flushed when it reaches max_batch_size or when the
+# oldest queued request has waited max_wait_ms, whichever comes first.
+# ============================================
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import Histogram, BATCH_SIZE_BUCKETS, LATENCY_MS_BUCKETS
+
+
+class MicroBatcher:
+    """Runs `predict_fn` on stacked inputs from many caller threads.
+
+    `predict_fn` takes an (N, ...) array and returns an (N, ...) array;
+    each caller of `submit()` gets back its own row.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5.0, name='predict-batcher'):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.batch_size_hist = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_hist = Histogram(LATENCY_MS_BUCKETS)
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, x, timeout=None):
+        future = self.submit_async(x)
+        return future.result(timeout=timeout)
+
+    def submit_async(self, x):
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((np.asarray(x), future, time.perf_counter()))
+        return future
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self._queue.qsize(),
+            'batch_size': self.batch_size_hist.snapshot(),
+            'queue_wait_ms': self.queue_wait_hist.snapshot(),
+        }
+
+    # --------------------------------------------
+    # Worker thread
+    # --------------------------------------------
+    def _collect(self, first):
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    # Past the deadline: still take whatever is already queued
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch = self._collect(first)
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.queue_wait_hist.observe((started - enqueued) * 1000.0)
+            self.batch_size_hist.observe(len(batch))
+
+            try:
+                outputs = self.predict_fn(np.stack([x for x, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for row, (_, future, _) in zip(outputs, batch):
+                future.set_result(row)
@@ -0,0 +1,93 @@
+# ============================================
+# FLASK VS ASGI CONCURRENCY BENCHMARK
+# Spawns app.py (Flask threaded server, or gunicorn) and asgi_app.py
+# (uvicorn) in turn against the same slow Pollinations stub and sweeps
+# closed-loop concurrency with a predict / generate-image mix. For each
+# server and level it reports throughput, latency percentiles, peak RSS
+# and peak thread count of the server process tree.
+# Both servers get the same settings: admission control off and an
+# upstream limit above the highest level, so the stack itself (threads
+# vs coroutines) is what is measured.
+#
+#   python bench_async.py --levels 16,64,256 --stub-delay-ms 500
+#   python bench_async.py --servers gunicorn,uvicorn --output bench/async.json
+# ============================================
+import argparse
+import json
+import os
+import time
+
+from bench_load import (HERE, ResourceMonitor, bitmap_to_canvas, load_bitmaps, run_load, spawn_server,
+                        start_stub)
+
+
+def sweep(kind, port, stub_url, env, canvases, levels, args):
+    proc, base_url = spawn_server(kind, port, stub_url, env)
+    rows = []
+    try:
+        with ResourceMonitor(proc.pid) as idle:
+            time.sleep(1.0)
+        for level in levels:
+            run_load(base_url, canvases, 0, level, args.warmup, args.generate_ratio, args.timeout, args.prompts)
+            with ResourceMonitor(proc.pid) as monitor:
+                endpoints, elapsed = run_load(base_url, canvases, 0, level, args.duration, args.generate_ratio,
+                                              args.timeout, args.prompts)
+            rows.append({'concurrency': level, 'elapsed_s': round(elapsed, 2), 'endpoints': endpoints,
+                         'server_resources': monitor.summary()})
+            summary = ', '.join(f"{name} {e['throughput_rps']} rps p99 {(e['latency_ms'] or {}).get('p99')}ms"
+                                f" ({e['errors']} errors)" for name, e in endpoints.items())
+            resources = rows[-1]['server_resources']
+            print(f"  {kind:8s} c={level:<4d} {summary}; rss {resources['rss_mb_max']} MB, "
+                  f"{resources['threads_max']} threads")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {'idle': idle.summary(), 'levels': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency and memory: Flask vs the ASGI entry point")
+    parser.add_argument('--servers', default='flask,uvicorn', help="comma list of flask, gunicorn, uvicorn")
+    parser.add_argument('--levels', default='16,64,256', help="concurrent clients")
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--generate-ratio', type=float, default=0.5)
+    parser.add_argument('--prompts', type=int, default=1000, help="distinct generate prompts (caching is off)")
+    parser.add_argument('--stub-delay-ms', type=float, default=500.0, help="simulated Pollinations latency")
+    parser.add_argument('--canvases', type=int, default=20, help="canvases per category")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--backend', default=os.environ.get('SKETCH_BACKEND', 'keras'))
+    parser.add_argument('--env', action='append', default=[], help="extra server env, KEY=VALUE")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    with open(os.path.join(HERE, 'categories.json')) as f:
+        categories = json.load(f)
+    canvases = [bitmap_to_canvas(b) for b in load_bitmaps(categories, args.canvases)]
+    levels = [int(level) for level in args.levels.split(',')]
+    env = {'SKETCH_BACKEND': args.backend, 'SKETCH_ADMISSION': '0', 'SKETCH_IMAGE_GEN_CACHE_TTL_SECONDS': '0',
+           'SKETCH_IMAGE_GEN_MAX_CONCURRENCY': str(max(levels) * 2)}
+    env.update(e.split('=', 1) for e in args.env)
+
+    stub, stub_url = start_stub(args.stub_delay_ms)
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'config': {k: getattr(args, k) for k in ('duration', 'generate_ratio', 'prompts', 'stub_delay_ms',
+                                                        'backend')},
+              'levels': levels, 'servers': {}}
+    try:
+        for kind in args.servers.split(','):
+            report['servers'][kind] = sweep(kind, args.port, stub_url, env, canvases, levels, args)
+    finally:
+        stub.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# ============================================
+# CASCADE / CENTROID BENCHMARK
+# Latency against accuracy for the classification modes in cascade.py:
+#   - full model, fast model and the cascade at several thresholds
+#   - the centroid index restricted to the first n categories, for growing n
+#   - output head + response cost per request for synthetic class counts
+#     up to all 345 QuickDraw categories (needs no data or trained model)
+#   python bench_cascade.py --output cascade_bench.json
+# ============================================
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from cascade import CascadeBackend, CentroidBackend, build_centroids
+from inference import NumpyBackend, load_backend
+from quickdraw_data import QuickDrawStream
+from export_model import evaluation_arrays
+from response_format import prediction_fields
+
+
+def timed(backend, x, single_runs):
+    # Accuracy over the whole set is measured batched; latency on single images
+    started = time.perf_counter()
+    predictions = np.concatenate([backend.predict(x[i:i + 256]) for i in range(0, len(x), 256)])
+    batched_ms = (time.perf_counter() - started) * 1000.0 / len(x)
+
+    single = []
+    for i in np.linspace(0, len(x) - 1, min(single_runs, len(x))).astype(int):
+        started = time.perf_counter()
+        backend.predict(x[i:i + 1])
+        single.append((time.perf_counter() - started) * 1000.0)
+    return predictions, {
+        'single_p50_ms': round(float(np.percentile(single, 50)), 3),
+        'single_p99_ms': round(float(np.percentile(single, 99)), 3),
+        'batched_ms_per_image': round(batched_ms, 4),
+    }
+
+
+def accuracy(predictions, labels):
+    return round(float((predictions.argmax(axis=1) == labels).mean()), 4)
+
+
+def bench_cascade(full, fast, x, y, thresholds, single_runs):
+    rows = []
+    for name, model in (('full', full), ('fast', fast)):
+        predictions, latency = timed(model, x, single_runs)
+        rows.append({'model': name, 'accuracy': accuracy(predictions, y), **latency})
+    for threshold in thresholds:
+        cascade = CascadeBackend(fast, full, threshold=threshold)
+        predictions, latency = timed(cascade, x, single_runs)
+        stats = cascade.stats()
+        rows.append({'model': 'cascade', 'threshold': threshold, 'accuracy': accuracy(predictions, y),
+                     'escalation_rate': round(stats['escalated'] / stats['images'], 4), **latency})
+    return rows
+
+
+def bench_centroids(index, full, x, y, counts, single_runs):
+    rows = []
+    for count in counts:
+        mask = y < count
+        xs, ys = x[mask], y[mask]
+        predictions, latency = timed(index.subset(count), xs, single_runs)
+        # The softmax model restricted to the same classes, for reference
+        full_predictions = np.concatenate([full.predict(xs[i:i + 256])[:, :count] for i in range(0, len(xs), 256)])
+        rows.append({'categories': count, 'centroid_accuracy': accuracy(predictions, ys),
+                     'softmax_accuracy_same_classes': accuracy(full_predictions, ys), **latency})
+    return rows
+
+
+def bench_head_scaling(counts, embedding_dim, top_k, runs):
+    """Per-request cost of the part that grows with the class count."""
+    rng = np.random.default_rng(0)
+    embedding = rng.standard_normal((1, embedding_dim)).astype(np.float32)
+    rows = []
+    for count in counts:
+        categories = [f'category_{i}' for i in range(count)]
+        kernel = rng.standard_normal((embedding_dim, count)).astype(np.float32) * 0.05
+        centroids = rng.standard_normal((count, embedding_dim)).astype(np.float32)
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+        def softmax(logits):
+            logits = logits - logits.max(axis=1, keepdims=True)
+            np.exp(logits, out=logits)
+            return logits / logits.sum(axis=1, keepdims=True)
+
+        def dense_all():
+            probs = softmax(embedding @ kernel)[0]
+            return json.dumps(prediction_fields(probs, categories, None))
+
+        def dense_top_k():
+            probs = softmax(embedding @ kernel)[0]
+            return json.dumps(prediction_fields(probs, categories, top_k))
+
+        def centroid_top_k():
+            e = embedding / np.linalg.norm(embedding)
+            probs = softmax((e @ centroids.T) / 0.05)[0]
+            return json.dumps(prediction_fields(probs, categories, top_k))
+
+        row = {'categories': count}
+        for name, fn in (('dense_all_classes', dense_all), ('dense_top_k', dense_top_k),
+                         ('centroid_top_k', centroid_top_k)):
+            fn()
+            started = time.perf_counter()
+            for _ in range(runs):
+                body = fn()
+            row[f'{name}_us'] = round((time.perf_counter() - started) * 1e6 / runs, 2)
+            row[f'{name}_bytes'] = len(body)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency vs accuracy for the cascade and centroid modes")
+    parser.add_argument('--backend', default='numpy', help="full model backend (keras or numpy)")
+    parser.add_argument('--model', default='sketch_model.h5')
+    parser.add_argument('--weights', default='sketch_model.npz')
+    parser.add_argument('--fast-weights', default='sketch_model_fast.npz')
+    parser.add_argument('--centroids', default='sketch_centroids.npz',
+                        help="existing index; built from the training split when missing")
+    parser.add_argument('--samples', type=int, default=500, help="validation drawings per category")
+    parser.add_argument('--thresholds', default='0.5,0.7,0.8,0.9,0.95,0.99')
+    parser.add_argument('--single-runs', type=int, default=200)
+    parser.add_argument('--head-counts', default='19,50,100,200,345')
+    parser.add_argument('--head-runs', type=int, default=2000)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = {'head_scaling': bench_head_scaling([int(c) for c in args.head_counts.split(',')],
+                                                 512, args.top_k, args.head_runs)}
+
+    with open('categories.json') as f:
+        categories = json.load(f)
+    try:
+        stream = QuickDrawStream(categories, validation_samples_per_category=args.samples)
+        x, y = evaluation_arrays(stream)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  QuickDraw data unavailable ({e}); skipping accuracy benchmarks", file=sys.stderr)
+        x = None
+
+    if x is not None:
+        full = load_backend(args.backend, args.model, args.weights)
+        if os.path.exists(args.fast_weights):
+            report['cascade'] = bench_cascade(full, NumpyBackend(args.fast_weights), x, y,
+                                              [float(t) for t in args.thresholds.split(',')], args.single_runs)
+        else:
+            print(f"⚠️  {args.fast_weights} not found (python cascade.py --train-fast); skipping cascade",
+                  file=sys.stderr)
+
+        index = None
+        if os.path.exists(args.centroids):
+            index = CentroidBackend.load(args.centroids, full)
+            if index.categories[:len(categories)] != categories:
+                index = None  # labels below follow categories.json order
+        if index is None:
+            index = build_centroids(full, categories)
+        counts = sorted({c for c in (2, 4, 8, 16, 32, 64, 128, 256) if c < len(categories)} | {len(categories)})
+        report['centroid'] = bench_centroids(index, full, x, y, counts, args.single_runs)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
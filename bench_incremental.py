@@ -0,0 +1,101 @@
+# ============================================
+# INCREMENTAL VS FULL RETRAIN BENCHMARK
+# Adds categories to sketch_model.h5 both ways and reports wall time and
+# accuracy (overall, old classes, new classes) on the same held-out rows:
+#   incremental - incremental.py per --freeze mode
+#   full        - same architecture, fresh weights, every class, trained
+#                 the way train_modek.py does (early stopping, LR decay)
+#   python bench_incremental.py giraffe zebra --output incremental_bench.json
+#   python bench_incremental.py giraffe --freeze all,conv --full-epochs 5
+# ============================================
+import argparse
+import json
+import time
+
+from downloader import download_categories
+from incremental import FREEZE_MODES, evaluate, evaluation_stream, fraction, merge_categories, train_incremental
+from quickdraw_data import QuickDrawStream
+
+
+def full_retrain(template, categories, epochs, batch_size, validation_samples):
+    from tensorflow import keras
+
+    # clone_model rebuilds the architecture with freshly initialized weights
+    model = keras.models.clone_model(template)
+    for layer in model.layers:
+        layer.trainable = True
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    stream = QuickDrawStream(categories, batch_size=batch_size,
+                             validation_samples_per_category=validation_samples)
+    started = time.perf_counter()
+    history = model.fit(
+        stream.train_dataset(),
+        steps_per_epoch=stream.steps_per_epoch,
+        epochs=epochs,
+        validation_data=stream.validation_dataset(),
+        validation_steps=stream.validation_steps,
+        callbacks=[keras.callbacks.EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True),
+                   keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=2)],
+        verbose=1,
+    )
+    return model, {'epochs_run': len(history.history['loss']), 'steps_per_epoch': stream.steps_per_epoch,
+                   'train_seconds': round(time.perf_counter() - started, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wall time and accuracy: incremental vs full retraining")
+    parser.add_argument('categories', nargs='+', help="categories to add")
+    parser.add_argument('--model', default='sketch_model.h5')
+    parser.add_argument('--old-categories', default='categories.json')
+    parser.add_argument('--freeze', default='conv,all', help=f"comma list of {', '.join(FREEZE_MODES)}")
+    parser.add_argument('--epochs', type=int, default=3, help="incremental epochs")
+    parser.add_argument('--full-epochs', type=int, default=20, help="as in train_modek.py")
+    parser.add_argument('--skip-full', action='store_true')
+    parser.add_argument('--replay-samples', type=int, default=500)
+    parser.add_argument('--replay-fraction', type=fraction, default=0.3)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--validation-samples', type=int, default=2000)
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    from tensorflow import keras
+
+    with open(args.old_categories) as f:
+        old_categories = json.load(f)
+    categories = merge_categories(old_categories, args.categories)
+    download_categories(categories)
+    evaluation = evaluation_stream(categories, args.validation_samples)
+
+    base = keras.models.load_model(args.model, compile=False)
+    report = {'old_categories': len(old_categories), 'new_categories': categories[len(old_categories):],
+              'evaluation_samples': evaluation.val_samples, 'incremental': []}
+    for freeze in args.freeze.split(','):
+        # Each run starts from an untouched copy of the trained model
+        model = keras.models.load_model(args.model, compile=False)
+        _, _, row = train_incremental(model, old_categories, args.categories, args.epochs, freeze,
+                                      args.replay_samples, args.replay_fraction, batch_size=args.batch_size,
+                                      validation_samples=args.validation_samples)
+        report['incremental'].append(row)
+        print(f"  incremental ({freeze}): {row['train_seconds']}s, accuracy {row['accuracy']}")
+
+    if not args.skip_full:
+        template = keras.Sequential(base.layers[:-1] + [keras.layers.Dense(len(categories), activation='softmax')])
+        template.build((None, 28, 28, 1))
+        model, row = full_retrain(template, categories, args.full_epochs, args.batch_size,
+                                  args.validation_samples)
+        row.update(evaluate(model, evaluation, len(old_categories)))
+        report['full'] = row
+        print(f"  full retrain: {row['train_seconds']}s, accuracy {row['accuracy']}")
+        for inc in report['incremental']:
+            inc['speedup_vs_full'] = round(row['train_seconds'] / max(inc['train_seconds'], 1e-9), 1)
+            inc['accuracy_delta_vs_full'] = round(inc['accuracy'] - row['accuracy'], 4)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+# ============================================
+# END-TO-END LOAD TEST AND LATENCY BENCHMARK
+# Replays realistic canvases (QuickDraw bitmaps from the bundled
+# <category>.npy files, upscaled to 280x280 PNGs like the browser sends)
+# against /api/predict and /api/generate-image, with the Pollinations
+# upstream replaced by a local stub.
+#
+#   # spawn app.py under Flask's threaded server, 200 req/s for 30s
+#   python bench_load.py --spawn flask --rate 200 --concurrency 32 --duration 30 \
+#       --output bench/flask.json
+#   # same under gunicorn
+#   python bench_load.py --spawn gunicorn --rate 200 --output bench/gunicorn.json
+#   # same against the ASGI entry point (asgi_app.py)
+#   python bench_load.py --spawn uvicorn --rate 200 --output bench/uvicorn.json
+#   # against an already running server (start it with
+#   # SKETCH_IMAGE_GEN_CACHE_TTL_SECONDS=0 so image calls are not cache hits)
+#   python bench_load.py --url http://localhost:5000
+#   # compare two runs (exit code 1 on a p99 regression above 10%)
+#   python bench_load.py --compare bench/before.json bench/after.json
+#
+# Latency is measured from each request's scheduled send time, so queueing
+# inside the client under an open-loop rate is not hidden.
+# ============================================
+import argparse
+import base64
+import http.server
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+import requests
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ============================================
+# WORKLOAD
+# ============================================
+def load_bitmaps(categories, per_category, seed=0):
+    rng = np.random.default_rng(seed)
+    bitmaps = []
+    for category in categories:
+        try:
+            data = np.load(os.path.join(HERE, f'{category}.npy'), mmap_mode='r')
+            if data.ndim != 2 or data.shape[1] != 784:
+                raise ValueError
+        except (OSError, ValueError):
+            continue  # missing or a Git LFS pointer
+        rows = rng.choice(len(data), size=min(per_category, len(data)), replace=False)
+        bitmaps.append(np.asarray(data[np.sort(rows)]).reshape(-1, 28, 28))
+    if bitmaps:
+        return np.concatenate(bitmaps)
+
+    # No real data on disk: random closed strokes so the decode path still works
+    from canvas_decode import rasterize_strokes
+    print("⚠️  No QuickDraw .npy data found, using synthetic strokes", file=sys.stderr)
+    out = []
+    for _ in range(per_category * max(1, len(categories))):
+        t = np.linspace(0, 2 * np.pi, 24)
+        r = 80 + 40 * rng.random(24)
+        out.append(rasterize_strokes([[list(128 + r * np.cos(t)), list(128 + r * np.sin(t))]]))
+    return np.stack(out)
+
+
+def bitmap_to_canvas(bitmap, size=280):
+    # Black ink on white, upscaled: what canvas.toDataURL('image/png') sends
+    image = Image.fromarray(255 - np.asarray(bitmap, dtype=np.uint8)).resize((size, size), Image.BILINEAR)
+    buf = BytesIO()
+    image.save(buf, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+# ============================================
+# POLLINATIONS STUB
+# ============================================
+def start_stub(delay_ms):
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay_ms / 1000.0)
+            body = b'\x89PNG\r\n\x1a\n'
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+# ============================================
+# SERVER UNDER TEST
+# ============================================
+def spawn_server(kind, port, stub_url, extra_env):
+    # The image cache is off so /api/generate-image reaches the stub on
+    # every call instead of replaying the same `prompts` answers; gunicorn
+    # picks preload and startup mode from SKETCH_BACKEND (see gunicorn.conf.py)
+    env = dict(os.environ, SKETCH_POLLINATIONS_URL=stub_url, PORT=str(port),
+               **{'SKETCH_IMAGE_GEN_CACHE_TTL_SECONDS': '0', **extra_env})
+    if kind == 'flask':
+        code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+        cmd = [sys.executable, '-c', code]
+    elif kind == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app']
+    elif kind == 'uvicorn':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(port),
+               '--log-level', 'warning']
+    else:
+        raise ValueError(f"Unknown server kind {kind!r}")
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{kind} server exited with code {proc.returncode}")
+        try:
+            if requests.get(base_url + '/api/categories', timeout=2).status_code == 200:
+                return proc, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not become ready")
+
+
+def process_tree(pid):
+    pids, frontier = [pid], [pid]
+    while frontier:
+        parent = frontier.pop()
+        try:
+            with open(f'/proc/{parent}/task/{parent}/children') as f:
+                children = [int(c) for c in f.read().split()]
+        except OSError:
+            children = []
+        pids.extend(children)
+        frontier.extend(children)
+    return pids
+
+
+def sample_usage(pid):
+    """(cpu seconds, rss bytes, threads) summed over a process and its children, from /proc."""
+    cpu, rss, threads = 0.0, 0, 0
+    ticks = os.sysconf('SC_CLK_TCK')
+    page = os.sysconf('SC_PAGE_SIZE')
+    for p in process_tree(pid):
+        try:
+            with open(f'/proc/{p}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            rss += int(fields[21]) * page
+            threads += int(fields[17])
+        except (OSError, IndexError, ValueError):
+            pass
+    return cpu, rss, threads
+
+
+class ResourceMonitor:
+    def __init__(self, pid, interval=0.5):
+        self.pid, self.interval = pid, interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append((time.perf_counter(),) + sample_usage(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.samples.append((time.perf_counter(),) + sample_usage(self.pid))
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, cpu0, _, _), (t1, cpu1, _, _) = self.samples[0], self.samples[-1]
+        rss = [s[2] for s in self.samples]
+        return {'cpu_percent': round(100.0 * (cpu1 - cpu0) / max(t1 - t0, 1e-9), 1),
+                'rss_mb_max': round(max(rss) / 2 ** 20, 1),
+                'rss_mb_mean': round(sum(rss) / len(rss) / 2 ** 20, 1),
+                'threads_max': max(s[3] for s in self.samples)}
+
+
+# ============================================
+# LOAD GENERATION
+# ============================================
+def percentiles(values):
+    if not values:
+        return None
+    arr = np.asarray(values)
+    return {'p50': round(float(np.percentile(arr, 50)), 2), 'p95': round(float(np.percentile(arr, 95)), 2),
+            'p99': round(float(np.percentile(arr, 99)), 2), 'max': round(float(arr.max()), 2),
+            'mean': round(float(arr.mean()), 2)}
+
+
+def run_load(base_url, canvases, rate, concurrency, duration, generate_ratio, timeout, prompts=50):
+    tickets = queue.Queue(maxsize=concurrency * 4 if rate <= 0 else 0)
+    results = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    rng = np.random.default_rng(1)
+
+    def worker():
+        session = requests.Session()
+        while True:
+            ticket = tickets.get()
+            if ticket is None:
+                return
+            scheduled, endpoint, i = ticket
+            if endpoint == 'predict':
+                url, body = '/api/predict', {'canvas_data': canvases[i % len(canvases)]}
+            else:
+                url, body = '/api/generate-image', {'prediction': f'thing{i % prompts}', 'style': 'cartoon'}
+            try:
+                response = session.post(base_url + url, json=body, timeout=timeout)
+                status = response.status_code
+            except requests.RequestException:
+                status = 0
+            done = time.perf_counter()
+            with lock:
+                results.append((endpoint, status, (done - scheduled) * 1000.0, done))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+
+    started = time.perf_counter()
+    i = 0
+    while not stop.is_set():
+        now = time.perf_counter()
+        if now - started >= duration:
+            break
+        endpoint = 'generate' if rng.random() < generate_ratio else 'predict'
+        if rate > 0:
+            # Open loop: requests are due at fixed times whether or not the server keeps up
+            scheduled = started + i / rate
+            if scheduled > now:
+                time.sleep(scheduled - now)
+            tickets.put((scheduled, endpoint, i))
+        else:
+            tickets.put((time.perf_counter(), endpoint, i))  # closed loop, bounded queue
+        i += 1
+
+    for _ in threads:
+        tickets.put(None)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for endpoint in ('predict', 'generate'):
+        rows = [r for r in results if r[0] == endpoint]
+        if not rows:
+            continue
+        ok = [r[2] for r in rows if 200 <= r[1] < 300]
+        report[endpoint] = {
+            'requests': len(rows),
+            'ok': len(ok),
+            'errors': len(rows) - len(ok),
+            'status_counts': {str(s): sum(1 for r in rows if r[1] == s) for s in sorted({r[1] for r in rows})},
+            'throughput_rps': round(len(ok) / elapsed, 2),
+            'latency_ms': percentiles(ok),
+        }
+    return report, elapsed
+
+
+# ============================================
+# PER-STAGE BREAKDOWN (in-process, same canvases)
+# ============================================
+def stage_breakdown(canvases, backend_kind, runs):
+    import config
+    from canvas_decode import strip_data_url
+    from inference import load_backend
+
+    backend = load_backend(backend_kind, config.MODEL_PATH, config.NUMPY_WEIGHTS_PATH, config.TFLITE_PATH)
+    with open(os.path.join(HERE, 'categories.json')) as f:
+        categories = json.load(f)
+
+    stages = {'base64_decode': [], 'pil_resize': [], 'inference': [], 'json_encode': []}
+    for i in range(runs):
+        canvas = canvases[i % len(canvases)]
+        t0 = time.perf_counter()
+        raw = base64.b64decode(strip_data_url(canvas))
+        t1 = time.perf_counter()
+        bitmap = 255 - np.array(Image.open(BytesIO(raw)).convert('L').resize((28, 28)))
+        t2 = time.perf_counter()
+        probs = backend.predict(bitmap.reshape(1, 28, 28, 1).astype('float32') / 255.0)[0]
+        t3 = time.perf_counter()
+        json.dumps({'success': True, 'prediction': categories[int(np.argmax(probs))],
+                    'all_predictions': {c: f"{float(p):.1%}" for c, p in zip(categories, probs)},
+                    'categories': categories})
+        t4 = time.perf_counter()
+        for name, (a, b) in zip(stages, ((t0, t1), (t1, t2), (t2, t3), (t3, t4))):
+            stages[name].append((b - a) * 1000.0)
+    return {name: percentiles(values) for name, values in stages.items()}
+
+
+# ============================================
+# COMPARISON
+# ============================================
+def compare(before_path, after_path, threshold):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    regressed = False
+    print(f"{'endpoint':<10} {'metric':<15} {'before':>10} {'after':>10} {'change':>8}")
+    for endpoint in sorted(set(before['endpoints']) & set(after['endpoints'])):
+        b, a = before['endpoints'][endpoint], after['endpoints'][endpoint]
+        rows = [('throughput_rps', b['throughput_rps'], a['throughput_rps'], False)]
+        for p in ('p50', 'p95', 'p99'):
+            if b['latency_ms'] and a['latency_ms']:
+                rows.append((f'{p}_ms', b['latency_ms'][p], a['latency_ms'][p], True))
+        for metric, old, new, lower_is_better in rows:
+            change = (new - old) / old if old else 0.0
+            worse = change > threshold if lower_is_better else change < -threshold
+            if metric == 'p99_ms' and worse:
+                regressed = True
+            print(f"{endpoint:<10} {metric:<15} {old:>10.2f} {new:>10.2f} {change:>+7.1%}{'  ⚠️' if worse else ''}")
+    return 1 if regressed else 0
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/predict and /api/generate-image")
+    parser.add_argument('--url', help="benchmark an already running server")
+    parser.add_argument('--spawn', choices=['flask', 'gunicorn', 'uvicorn'], default='flask')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--rate', type=float, default=50.0, help="requests/s (0 = closed loop)")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--generate-ratio', type=float, default=0.1, help="share of /api/generate-image calls")
+    parser.add_argument('--stub-delay-ms', type=float, default=200.0, help="simulated Pollinations latency")
+    parser.add_argument('--canvases', type=int, default=50, help="canvases per category")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--stages', type=int, default=200, help="per-stage breakdown runs (0 to skip)")
+    parser.add_argument('--backend', default=os.environ.get('SKETCH_BACKEND', 'keras'))
+    parser.add_argument('--env', action='append', default=[], help="extra server env, KEY=VALUE")
+    parser.add_argument('--output')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    with open(os.path.join(HERE, 'categories.json')) as f:
+        categories = json.load(f)
+    canvases = [bitmap_to_canvas(b) for b in load_bitmaps(categories, args.canvases)]
+    stub, stub_url = start_stub(args.stub_delay_ms)
+
+    proc = None
+    if args.url:
+        base_url, server_kind = args.url.rstrip('/'), 'external'
+    else:
+        extra_env = dict(e.split('=', 1) for e in args.env)
+        extra_env.setdefault('SKETCH_BACKEND', args.backend)
+        proc, base_url = spawn_server(args.spawn, args.port, stub_url, extra_env)
+        server_kind = args.spawn
+
+    try:
+        if args.warmup > 0:
+            run_load(base_url, canvases, args.rate, args.concurrency, args.warmup, args.generate_ratio, args.timeout)
+        if proc is not None:
+            with ResourceMonitor(proc.pid) as monitor:
+                endpoints, elapsed = run_load(base_url, canvases, args.rate, args.concurrency, args.duration,
+                                              args.generate_ratio, args.timeout)
+            resources = monitor.summary()
+        else:
+            endpoints, elapsed = run_load(base_url, canvases, args.rate, args.concurrency, args.duration,
+                                          args.generate_ratio, args.timeout)
+            resources = None
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        stub.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'server': server_kind,
+        'config': {k: getattr(args, k) for k in ('rate', 'concurrency', 'duration', 'generate_ratio',
+                                                  'stub_delay_ms', 'backend')},
+        'elapsed_s': round(elapsed, 2),
+        'endpoints': endpoints,
+        'server_resources': resources,
+        'stages_ms': stage_breakdown(canvases, args.backend, args.stages) if args.stages else None,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
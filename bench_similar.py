@@ -0,0 +1,125 @@
+# ============================================
+# SIMILAR-SKETCH SEARCH BENCHMARK
+# Single-query latency of exact (brute-force) and IVF search over float16
+# memmaps of 10k, 100k and 1M clustered synthetic vectors, plus IVF
+# recall@k against the exact answer. --index also times a real index
+# built with `python similarity.py --build`.
+#   python bench_similar.py --output similar_bench.json
+#   python bench_similar.py --sizes 10000,100000 --dim 512 --nprobe 4,8,16
+# ============================================
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from similarity import IndexWriter, SimilarityIndex, build_ivf
+
+
+def synthetic_index(path, count, dim, clusters, seed=0, chunk=65536):
+    # Gaussian blobs around random directions, like embeddings of many classes
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    writer = IndexWriter(path, dim, count, ['synthetic'])
+    for start in range(0, count, chunk):
+        n = min(chunk, count - start)
+        x = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+        writer.append(x, 0, np.arange(start, start + n))
+    writer.close()
+    return SimilarityIndex(path)
+
+
+def latency(fn, queries):
+    fn(queries[0])
+    times = []
+    for query in queries:
+        started = time.perf_counter()
+        fn(query)
+        times.append((time.perf_counter() - started) * 1000.0)
+    return {'p50_ms': round(float(np.percentile(times, 50)), 3),
+            'p99_ms': round(float(np.percentile(times, 99)), 3)}
+
+
+def bench_index(index, queries, k, nprobes, nlist, exact_queries=20):
+    row = {'vectors': index.count, 'dim': index.dim, 'disk_mb': round(index.embeddings.nbytes / 1e6, 1)}
+    # Exact search is slow at 1M rows: time a few queries, batch the ground truth
+    row['exact'] = latency(lambda q: index.search(q, k, exact=True), queries[:exact_queries])
+    truth = [set(idx) for idx in index.search(queries, k, exact=True)[0]]
+
+    if index.ivf is None:
+        started = time.perf_counter()
+        row['ivf_lists'] = build_ivf(index, nlist)
+        row['ivf_build_s'] = round(time.perf_counter() - started, 2)
+    else:
+        row['ivf_lists'] = len(index.ivf[0])
+    row['ivf'] = []
+    for nprobe in nprobes:
+        found = [set(index.search(q, k, nprobe=nprobe)[0][0]) for q in queries]
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        row['ivf'].append({'nprobe': nprobe, f'recall@{k}': round(float(recall), 4),
+                           **latency(lambda q: index.search(q, k, nprobe=nprobe), queries)})
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and recall of the /api/similar search")
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--dim', type=int, default=512, help="embedding size (the CNN's Dense(512))")
+    parser.add_argument('--clusters', type=int, default=345)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--exact-queries', type=int, default=20, help="queries timed with exact search")
+    parser.add_argument('--k', type=int, default=12)
+    parser.add_argument('--nprobe', default='4,8,16')
+    parser.add_argument('--nlist', type=int, help="IVF lists (default 4 * sqrt(N))")
+    parser.add_argument('--index', help="also benchmark this index directory")
+    parser.add_argument('--workdir', help="where synthetic memmaps go (default: a temp dir)")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    nprobes = [int(n) for n in args.nprobe.split(',')]
+    rng = np.random.default_rng(1)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_similar_')
+    report = {'synthetic': []}
+    try:
+        for size in (int(s) for s in args.sizes.split(',')):
+            started = time.perf_counter()
+            index = synthetic_index(os.path.join(workdir, f'index_{size}'), size, args.dim, args.clusters)
+            write_s = time.perf_counter() - started
+            # Queries are noisy copies of indexed vectors
+            rows = rng.integers(0, size, args.queries)
+            queries = np.asarray(index.embeddings[np.sort(rows)], dtype=np.float32)
+            queries += 0.02 * rng.standard_normal(queries.shape).astype(np.float32)
+            row = bench_index(index, queries, args.k, nprobes, args.nlist, args.exact_queries)
+            row['write_s'] = round(write_s, 2)
+            report['synthetic'].append(row)
+            print(f"  {size}: exact p50 {row['exact']['p50_ms']}ms, "
+                  f"ivf nprobe={nprobes[0]} p50 {row['ivf'][0]['p50_ms']}ms")
+            del index
+            shutil.rmtree(os.path.join(workdir, f'index_{size}'), ignore_errors=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.index:
+        index = SimilarityIndex(args.index)
+        rows = rng.integers(0, index.count, args.queries)
+        queries = np.asarray(index.embeddings[np.sort(rows)], dtype=np.float32)
+        if index.ivf is not None:
+            report['index'] = bench_index(index, queries, args.k, nprobes, args.nlist, args.exact_queries)
+        else:
+            # Never writes an ivf.npz into a real index
+            report['index'] = {'vectors': index.count,
+                               'exact': latency(lambda q: index.search(q, args.k, exact=True), queries)}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
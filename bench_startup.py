@@ -0,0 +1,116 @@
+# ============================================
+# STARTUP-TIME BENCHMARK
+# Measures every import and load phase of app.py in fresh interpreters so
+# each number is a cold start, and reports them as JSON:
+#   python bench_startup.py --runs 5 --output startup.json
+# ============================================
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import textwrap
+
+IMPORT_PROBE = textwrap.dedent('''
+    import json, sys, time
+    started = time.perf_counter()
+    try:
+        __import__(sys.argv[1])
+        ok = True
+    except Exception:
+        ok = False
+    print(json.dumps({'ms': (time.perf_counter() - started) * 1000.0, 'ok': ok}))
+''')
+
+APP_PROBE = textwrap.dedent('''
+    import json, time
+    started = time.perf_counter()
+    import app
+    imported = (time.perf_counter() - started) * 1000.0
+    client = app.app.test_client()
+    live = client.get('/api/health/live').status_code
+    live_ms = (time.perf_counter() - started) * 1000.0
+    # /api/categories needs the model, so it also triggers a lazy load
+    while client.get('/api/categories').status_code != 200:
+        if app.model_loader.state == 'failed' or time.perf_counter() - started > 300:
+            break
+        time.sleep(0.005)
+    ready_ms = (time.perf_counter() - started) * 1000.0
+    print(json.dumps({
+        'import_app_ms': imported,
+        'first_live_ms': live_ms if live == 200 else None,
+        'ready_ms': ready_ms if app.model_loader.ready else None,
+        'phases_ms': app.startup.phases,
+    }))
+''')
+
+MODULES = ['numpy', 'PIL.Image', 'flask', 'flask_cors', 'requests', 'tensorflow']
+
+
+def run_probe(code, args=(), env=None):
+    result = subprocess.run([sys.executable, '-c', code, *args], capture_output=True, text=True,
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        return None
+    return json.loads(lines[-1])
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {'median': round(statistics.median(values), 2), 'min': round(min(values), 2),
+            'max': round(max(values), 2), 'runs': len(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for app.py")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--modes', default='eager,background,lazy')
+    parser.add_argument('--backends', default='keras,numpy')
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = {'python': sys.version.split()[0], 'imports': {}, 'app': {}}
+
+    for module in MODULES:
+        samples = [run_probe(IMPORT_PROBE, [module]) for _ in range(args.runs)]
+        if not all(s and s['ok'] for s in samples):
+            report['imports'][module] = None
+            continue
+        report['imports'][module] = summarize([s['ms'] for s in samples])
+        print(f"import {module:<12} {report['imports'][module]['median']:>9.1f} ms", file=sys.stderr)
+
+    for backend in args.backends.split(','):
+        for mode in args.modes.split(','):
+            env = dict(os.environ, SKETCH_BACKEND=backend, SKETCH_STARTUP=mode)
+            samples = [s for s in (run_probe(APP_PROBE, env=env) for _ in range(args.runs)) if s]
+            key = f'{backend}/{mode}'
+            if not samples:
+                report['app'][key] = None
+                print(f"app {key:<20} failed", file=sys.stderr)
+                continue
+            phases = sorted({p for s in samples for p in s['phases_ms']})
+            report['app'][key] = {
+                'import_app_ms': summarize([s['import_app_ms'] for s in samples]),
+                'first_live_ms': summarize([s['first_live_ms'] for s in samples]),
+                'ready_ms': summarize([s['ready_ms'] for s in samples]),
+                'phases_ms': {p: summarize([s['phases_ms'].get(p) for s in samples]) for p in phases},
+            }
+            entry = report['app'][key]
+            print(f"app {key:<20} live {entry['first_live_ms']['median']:>9.1f} ms  "
+                  f"ready {entry['ready_ms']['median'] if entry['ready_ms'] else float('nan'):>9.1f} ms",
+                  file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
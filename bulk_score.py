@@ -0,0 +1,332 @@
+# ============================================
+# OFFLINE BULK SCORING AND EVALUATION
+# Streams <category>.npy files (or their packed shards) through a served
+# model version in large vectorized batches, spread over worker
+# processes, and writes a compact columnar report:
+#   categories, per_class_count, per_class_correct   per-class accuracy
+#   confusion                                         C x C int64, true x predicted
+#   topk_correct                                      C x K, true class within the top 1..K
+#   calibration_{count,confidence,correct}            confidence histogram
+#                                                     (reliability diagram, ECE)
+#   rows_{label,row,predicted,confidence,true_prob}   per drawing, with --save-rows
+#   summary                                           JSON: overall numbers, images/sec
+# as one .npz (default) or, with --format parquet and pyarrow installed,
+# a directory of Parquet tables.
+# Workers each load the model once and score chunks of rows; only the
+# predicted class, its confidence and the true class's rank come back.
+#
+#   python bulk_score.py                                  # current version, every row
+#   python bulk_score.py --rows holdout --workers 8       # the training validation tail
+#   python bulk_score.py cat dog --limit 50000 --version 20251215-101500 -o v2.npz
+#   python bulk_score.py --compare v1.npz v2.npz
+# ============================================
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+import config
+from inference import load_backend
+from model_registry import ModelRegistry, version_file
+from quickdraw_data import QuickDrawStream, open_category
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional: pip install pyarrow
+    pyarrow = None
+
+CHUNK_ROWS = 32768
+ROW_SOURCES = ('all', 'holdout')
+
+
+def load_scoring_model(version=None, models_dir=config.MODELS_DIR, kind=config.INFERENCE_BACKEND):
+    """(version, backend, categories) for a version the server could serve."""
+    registry = ModelRegistry(None, root=models_dir)
+    version = version or registry.current_version()
+    path = registry.path_for(version)
+    backend = load_backend(kind,
+                           version_file(path, config.MODEL_PATH),
+                           version_file(path, config.NUMPY_WEIGHTS_PATH),
+                           version_file(path, config.TFLITE_PATH),
+                           fast_weights_path=version_file(path, config.FAST_WEIGHTS_PATH),
+                           centroids_path=version_file(path, config.CENTROIDS_PATH),
+                           cascade_threshold=config.CASCADE_THRESHOLD,
+                           base_kind=config.BASE_BACKEND)
+    categories = getattr(backend, 'categories', None)
+    if categories is None:
+        with open(version_file(path, 'categories.json')) as f:
+            categories = json.load(f)
+    return version, backend, list(categories)
+
+
+# ============================================
+# WORKERS
+# ============================================
+_worker = {}
+
+
+def _init_worker(version, models_dir, kind, data_dir, batch_size):
+    _worker['model'] = load_scoring_model(version, models_dir, kind)
+    _worker['data_dir'] = data_dir
+    _worker['batch_size'] = batch_size
+    _worker['arrays'] = {}
+
+
+def _score_chunk(task):
+    """(category, label, start, stop) -> (label, start, predicted, confidence, true_prob, rank)"""
+    category, label, start, stop = task
+    _, backend, _ = _worker['model']
+    array = _worker['arrays'].get(category)
+    if array is None:
+        array = _worker['arrays'][category] = open_category(category, _worker['data_dir'])
+
+    batch_size = _worker['batch_size']
+    n = stop - start
+    predicted = np.empty(n, dtype=np.uint16)
+    confidence = np.empty(n, dtype=np.float32)
+    true_prob = np.empty(n, dtype=np.float32)
+    rank = np.empty(n, dtype=np.uint16)
+    x = np.empty((batch_size, 28, 28, 1), dtype=np.float32)
+    for offset in range(0, n, batch_size):
+        count = min(batch_size, n - offset)
+        pixels = np.asarray(array[start + offset:start + offset + count])
+        batch = x[:count]
+        batch[...] = pixels.reshape(count, 28, 28, 1)
+        batch *= 1.0 / 255.0
+        probs = np.asarray(backend.predict(batch), dtype=np.float32)
+        top = probs.argmax(axis=1)
+        p_true = probs[:, label]
+        window = slice(offset, offset + count)
+        predicted[window] = top
+        confidence[window] = probs[np.arange(count), top]
+        true_prob[window] = p_true
+        # 0 when the true class is the top prediction; ties count in its favour
+        rank[window] = (probs > p_true[:, None]).sum(axis=1)
+    return label, start, predicted, confidence, true_prob, rank
+
+
+# ============================================
+# AGGREGATION
+# ============================================
+class Scores:
+    def __init__(self, categories, top_k=5, bins=15, keep_rows=False):
+        self.categories = categories
+        self.num_classes = len(categories)
+        self.top_k = max(1, min(top_k, self.num_classes))
+        self.bins = bins
+        self.confusion = np.zeros((self.num_classes, self.num_classes), dtype=np.int64)
+        self.rank_count = np.zeros((self.num_classes, self.top_k), dtype=np.int64)  # true class ranked k-th
+        self.calibration_count = np.zeros(bins, dtype=np.int64)
+        self.calibration_confidence = np.zeros(bins, dtype=np.float64)
+        self.calibration_correct = np.zeros(bins, dtype=np.int64)
+        self.log_loss_sum = 0.0
+        self.rows = [] if keep_rows else None
+
+    def add(self, label, start, predicted, confidence, true_prob, rank):
+        c = self.num_classes
+        self.confusion[label] += np.bincount(predicted, minlength=c)
+        self.rank_count[label] += np.bincount(np.minimum(rank, self.top_k), minlength=self.top_k + 1)[:-1]
+        correct = predicted == label
+        which = np.minimum((confidence * self.bins).astype(np.int64), self.bins - 1)
+        self.calibration_count += np.bincount(which, minlength=self.bins)
+        self.calibration_confidence += np.bincount(which, weights=confidence, minlength=self.bins)
+        self.calibration_correct += np.bincount(which, weights=correct, minlength=self.bins).astype(np.int64)
+        self.log_loss_sum += float(-np.log(np.maximum(true_prob, 1e-12)).sum())
+        if self.rows is not None:
+            self.rows.append((np.full(len(predicted), label, dtype=np.uint16),
+                              np.arange(start, start + len(predicted), dtype=np.uint32),
+                              predicted, confidence.astype(np.float16), true_prob.astype(np.float16)))
+
+    @property
+    def total(self):
+        return int(self.confusion.sum())
+
+    def per_class(self):
+        count = self.confusion.sum(axis=1)
+        within = np.cumsum(self.rank_count, axis=1)
+        return count, np.diag(self.confusion).copy(), within
+
+    def expected_calibration_error(self):
+        filled = self.calibration_count > 0
+        gap = np.abs(self.calibration_correct[filled] - self.calibration_confidence[filled])
+        return float(gap.sum() / max(self.total, 1))
+
+    def summary(self):
+        count, correct, within = self.per_class()
+        total = max(self.total, 1)
+        accuracy = np.divide(correct, count, out=np.zeros(len(count)), where=count > 0)
+        return {
+            'drawings': self.total,
+            'accuracy': round(float(correct.sum() / total), 4),
+            'top_k_accuracy': {f'top_{k + 1}': round(float(within[:, k].sum() / total), 4)
+                               for k in range(self.top_k)},
+            'mean_class_accuracy': round(float(accuracy[count > 0].mean()), 4) if (count > 0).any() else None,
+            'log_loss': round(self.log_loss_sum / total, 4),
+            'expected_calibration_error': round(self.expected_calibration_error(), 4),
+            'per_class_accuracy': {c: round(float(a), 4) for c, a, n in zip(self.categories, accuracy, count) if n},
+        }
+
+    def arrays(self):
+        count, correct, within = self.per_class()
+        arrays = {
+            'categories': np.array(self.categories),
+            'per_class_count': count,
+            'per_class_correct': correct,
+            'confusion': self.confusion,
+            'topk_correct': within,
+            'calibration_edges': np.linspace(0.0, 1.0, self.bins + 1),
+            'calibration_count': self.calibration_count,
+            'calibration_confidence': self.calibration_confidence,
+            'calibration_correct': self.calibration_correct,
+        }
+        if self.rows:
+            for name, column in zip(('label', 'row', 'predicted', 'confidence', 'true_prob'), zip(*self.rows)):
+                arrays[f'rows_{name}'] = np.concatenate(column)
+        return arrays
+
+
+# ============================================
+# DRIVER
+# ============================================
+def plan_chunks(categories, model_categories, data_dir='.', rows='all', limit=None, chunk_rows=CHUNK_ROWS):
+    """(category, label, start, stop) tasks covering the requested rows of every category."""
+    if rows not in ROW_SOURCES:
+        raise ValueError(f"rows must be one of {', '.join(ROW_SOURCES)}")
+    unknown = [c for c in categories if c not in model_categories]
+    if unknown:
+        raise ValueError(f"Not categories of this model: {', '.join(unknown)}")
+    if rows == 'holdout':
+        # The tail rows QuickDrawStream (train_modek.py) never trains on
+        ranges = QuickDrawStream(categories, data_dir).val_ranges
+    else:
+        ranges = [(0, len(open_category(c, data_dir))) for c in categories]
+    tasks = []
+    for category, (start, stop) in zip(categories, ranges):
+        if limit is not None:
+            start = max(start, stop - limit)
+        label = model_categories.index(category)
+        tasks.extend((category, label, s, min(s + chunk_rows, stop)) for s in range(start, stop, chunk_rows))
+    return tasks
+
+
+def score(categories=None, version=None, models_dir=config.MODELS_DIR, kind=config.INFERENCE_BACKEND,
+          data_dir='.', rows='all', limit=None, workers=None, batch_size=4096, top_k=5, bins=15,
+          keep_rows=False, chunk_rows=CHUNK_ROWS):
+    workers = workers or os.cpu_count() or 1
+    version, backend, model_categories = load_scoring_model(version, models_dir, kind)
+    tasks = plan_chunks(categories or model_categories, model_categories, data_dir, rows, limit, chunk_rows)
+    scores = Scores(model_categories, top_k, bins, keep_rows)
+    init_args = (version, models_dir, kind, data_dir, batch_size)
+
+    started = time.perf_counter()
+    if workers == 1:
+        _worker['model'] = (version, backend, model_categories)
+        _worker.update(data_dir=data_dir, batch_size=batch_size, arrays={})
+        for task in tasks:
+            scores.add(*_score_chunk(task))
+    else:
+        # One process per core, each single-threaded, beats one process
+        # with a multi-threaded BLAS on batches this small. Set before the
+        # workers start: spawned processes read it when importing NumPy.
+        for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+            os.environ.setdefault(var, '1')
+        # spawn, not fork: TensorFlow and BLAS thread pools do not survive fork()
+        with mp.get_context('spawn').Pool(workers, _init_worker, init_args) as pool:
+            for result in pool.imap_unordered(_score_chunk, tasks):
+                scores.add(*result)
+    elapsed = time.perf_counter() - started
+
+    summary = {'model_version': version, 'backend': kind, 'rows': rows, 'workers': workers,
+               'batch_size': batch_size, 'seconds': round(elapsed, 2),
+               'images_per_second': round(scores.total / max(elapsed, 1e-9), 1), **scores.summary()}
+    return scores, summary
+
+
+def write_report(scores, summary, output, fmt='npz'):
+    arrays = scores.arrays()
+    if fmt == 'parquet':
+        if pyarrow is None:
+            raise SystemExit("--format parquet needs pyarrow (pip install pyarrow)")
+        os.makedirs(output, exist_ok=True)
+        c, k = scores.num_classes, scores.top_k
+        classes = {'category': arrays['categories'].tolist(), 'count': arrays['per_class_count'],
+                   'correct': arrays['per_class_correct'],
+                   **{f'top_{i + 1}_correct': arrays['topk_correct'][:, i] for i in range(k)},
+                   **{f'predicted_{name}': arrays['confusion'][:, j] for j, name in enumerate(scores.categories)}}
+        tables = {
+            'classes': classes,
+            'calibration': {name[len('calibration_'):]: arrays[name] for name in
+                            ('calibration_count', 'calibration_confidence', 'calibration_correct')},
+        }
+        tables['calibration']['lower'] = arrays['calibration_edges'][:-1]
+        tables['calibration']['upper'] = arrays['calibration_edges'][1:]
+        if 'rows_label' in arrays:
+            tables['rows'] = {name[len('rows_'):]: arrays[name] for name in arrays if name.startswith('rows_')}
+        metadata = {'summary': json.dumps(summary), 'num_classes': str(c)}
+        for name, columns in tables.items():
+            table = pyarrow.table(columns).replace_schema_metadata(metadata)
+            pyarrow.parquet.write_table(table, os.path.join(output, f'{name}.parquet'), compression='zstd')
+        return output
+    np.savez_compressed(output, summary=np.array(json.dumps(summary)), **arrays)
+    return output
+
+
+def compare(before_path, after_path):
+    """Overall and per-class accuracy of two .npz reports, largest changes first."""
+    before, after = np.load(before_path), np.load(after_path)
+
+    def per_class(report):
+        count = report['per_class_count']
+        accuracy = np.divide(report['per_class_correct'], count, out=np.zeros(len(count)), where=count > 0)
+        return dict(zip(report['categories'].tolist(), accuracy))
+
+    a, b = per_class(before), per_class(after)
+    deltas = sorted(((b[c] - a[c], c) for c in a if c in b), key=lambda d: abs(d[0]), reverse=True)
+    sa, sb = json.loads(str(before['summary'])), json.loads(str(after['summary']))
+    return {
+        'before': {k: sa.get(k) for k in ('model_version', 'drawings', 'accuracy', 'top_k_accuracy',
+                                          'expected_calibration_error', 'images_per_second')},
+        'after': {k: sb.get(k) for k in ('model_version', 'drawings', 'accuracy', 'top_k_accuracy',
+                                         'expected_calibration_error', 'images_per_second')},
+        'accuracy_delta': round(sb['accuracy'] - sa['accuracy'], 4),
+        'per_class_delta': {c: round(float(d), 4) for d, c in deltas},
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Score QuickDraw drawings in bulk with a served model version")
+    parser.add_argument('categories', nargs='*', help="default: every category of the model")
+    parser.add_argument('--version', help="model version (default: CURRENT)")
+    parser.add_argument('--models-dir', default=config.MODELS_DIR)
+    parser.add_argument('--backend', default=config.INFERENCE_BACKEND)
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--rows', choices=ROW_SOURCES, default='all',
+                        help="holdout: only the validation tail train_modek.py leaves out")
+    parser.add_argument('--limit', type=int, help="at most this many rows per category (from the end)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows per worker task")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--bins', type=int, default=15, help="calibration bins")
+    parser.add_argument('--save-rows', action='store_true', help="also write one row per drawing")
+    parser.add_argument('--format', choices=('npz', 'parquet'), default='npz')
+    parser.add_argument('-o', '--output', help="default: scores_<version>.npz (or a directory for parquet)")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="diff two .npz reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        raise SystemExit(0)
+
+    scores, summary = score(args.categories, args.version, args.models_dir, args.backend, args.data_dir,
+                            args.rows, args.limit, args.workers, args.batch_size, args.top_k, args.bins,
+                            args.save_rows, args.chunk_rows)
+    output = args.output or f"scores_{summary['model_version']}" + ('.npz' if args.format == 'npz' else '')
+    write_report(scores, summary, output, args.format)
+    print(json.dumps({k: v for k, v in summary.items() if k != 'per_class_accuracy'}, indent=2))
+    print(f"✅ Scored {summary['drawings']} drawings at {summary['images_per_second']} images/sec -> {output}")
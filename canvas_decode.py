@@ -0,0 +1,179 @@
+# ============================================
+# CANVAS INPUT DECODING
+# Turns a request payload into the uint8 28x28 bitmap the model expects
+# (QuickDraw layout: background 0, ink 255). Selected by the request's
+# 'format' field:
+#   png     - 'canvas_data': base64 PNG of the full canvas (default)
+#   raw     - 'bitmap': base64 of 784 bytes already downsampled on the client
+#   strokes - 'strokes': list of strokes, each [[x0, x1, ...], [y0, y1, ...]]
+#             (QuickDraw simplified format) or [[x, y], [x, y], ...]
+# ============================================
+import base64
+from contextlib import nullcontext
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = 28
+INPUT_FORMATS = ('png', 'raw', 'strokes')
+# Stroke payloads: more segments than this are rejected (400); the
+# rasterizer works through them RASTER_BLOCK at a time, so its scratch
+# memory stays around RASTER_BLOCK x 784 floats whatever the input size
+MAX_SEGMENTS = 50000
+RASTER_BLOCK = 256
+
+
+def strip_data_url(data):
+    if 'base64,' in data:
+        return data.split('base64,', 1)[1]
+    return data
+
+
+def decode_png(canvas_data):
+    return decode_png_bytes(base64.b64decode(strip_data_url(canvas_data)))
+
+
+def decode_png_bytes(image_data, stage=None):
+    # stage(name) -> context manager, so callers can time 'decode' and
+    # 'resize' apart (see metrics.stage)
+    stage = stage or (lambda name: nullcontext())
+    with stage('decode'):
+        image = Image.open(BytesIO(image_data)).convert('L')
+    with stage('resize'):
+        image = image.resize((IMG_SIZE, IMG_SIZE))
+    return 255 - np.array(image)
+
+
+def decode_raw(bitmap):
+    buf = base64.b64decode(strip_data_url(bitmap)) if isinstance(bitmap, str) else bitmap
+    if len(buf) != IMG_SIZE * IMG_SIZE:
+        raise ValueError(f"Raw bitmap must be {IMG_SIZE * IMG_SIZE} bytes, got {len(buf)}")
+    # Zero-copy view over the decoded bytes
+    return np.frombuffer(buf, dtype=np.uint8).reshape(IMG_SIZE, IMG_SIZE)
+
+
+def decode_bitmaps(bitmaps):
+    # Same layout as the QuickDraw .npy files: uint8, 784 pixels per row, ink = 255
+    if isinstance(bitmaps, str):
+        array = np.frombuffer(base64.b64decode(bitmaps), dtype=np.uint8)
+    elif isinstance(bitmaps, (bytes, bytearray)):
+        array = np.frombuffer(bitmaps, dtype=np.uint8)
+    else:
+        array = np.asarray(bitmaps, dtype=np.uint8)
+
+    if array.size % (IMG_SIZE * IMG_SIZE) != 0:
+        raise ValueError(f"Bitmap data has {array.size} bytes, expected a multiple of 784 (N x 28 x 28)")
+    return array.reshape(-1, IMG_SIZE, IMG_SIZE)
+
+
+# ============================================
+# STROKE RASTERIZER
+# ============================================
+def _stroke_points(stroke):
+    points = np.asarray(stroke, dtype=np.float32)
+    if points.ndim != 2:
+        raise ValueError("Each stroke must be [[xs...], [ys...]] or [[x, y], ...]")
+    # [[xs], [ys]] (QuickDraw) vs [[x, y], ...]; a 2x2 stroke is read as QuickDraw
+    if points.shape[0] == 2:
+        points = points.T
+    elif points.shape[1] != 2:
+        raise ValueError("Each stroke must be [[xs...], [ys...]] or [[x, y], ...]")
+    return points
+
+
+def strokes_to_segments(strokes):
+    """Flatten strokes into an (S, 4) array of x0, y0, x1, y1 segments."""
+    segments, total = [], 0
+    for stroke in strokes:
+        points = _stroke_points(stroke)
+        if len(points) == 0:
+            continue
+        if len(points) == 1:
+            points = np.repeat(points, 2, axis=0)  # a dot
+        total += len(points) - 1
+        if total > MAX_SEGMENTS:
+            raise ValueError(f"Too many stroke segments (limit {MAX_SEGMENTS})")
+        segments.append(np.hstack([points[:-1], points[1:]]))
+    if not segments:
+        return np.zeros((0, 4), dtype=np.float32)
+    return np.concatenate(segments)
+
+
+def fit_segments(segments, size=IMG_SIZE, padding=2.0):
+    # Center the bounding box and scale its longest side to the grid, the
+    # way the QuickDraw bitmaps were produced
+    if len(segments) == 0:
+        return segments
+    xs = segments[:, [0, 2]]
+    ys = segments[:, [1, 3]]
+    min_x, min_y = xs.min(), ys.min()
+    extent = max(xs.max() - min_x, ys.max() - min_y, 1e-6)
+    scale = (size - 1 - 2 * padding) / extent
+    offset_x = (size - 1 - (xs.max() - min_x) * scale) / 2.0
+    offset_y = (size - 1 - (ys.max() - min_y) * scale) / 2.0
+
+    fitted = np.empty_like(segments)
+    fitted[:, [0, 2]] = (xs - min_x) * scale + offset_x
+    fitted[:, [1, 3]] = (ys - min_y) * scale + offset_y
+    return fitted
+
+
+def rasterize_segments(segments, size=IMG_SIZE, line_width=1.8, out=None):
+    """Anti-aliased rasterization of grid-space segments, fully vectorized.
+
+    Computes the distance from every pixel center to a block of segments at
+    once (RASTER_BLOCK x size*size) and keeps the nearest per pixel. If
+    `out` is a uint8 bitmap, strokes are max-blended into it in place.
+    """
+    if out is None:
+        out = np.zeros((size, size), dtype=np.uint8)
+    if len(segments) == 0:
+        return out
+
+    ys, xs = np.mgrid[0:size, 0:size].astype(np.float32)
+    px = xs.reshape(1, -1)
+    py = ys.reshape(1, -1)
+
+    dist = np.full(size * size, np.inf, dtype=np.float32)
+    for start in range(0, len(segments), RASTER_BLOCK):
+        block = segments[start:start + RASTER_BLOCK]
+        x0, y0, x1, y1 = (block[:, i:i + 1].astype(np.float32) for i in range(4))
+        dx, dy = x1 - x0, y1 - y0
+        length_sq = np.maximum(dx * dx + dy * dy, 1e-12)
+        t = np.clip(((px - x0) * dx + (py - y0) * dy) / length_sq, 0.0, 1.0)
+        np.minimum(dist, np.hypot(px - (x0 + t * dx), py - (y0 + t * dy)).min(axis=0), out=dist)
+
+    # Solid inside the pen radius, 1px linear falloff outside it
+    coverage = np.clip(line_width / 2.0 + 0.5 - dist, 0.0, 1.0)
+    ink = (coverage * 255.0 + 0.5).astype(np.uint8).reshape(size, size)
+    np.maximum(out, ink, out=out)
+    return out
+
+
+def rasterize_strokes(strokes, size=IMG_SIZE, line_width=1.8):
+    return rasterize_segments(fit_segments(strokes_to_segments(strokes), size), size, line_width)
+
+
+# ============================================
+# REQUEST DISPATCH
+# ============================================
+def decode_input(data):
+    """Return the uint8 28x28 bitmap for a /api/predict JSON payload."""
+    input_format = data.get('format', 'png')
+    if input_format == 'png':
+        canvas_data = data.get('canvas_data')
+        if not canvas_data:
+            raise ValueError("No canvas data")
+        return decode_png(canvas_data)
+    if input_format == 'raw':
+        bitmap = data.get('bitmap')
+        if not bitmap:
+            raise ValueError("No bitmap data")
+        return decode_raw(bitmap)
+    if input_format == 'strokes':
+        strokes = data.get('strokes')
+        if not strokes:
+            raise ValueError("No stroke data")
+        return rasterize_strokes(strokes, line_width=float(data.get('line_width', 1.8)))
+    raise ValueError(f"Unknown format '{input_format}', expected one of {', '.join(INPUT_FORMATS)}")
@@ -0,0 +1,228 @@
+# ============================================
+# SCALABLE CLASSIFICATION MODES (SKETCH_BACKEND=cascade | centroid)
+# - cascade:  a tiny CNN answers first; drawings it is unsure about
+#             (max probability < threshold) are re-run through the full
+#             model. Most sketches never touch the big network.
+# - centroid: the full model's penultimate layer is used as an embedding
+#             and each category is one L2-normalised prototype vector.
+#             Prediction is a single (N, D) x (D, K) matmul, and a new
+#             category only needs embeddings of its drawings, not a new
+#             output layer or retraining.
+#
+#   python cascade.py --train-fast                # tiny model -> sketch_model_fast.npz
+#   python cascade.py --build-centroids           # categories.json -> sketch_centroids.npz
+#   python cascade.py --add-category giraffe      # download, embed, append prototype
+# Both backends expose the same predict(batch) as inference.py.
+# ============================================
+import json
+import threading
+
+import numpy as np
+
+from inference import export_numpy_weights, load_backend
+from quickdraw_data import QuickDrawStream, open_category
+
+FAST_MODEL_PATH = 'sketch_model_fast.h5'
+FAST_WEIGHTS_PATH = 'sketch_model_fast.npz'
+CENTROIDS_PATH = 'sketch_centroids.npz'
+
+
+class CascadeBackend:
+    name = 'cascade'
+
+    def __init__(self, fast, full, threshold=0.9):
+        if _num_classes(fast) != _num_classes(full):
+            raise ValueError(f"Fast model has {_num_classes(fast)} classes, full model {_num_classes(full)}")
+        self.fast = fast
+        self.full = full
+        self.threshold = threshold
+        self.counters = {'images': 0, 'escalated': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def num_classes(self):
+        return _num_classes(self.fast)
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        probabilities = self.fast.predict(batch)
+        unsure = np.flatnonzero(probabilities.max(axis=1) < self.threshold)
+        if len(unsure):
+            probabilities[unsure] = self.full.predict(batch[unsure])
+        with self._lock:
+            self.counters['images'] += len(probabilities)
+            self.counters['escalated'] += len(unsure)
+        return probabilities
+
+    def stats(self):
+        with self._lock:
+            images, escalated = self.counters['images'], self.counters['escalated']
+        return {'threshold': self.threshold, 'images': images, 'escalated': escalated,
+                'escalation_rate': round(escalated / images, 4) if images else 0.0}
+
+
+def _num_classes(backend):
+    num_classes = getattr(backend, 'num_classes', None)
+    if num_classes is None:
+        num_classes = backend.predict(np.zeros((1, 28, 28, 1), dtype=np.float32)).shape[1]
+    return num_classes
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+class CentroidBackend:
+    name = 'centroid'
+
+    def __init__(self, embedder, centroids, categories, temperature=0.05, counts=None):
+        self.embedder = embedder
+        self.categories = list(categories)
+        self.temperature = temperature
+        self.centroids = _normalize(centroids)
+        # Embeddings averaged into each prototype, so prototypes can be refined later
+        self.counts = np.asarray(counts if counts is not None else np.ones(len(self.categories)), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    @property
+    def num_classes(self):
+        return len(self.categories)
+
+    def predict(self, batch):
+        # Cosine similarity to every prototype, turned into probabilities
+        scores = _normalize(self.embedder.embed(batch)) @ self.centroids.T
+        scores /= self.temperature
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def add_category(self, name, embeddings):
+        embeddings = _normalize(embeddings)
+        prototype = _normalize(embeddings.mean(axis=0))
+        with self._lock:
+            if name in self.categories:
+                idx = self.categories.index(name)
+                total = self.counts[idx] + len(embeddings)
+                merged = self.centroids[idx] * self.counts[idx] + embeddings.sum(axis=0)
+                centroids = self.centroids.copy()
+                centroids[idx] = _normalize(merged)
+                counts = self.counts.copy()
+                counts[idx] = total
+            else:
+                centroids = np.vstack([self.centroids, prototype[None]])
+                counts = np.append(self.counts, len(embeddings))
+            # Swap whole arrays so concurrent predict() calls see a consistent index
+            categories = self.categories if name in self.categories else self.categories + [name]
+            self.centroids, self.counts, self.categories = centroids, counts, categories
+
+    def subset(self, count):
+        return CentroidBackend(self.embedder, self.centroids[:count], self.categories[:count],
+                               self.temperature, self.counts[:count])
+
+    def save(self, path=CENTROIDS_PATH):
+        np.savez(path, centroids=self.centroids, counts=self.counts,
+                 categories=np.array(json.dumps(self.categories)),
+                 temperature=np.array(self.temperature))
+        return path
+
+    @classmethod
+    def load(cls, path, embedder):
+        data = np.load(path)
+        return cls(embedder, data['centroids'], json.loads(str(data['categories'])),
+                   float(data['temperature']), data['counts'])
+
+
+# ============================================
+# BUILDING THE FAST MODEL AND THE CENTROID INDEX
+# ============================================
+def embed_category(embedder, category, data_dir='.', samples=2000, batch_size=512):
+    # Prototypes come from the training rows (validation keeps the file's tail)
+    array = open_category(category, data_dir)
+    stop = min(samples, len(array))
+    chunks = [embedder.embed(np.asarray(array[i:min(i + batch_size, stop)], dtype=np.float32)
+                             .reshape(-1, 28, 28, 1) / 255.0)
+              for i in range(0, stop, batch_size)]
+    return np.concatenate(chunks)
+
+
+def build_centroids(embedder, categories, data_dir='.', samples=2000, temperature=0.05):
+    index = None
+    for category in categories:
+        embeddings = embed_category(embedder, category, data_dir, samples)
+        if index is None:
+            index = CentroidBackend(embedder, np.empty((0, embeddings.shape[1]), dtype=np.float32), [],
+                                    temperature, counts=np.empty(0, dtype=np.int64))
+        index.add_category(category, embeddings)
+        print(f"  {category}: {len(embeddings)} drawings")
+    return index
+
+
+def build_fast_model(num_classes):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense
+
+    # ~20x fewer multiply-adds than the full model in train_modek.py
+    return Sequential([
+        Conv2D(16, (3, 3), activation='relu', input_shape=(28, 28, 1)),
+        MaxPooling2D((2, 2)),
+        Conv2D(32, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Flatten(),
+        Dense(64, activation='relu'),
+        Dense(num_classes, activation='softmax')
+    ])
+
+
+def train_fast_model(stream, epochs=5, model_path=FAST_MODEL_PATH, weights_path=FAST_WEIGHTS_PATH):
+    model = build_fast_model(stream.num_classes)
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    model.fit(stream.train_dataset(), steps_per_epoch=stream.steps_per_epoch, epochs=epochs,
+              validation_data=stream.validation_dataset(), validation_steps=stream.validation_steps,
+              verbose=1)
+    _, accuracy = model.evaluate(stream.validation_dataset(), steps=stream.validation_steps)
+    model.save(model_path)
+    export_numpy_weights(model, weights_path)
+    print(f"✅ Fast model saved to {weights_path} (accuracy {accuracy * 100:.2f}%)")
+    return model, accuracy
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the cascade's fast model or build the centroid index")
+    parser.add_argument('--train-fast', action='store_true')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--build-centroids', action='store_true')
+    parser.add_argument('--add-category', action='append', default=[], metavar='NAME')
+    parser.add_argument('--samples', type=int, default=2000, help="drawings averaged into each prototype")
+    parser.add_argument('--temperature', type=float, default=0.05)
+    parser.add_argument('--backend', default='keras', help="backbone used for embeddings (keras or numpy)")
+    parser.add_argument('--model', default='sketch_model.h5')
+    parser.add_argument('--weights', default='sketch_model.npz')
+    parser.add_argument('--centroids', default=CENTROIDS_PATH)
+    args = parser.parse_args()
+
+    with open('categories.json') as f:
+        categories = json.load(f)
+
+    if args.train_fast:
+        train_fast_model(QuickDrawStream(categories), epochs=args.epochs)
+
+    if args.build_centroids or args.add_category:
+        embedder = load_backend(args.backend, args.model, args.weights)
+        if args.build_centroids:
+            print(f"Building centroid index for {len(categories)} categories...")
+            index = build_centroids(embedder, categories, samples=args.samples, temperature=args.temperature)
+        else:
+            index = CentroidBackend.load(args.centroids, embedder)
+
+        if args.add_category:
+            from downloader import download_categories
+            download_categories(args.add_category)
+            for category in args.add_category:
+                index.add_category(category, embed_category(embedder, category, samples=args.samples))
+                print(f"  + {category}")
+        index.save(args.centroids)
+        print(f"✅ Centroid index with {index.num_classes} categories saved to {args.centroids}")
@@ -0,0 +1,160 @@
+# ============================================
+# SERVING CONFIGURATION
+# Every value can be overridden with an environment variable so the same
+# code runs under `python app.py`, gunicorn and the benchmark scripts.
+# ============================================
+import os
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_str(name, default):
+    return os.environ.get(name, default)
+
+
+# Model files and inference backend ('keras', 'numpy', 'tflite', 'cascade' or
+# 'centroid', see inference.py and cascade.py)
+MODEL_PATH = env_str('SKETCH_MODEL_PATH', 'sketch_model.h5')
+NUMPY_WEIGHTS_PATH = env_str('SKETCH_NUMPY_WEIGHTS', 'sketch_model.npz')
+TFLITE_PATH = env_str('SKETCH_TFLITE_PATH', 'sketch_model.tflite')
+INFERENCE_BACKEND = env_str('SKETCH_BACKEND', 'keras')
+
+# cascade: the tiny model answers when its top probability reaches the
+# threshold, otherwise the SKETCH_BASE_BACKEND model does; centroid: the
+# base model's embeddings are matched against per-category prototypes
+FAST_WEIGHTS_PATH = env_str('SKETCH_FAST_WEIGHTS', 'sketch_model_fast.npz')
+CENTROIDS_PATH = env_str('SKETCH_CENTROIDS_PATH', 'sketch_centroids.npz')
+CASCADE_THRESHOLD = env_float('SKETCH_CASCADE_THRESHOLD', 0.9)
+BASE_BACKEND = env_str('SKETCH_BASE_BACKEND', 'keras')
+
+# Versioned model directories and hot reload (see model_registry.py); without
+# MODELS_DIR the top-level model files are served as version 'default'.
+# SKETCH_MODEL_VERSION pins the initial version (default: CURRENT / newest).
+# Admin endpoints are disabled unless SKETCH_ADMIN_TOKEN is set.
+MODELS_DIR = env_str('SKETCH_MODELS_DIR', 'models')
+MODEL_VERSION = env_str('SKETCH_MODEL_VERSION', '')
+MODEL_WATCH_INTERVAL = env_float('SKETCH_MODEL_WATCH_INTERVAL', 5.0)
+MAX_LOADED_MODELS = env_int('SKETCH_MAX_LOADED_MODELS', 2)
+ADMIN_TOKEN = env_str('SKETCH_ADMIN_TOKEN', '')
+
+# Startup: 'eager', 'background' or 'lazy' (see model_loader.py); requests
+# wait up to READY_TIMEOUT seconds for a loading model before a 503
+STARTUP_MODE = env_str('SKETCH_STARTUP', 'eager')
+READY_TIMEOUT = env_float('SKETCH_READY_TIMEOUT', 5.0)
+
+# Admission control (see admission.py). Classes are
+# 'name=concurrency:queue:priority[:deadline_ms]'; a lower priority value is
+# served first. A request that waits longer than ADMISSION_QUEUE_SLO_MS for
+# a slot, or past its deadline (X-Request-Timeout-Ms header, else the class
+# or ADMISSION_DEADLINE_MS), gets a 503 with Retry-After.
+#
+# Sizing rule: an admitted request holds one of gunicorn's threads
+# (GUNICORN_THREADS per worker process), so the defaults follow it:
+#   - total = threads - 1, leaving one thread for health, readiness and
+#     metrics, which bypass admission
+#   - ADMISSION_RESERVED = threads // 4 of those only priority-0 classes
+#     (predict, admin) may take, so slow classes together never hold
+#     every thread
+#   - generate_image, batch, similar and default get threads // 4 each,
+#     stream gets threads // 2 (the same as STREAM_MAX_OPEN)
+# Raising the limits above the thread count only moves the queue from the
+# admission controller into gunicorn's backlog, where it has no deadline.
+THREADS = env_int('GUNICORN_THREADS', 8)
+_quarter = max(1, THREADS // 4)
+ADMISSION_ENABLED = env_bool('SKETCH_ADMISSION', True)
+ADMISSION_MAX_CONCURRENCY = env_int('SKETCH_ADMISSION_MAX_CONCURRENCY', max(1, THREADS - 1))
+ADMISSION_RESERVED = env_int('SKETCH_ADMISSION_RESERVED', min(THREADS // 4, ADMISSION_MAX_CONCURRENCY - 1))
+ADMISSION_QUEUE_SLO_MS = env_float('SKETCH_ADMISSION_QUEUE_SLO_MS', 250.0)
+ADMISSION_DEADLINE_MS = env_float('SKETCH_ADMISSION_DEADLINE_MS', 30000.0)
+ADMISSION_CLASSES = env_str('SKETCH_ADMISSION_CLASSES',
+                            f'predict={max(1, THREADS - 1)}:256:0,batch={_quarter}:16:1,'
+                            f'similar={_quarter}:64:1,stream={max(1, THREADS // 2)}:64:1,'
+                            f'generate_image={_quarter}:16:2,admin=1:4:0,default={_quarter}:32:1')
+
+# Micro-batching of /api/predict forward passes
+BATCHING_ENABLED = env_bool('SKETCH_BATCHING', True)
+BATCH_MAX_SIZE = env_int('SKETCH_BATCH_MAX_SIZE', 32)
+BATCH_MAX_WAIT_MS = env_float('SKETCH_BATCH_MAX_WAIT_MS', 5.0)
+
+# Multi-process inference pool (0 = run inference in the web process);
+# affinity is '' (no pinning), 'auto' or a CPU list such as '0,1,2,3'
+WORKER_PROCESSES = env_int('SKETCH_WORKER_PROCESSES', 0)
+WORKER_CPU_AFFINITY = env_str('SKETCH_WORKER_CPU_AFFINITY', '')
+WORKER_SLOTS = env_int('SKETCH_WORKER_SLOTS', 128)
+WORKER_MAX_PAYLOAD_BYTES = env_int('SKETCH_WORKER_MAX_PAYLOAD_BYTES', 256 * 1024)
+WORKER_MAX_BATCH = env_int('SKETCH_WORKER_MAX_BATCH', 32)
+# Ring slots one /api/predict/batch request may hold at once (0 = slots // 4)
+WORKER_MAX_REQUEST_SLOTS = env_int('SKETCH_WORKER_MAX_REQUEST_SLOTS', 0)
+# How long a request waits for a worker's (or the micro-batcher's) answer
+WORKER_RESULT_TIMEOUT = env_float('SKETCH_WORKER_RESULT_TIMEOUT', 10.0)
+# Retry-After (seconds) sent when no ring slot frees up before the deadline
+WORKER_SATURATED_RETRY_AFTER = env_int('SKETCH_WORKER_SATURATED_RETRY_AFTER', 1)
+
+# Prediction result cache (keyed on the quantized 28x28 bitmap)
+CACHE_ENABLED = env_bool('SKETCH_CACHE', True)
+CACHE_MAX_ENTRIES = env_int('SKETCH_CACHE_MAX_ENTRIES', 4096)
+CACHE_TTL_SECONDS = env_float('SKETCH_CACHE_TTL_SECONDS', 600.0)
+CACHE_QUANTIZE_BITS = env_int('SKETCH_CACHE_QUANTIZE_BITS', 4)
+
+# /api/predict/batch
+BATCH_ENDPOINT_MAX_ITEMS = env_int('SKETCH_BATCH_ENDPOINT_MAX_ITEMS', 1024)
+BATCH_ENDPOINT_CHUNK = env_int('SKETCH_BATCH_ENDPOINT_CHUNK', 256)
+DECODE_WORKERS = env_int('SKETCH_DECODE_WORKERS', min(8, (os.cpu_count() or 1) + 4))
+
+# Live prediction streaming (SSE)
+STREAM_MAX_SESSIONS = env_int('SKETCH_STREAM_MAX_SESSIONS', 1000)
+STREAM_IDLE_TTL = env_float('SKETCH_STREAM_IDLE_TTL', 300.0)
+STREAM_DEBOUNCE_MS = env_float('SKETCH_STREAM_DEBOUNCE_MS', 50.0)
+STREAM_KEEPALIVE_SECONDS = env_float('SKETCH_STREAM_KEEPALIVE_SECONDS', 15.0)
+# Each open event stream holds a serving thread, so keep this below
+# gunicorn's threads (GUNICORN_THREADS) per worker. Sessions are per
+# worker process: with WEB_CONCURRENCY > 1 the load balancer must be sticky
+STREAM_MAX_OPEN = env_int('SKETCH_STREAM_MAX_OPEN', max(1, THREADS // 2))
+
+# /api/generate-image
+POLLINATIONS_BASE_URL = env_str('SKETCH_POLLINATIONS_URL', 'https://image.pollinations.ai')
+IMAGE_GEN_TIMEOUT = env_float('SKETCH_IMAGE_GEN_TIMEOUT', 15.0)
+IMAGE_GEN_MAX_CONCURRENCY = env_int('SKETCH_IMAGE_GEN_MAX_CONCURRENCY', 8)
+IMAGE_GEN_CACHE_TTL_SECONDS = env_float('SKETCH_IMAGE_GEN_CACHE_TTL_SECONDS', 3600.0)
+
+# asgi_app.py: threads running PNG decode and inference off the event loop
+# (the only blocking work it does; upstream calls are awaited)
+ASYNC_CPU_WORKERS = env_int('SKETCH_ASYNC_CPU_WORKERS', os.cpu_count() or 1)
+
+# /api/similar (see similarity.py): index directory, looked up inside each
+# model version; result limit and IVF lists scanned per query
+SIMILAR_INDEX_DIR = env_str('SKETCH_SIMILAR_INDEX_DIR', 'sketch_index')
+SIMILAR_DEFAULT_K = env_int('SKETCH_SIMILAR_DEFAULT_K', 12)
+SIMILAR_MAX_K = env_int('SKETCH_SIMILAR_MAX_K', 100)
+SIMILAR_NPROBE = env_int('SKETCH_SIMILAR_NPROBE', 8)
+
+# Generated images kept on disk by server.py (see image_store.py)
+IMAGE_STORE_DIR = env_str('SKETCH_IMAGE_STORE_DIR', 'static/generated')
+IMAGE_STORE_MAX_BYTES = env_int('SKETCH_IMAGE_STORE_MAX_BYTES', 512 * 1024 * 1024)
+
+# Observability: Prometheus text on /metrics, sampled per-request log lines
+# (0 = off, 1 = every request) and the opt-in /api/debug/profile hook
+METRICS_ENABLED = env_bool('SKETCH_METRICS', True)
+LOG_SAMPLE_RATE = env_float('SKETCH_LOG_SAMPLE_RATE', 0.0)
+LOG_LEVEL = env_str('SKETCH_LOG_LEVEL', 'INFO')
+PROFILING_ENABLED = env_bool('SKETCH_PROFILING', False)
+PROFILING_MAX_SECONDS = env_float('SKETCH_PROFILING_MAX_SECONDS', 60.0)
@@ -0,0 +1,232 @@
+# ============================================
+# QUICKDRAW DATASET DOWNLOADER
+# - several categories download concurrently
+# - responses stream to <category>.npy.part in chunks (never held in RAM)
+# - an interrupted .part file resumes with an HTTP Range request
+# - finished files are checked against the server size and the .npy
+#   header (uint8, N x 784) before an atomic rename into place
+# - a JSON manifest records verified files so later runs skip them
+#   without re-reading hundreds of MB
+#   python downloader.py cloud sun tree --workers 8
+# ============================================
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = 'https://storage.googleapis.com/quickdraw_dataset/full/numpy_bitmap/'
+MANIFEST_NAME = 'dataset_manifest.json'
+ROW_BYTES = 28 * 28
+
+
+class InvalidDataset(Exception):
+    pass
+
+
+def validate_npy(path, expected_size=None):
+    """Return the row count of a QuickDraw bitmap file, or raise InvalidDataset."""
+    size = os.path.getsize(path)
+    if expected_size is not None and size != expected_size:
+        raise InvalidDataset(f"{path}: {size} bytes on disk, server reported {expected_size}")
+    try:
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            header_len = f.tell()
+    except (ValueError, OSError) as e:
+        # e.g. a Git LFS pointer or an HTML error page saved as .npy
+        raise InvalidDataset(f"{path}: not a .npy file ({e})")
+
+    if dtype != np.uint8 or len(shape) != 2 or shape[1] != ROW_BYTES or fortran_order:
+        raise InvalidDataset(f"{path}: expected uint8 (N, {ROW_BYTES}), got {dtype} {shape}")
+    if header_len + shape[0] * ROW_BYTES != size:
+        raise InvalidDataset(f"{path}: truncated ({size} bytes, header promises "
+                             f"{header_len + shape[0] * ROW_BYTES})")
+    return shape[0]
+
+
+class DatasetDownloader:
+    def __init__(self, base_url=BASE_URL, data_dir='.', max_workers=8, chunk_size=1 << 20,
+                 timeout=60, retries=3):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.data_dir = data_dir
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+        self.manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        self._manifest_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url_for(self, category):
+        return self.base_url + category.replace('_', '%20') + '.npy'
+
+    def path_for(self, category):
+        return os.path.join(self.data_dir, f'{category}.npy')
+
+    # --------------------------------------------
+    # Manifest
+    # --------------------------------------------
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def _record(self, category, entry):
+        with self._manifest_lock:
+            self.manifest[category] = entry
+            self._save_manifest()
+
+    def is_verified(self, category):
+        """Cheap check: file matches the size and mtime recorded in the manifest."""
+        entry = self.manifest.get(category)
+        path = self.path_for(category)
+        if not entry or not os.path.exists(path):
+            return False
+        st = os.stat(path)
+        return st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']
+
+    # --------------------------------------------
+    # Download one category
+    # --------------------------------------------
+    def download(self, category, force=False):
+        path = self.path_for(category)
+        if not force and self.is_verified(category):
+            return {'category': category, 'status': 'cached', 'path': path}
+
+        if not force and os.path.exists(path):
+            # Present but unknown to the manifest: accept it only if it validates
+            try:
+                rows = validate_npy(path)
+                self._record(category, self._entry(path, rows, sha256=None))
+                return {'category': category, 'status': 'verified', 'path': path, 'rows': rows}
+            except InvalidDataset as e:
+                print(f"⚠️  {e}; downloading again")
+
+        last_error = None
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self._download_once(category, path)
+            except (requests.RequestException, InvalidDataset, OSError) as e:
+                last_error = e
+                print(f"⚠️  {category}: attempt {attempt}/{self.retries} failed: {e}")
+                if attempt < self.retries:
+                    time.sleep(min(2 ** attempt, 10))
+        raise InvalidDataset(f"{category}: download failed after {self.retries} attempts: {last_error}")
+
+    def _download_once(self, category, path):
+        part = path + '.part'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        started = time.perf_counter()
+
+        with self.session.get(self.url_for(category), headers=headers, stream=True,
+                              timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # .part already holds the whole file (or more); start over
+                os.remove(part)
+                raise InvalidDataset(f"{category}: stale partial download")
+            if response.status_code == 200:
+                offset = 0  # server ignored the Range header
+            elif response.status_code != 206:
+                raise InvalidDataset(f"{category}: HTTP {response.status_code}")
+            total = self._total_size(response, offset)
+
+            digest = hashlib.sha256()
+            if offset:
+                with open(part, 'rb') as f:
+                    for block in iter(lambda: f.read(self.chunk_size), b''):
+                        digest.update(block)
+            with open(part, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+
+        try:
+            rows = validate_npy(part, expected_size=total)
+        except InvalidDataset:
+            os.remove(part)
+            raise
+        os.replace(part, path)
+
+        self._record(category, self._entry(path, rows, digest.hexdigest(), response.headers.get('ETag')))
+        seconds = time.perf_counter() - started
+        return {'category': category, 'status': 'resumed' if offset else 'downloaded', 'path': path,
+                'rows': rows, 'bytes': total - offset, 'seconds': round(seconds, 2)}
+
+    @staticmethod
+    def _total_size(response, offset):
+        content_range = response.headers.get('Content-Range')
+        if content_range and '/' in content_range and not content_range.endswith('/*'):
+            return int(content_range.rsplit('/', 1)[1])
+        length = response.headers.get('Content-Length')
+        return offset + int(length) if length is not None else None
+
+    @staticmethod
+    def _entry(path, rows, sha256, etag=None):
+        st = os.stat(path)
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'rows': rows,
+                'sha256': sha256, 'etag': etag, 'verified_at': time.time()}
+
+    # --------------------------------------------
+    # Many categories
+    # --------------------------------------------
+    def download_all(self, categories, force=False):
+        results, failures = {}, {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='download') as pool:
+            futures = {pool.submit(self.download, c, force): c for c in categories}
+            for future in as_completed(futures):
+                category = futures[future]
+                try:
+                    results[category] = result = future.result()
+                    print(f"✅ {category}: {result['status']}")
+                except Exception as e:
+                    failures[category] = str(e)
+                    print(f"❌ {category}: {e}")
+        if failures:
+            raise InvalidDataset(f"{len(failures)} categories failed: {', '.join(sorted(failures))}")
+        return results
+
+
+def download_categories(categories, data_dir='.', max_workers=8, base_url=BASE_URL, force=False):
+    return DatasetDownloader(base_url, data_dir, max_workers).download_all(categories, force=force)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Download and verify QuickDraw bitmap files")
+    parser.add_argument('categories', nargs='*', help="defaults to categories.json")
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--force', action='store_true', help="re-download even verified files")
+    args = parser.parse_args()
+
+    categories = args.categories
+    if not categories:
+        with open('categories.json', 'r') as f:
+            categories = json.load(f)
+    download_categories(categories, args.data_dir, args.workers, args.base_url, args.force)
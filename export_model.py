@@ -0,0 +1,239 @@
+# ============================================
+# MODEL EXPORT FOR CPU SERVING
+# Runs after training (or standalone) and writes compact variants of the
+# Keras model next to sketch_model.h5:
+#   float32.tflite        - same weights, TFLite runtime
+#   dynamic_int8.tflite   - int8 weights, float activations
+#   int8.tflite           - full int8, activations calibrated on a slice
+#                           of the QuickDraw training data
+#   pruned<NN>_int8.tflite - magnitude-pruned to NN% sparsity, then int8
+# For each variant it reports file size (raw and gzipped, which is where
+# pruning shows up), p50/p99 latency for one image and for a batch, and
+# accuracy change against model_accuracy.txt. The fastest variant within
+# the accuracy budget is flagged as recommended, and the fastest .tflite
+# variant within it is copied to sketch_model.tflite - the file
+# SKETCH_BACKEND=tflite loads and publish_version() ships. Serve another
+# variant with SKETCH_TFLITE_PATH=sketch_model.<variant>.tflite.
+#
+#   python export_model.py --prune 0.5,0.75 --max-accuracy-drop 0.01
+# ============================================
+import gzip
+import itertools
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from quickdraw_data import QuickDrawStream
+
+
+def calibration_batches(stream, samples):
+    # Class-balanced slice of the training split
+    taken = 0
+    for x, _ in stream.train_batches():
+        yield x
+        taken += len(x)
+        if taken >= samples:
+            return
+
+
+def evaluation_arrays(stream):
+    xs, ys = [], []
+    for x, y in stream.validation_batches():
+        xs.append(x)
+        ys.append(y.argmax(axis=1))
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+# ============================================
+# PRUNING
+# ============================================
+def magnitude_prune(model, sparsity, layer_types=('Dense', 'Conv2D')):
+    """Zero the smallest-magnitude kernel weights of each layer in place."""
+    masks = {}
+    for layer in model.layers:
+        if type(layer).__name__ not in layer_types or not layer.get_weights():
+            continue
+        kernel, *rest = layer.get_weights()
+        threshold = np.quantile(np.abs(kernel), sparsity)
+        mask = (np.abs(kernel) > threshold).astype(kernel.dtype)
+        layer.set_weights([kernel * mask, *rest])
+        masks[layer.name] = mask
+    return masks
+
+
+def fine_tune_pruned(model, masks, stream, steps):
+    # Short recovery fine-tune; masks are re-applied so pruned weights stay zero
+    from tensorflow import keras
+
+    class KeepMasks(keras.callbacks.Callback):
+        def on_train_batch_end(self, batch, logs=None):
+            for layer in self.model.layers:
+                if layer.name in masks:
+                    kernel, *rest = layer.get_weights()
+                    layer.set_weights([kernel * masks[layer.name], *rest])
+
+    model.compile(optimizer=keras.optimizers.Adam(1e-4), loss='categorical_crossentropy', metrics=['accuracy'])
+    model.fit(stream.train_dataset(), steps_per_epoch=steps, epochs=1, callbacks=[KeepMasks()], verbose=1)
+
+
+# ============================================
+# TFLITE CONVERSION
+# ============================================
+def convert(model, quantization, calibration=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ('dynamic_int8', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        def representative_dataset():
+            for x in calibration:
+                for i in range(0, len(x), 32):
+                    yield [x[i:i + 32]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Keep float32 input/output so the serving code does not change
+    return converter.convert()
+
+
+# ============================================
+# MEASUREMENT
+# ============================================
+def latency_ms(backend, x, runs):
+    backend.predict(x)  # warm up
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        backend.predict(x)
+        times.append((time.perf_counter() - started) * 1000.0)
+    return {'p50': round(float(np.percentile(times, 50)), 3), 'p99': round(float(np.percentile(times, 99)), 3)}
+
+
+def stream_accuracy(backend, stream):
+    # One validation batch at a time, never the whole split in memory
+    correct = seen = 0
+    for x, y in stream.validation_batches():
+        correct += int((backend.predict(x).argmax(axis=1) == y.argmax(axis=1)).sum())
+        seen += len(y)
+    return correct / max(1, seen)
+
+
+def measure(backend, path, stream, x_sample, baseline, batch_size, runs):
+    accuracy = stream_accuracy(backend, stream)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return {
+        'path': path,
+        'size_bytes': len(raw),
+        'gzip_bytes': len(gzip.compress(raw, compresslevel=6)),
+        'latency_single_ms': latency_ms(backend, x_sample[:1], runs),
+        f'latency_batch{batch_size}_ms': latency_ms(backend, x_sample[:batch_size], max(1, runs // 4)),
+        'accuracy': round(accuracy, 4),
+        'accuracy_delta_vs_baseline': round(accuracy - baseline, 4),
+    }
+
+
+def read_baseline(path='model_accuracy.txt'):
+    try:
+        with open(path, 'r') as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return 0.0
+
+
+def export_variants(model, stream, out_dir='.', prune_levels=(0.5,), fine_tune_steps=0,
+                    calibration_samples=1000, baseline_accuracy=None, max_accuracy_drop=0.01,
+                    batch_size=32, runs=200, report_path='export_report.json',
+                    publish_as='sketch_model.tflite'):
+    from tensorflow import keras
+    from inference import KerasBackend, TFLiteBackend
+
+    baseline = read_baseline() if baseline_accuracy is None else baseline_accuracy
+    calibration = list(calibration_batches(stream, calibration_samples))
+    # Latency inputs only; accuracy streams over the validation split
+    x_sample = np.concatenate([x for x, _ in itertools.islice(stream.validation_batches(),
+                                                              -(-batch_size // stream.batch_size))])
+    os.makedirs(out_dir, exist_ok=True)
+
+    report = {'baseline_accuracy': baseline, 'eval_samples': stream.val_samples, 'variants': {}}
+
+    h5_path = os.path.join(out_dir, 'sketch_model.h5')
+    if not os.path.exists(h5_path):
+        model.save(h5_path)
+    report['variants']['keras_float32'] = measure(KerasBackend(h5_path), h5_path, stream, x_sample,
+                                                  baseline, batch_size, runs)
+
+    candidates = [('float32', model, 'float32'), ('dynamic_int8', model, 'dynamic_int8'), ('int8', model, 'int8')]
+    for level in prune_levels:
+        pruned = keras.models.clone_model(model)
+        pruned.set_weights(model.get_weights())
+        masks = magnitude_prune(pruned, level)
+        if fine_tune_steps:
+            fine_tune_pruned(pruned, masks, stream, fine_tune_steps)
+        candidates.append((f'pruned{int(level * 100)}_int8', pruned, 'int8'))
+
+    for name, variant_model, quantization in candidates:
+        path = os.path.join(out_dir, f'sketch_model.{name}.tflite')
+        with open(path, 'wb') as f:
+            f.write(convert(variant_model, quantization, calibration))
+        report['variants'][name] = measure(TFLiteBackend(path), path, stream, x_sample, baseline, batch_size,
+                                           runs)
+        print(f"✅ {name}: {report['variants'][name]}")
+
+    within_budget = {name: v for name, v in report['variants'].items()
+                     if v['accuracy_delta_vs_baseline'] >= -max_accuracy_drop}
+    if within_budget:
+        report['recommended'] = min(within_budget, key=lambda n: within_budget[n]['latency_single_ms']['p50'])
+
+    if publish_as:
+        # float32 matches the Keras model, so it is the fallback when every
+        # quantized variant is over the accuracy budget
+        tflite = [name for name in within_budget if name != 'keras_float32'] or ['float32']
+        chosen = min(tflite, key=lambda n: report['variants'][n]['latency_single_ms']['p50'])
+        published = os.path.join(out_dir, publish_as)
+        shutil.copyfile(report['variants'][chosen]['path'], published)
+        report['published'] = {'variant': chosen, 'path': published}
+        print(f"✅ Published {chosen} as {published}")
+
+    with open(os.path.join(out_dir, report_path), 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    print(f"\n{'variant':<20} {'size':>10} {'gzip':>10} {'p50 1x':>9} {'p99 1x':>9} {'acc':>8} {'Δacc':>8}")
+    for name, v in report['variants'].items():
+        marker = ' ⭐' if name == report.get('recommended') else ''
+        print(f"{name:<20} {v['size_bytes'] / 1024:>8.0f}KB {v['gzip_bytes'] / 1024:>8.0f}KB "
+              f"{v['latency_single_ms']['p50']:>7.2f}ms {v['latency_single_ms']['p99']:>7.2f}ms "
+              f"{v['accuracy']:>8.2%} {v['accuracy_delta_vs_baseline']:>+8.2%}{marker}")
+
+
+if __name__ == '__main__':
+    import argparse
+    from tensorflow import keras
+
+    parser = argparse.ArgumentParser(description="Export quantized / pruned variants of the sketch model")
+    parser.add_argument('--model', default='sketch_model.h5')
+    parser.add_argument('--categories', default='categories.json')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--prune', default='0.5', help="comma-separated sparsity levels, '' to skip")
+    parser.add_argument('--fine-tune-steps', type=int, default=0)
+    parser.add_argument('--calibration-samples', type=int, default=1000)
+    parser.add_argument('--eval-samples-per-category', type=int, default=500)
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01)
+    parser.add_argument('--publish-as', default='sketch_model.tflite',
+                        help="copy the fastest .tflite variant within budget here, '' to skip")
+    args = parser.parse_args()
+
+    with open(args.categories, 'r') as f:
+        categories = json.load(f)
+    stream = QuickDrawStream(categories, validation_samples_per_category=args.eval_samples_per_category)
+    levels = [float(p) for p in args.prune.split(',') if p.strip()]
+    export_variants(keras.models.load_model(args.model), stream, args.out_dir, levels,
+                    args.fine_tune_steps, args.calibration_samples,
+                    max_accuracy_drop=args.max_accuracy_drop, publish_as=args.publish_as)
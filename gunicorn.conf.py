@@ -0,0 +1,50 @@
+# ============================================
+# GUNICORN CONFIGURATION
+#   gunicorn app:app
+# The app (and, in eager startup mode, the model) is imported once in the
+# master process and shared copy-on-write with every forked worker, so a
+# new worker can serve /api/health immediately.
+#
+# TensorFlow is not fork-safe once its thread pools are running, so
+# preloading is only the default for TF-free backends (numpy, tflite, or a
+# cascade/centroid on top of them). With keras each worker imports the app
+# itself and loads the model in the background; SKETCH_PRELOAD and
+# SKETCH_STARTUP still override both choices.
+#
+# Live prediction sessions (/api/stream) are held in each worker's memory:
+# with workers > 1, route each client to the same worker (sticky load
+# balancing) or run a single worker. Every open event stream occupies one
+# of the worker's threads; SKETCH_STREAM_MAX_OPEN (default threads // 2)
+# keeps the rest free for other requests. Admission limits are derived
+# from GUNICORN_THREADS the same way (see config.py), so tune the thread
+# count rather than the per-class limits.
+# ============================================
+import gc
+import os
+
+
+def uses_tensorflow():
+    backend = os.environ.get('SKETCH_BACKEND', 'keras')
+    if backend in ('cascade', 'centroid'):
+        backend = os.environ.get('SKETCH_BASE_BACKEND', 'keras')
+    return backend == 'keras'
+
+
+preload_app = os.environ.get('SKETCH_PRELOAD', '0' if uses_tensorflow() else '1').lower() in ('1', 'true', 'yes', 'on')
+os.environ.setdefault('SKETCH_STARTUP', 'eager' if preload_app else 'background')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+timeout = 60
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far (model weights included) out of the
+    # GC's reach so collections in the workers do not touch those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    server.log.info("Worker %s forked from preloaded master", worker.pid)
@@ -0,0 +1,356 @@
+# ============================================
+# IMAGE GENERATION PIPELINE (Pollinations)
+# - one pooled requests.Session shared by every worker thread
+# - bounded number of concurrent upstream calls
+# - identical in-flight prompts coalesce onto a single upstream call
+# - generated URLs are cached per prompt (deterministic seed, no timestamp)
+# - optional fire-and-poll jobs that return immediately
+# The upstream base URL is configurable, so the whole pipeline can run
+# against a local stub HTTP server.
+# AsyncImageGenerator is the same pipeline on asyncio + httpx, for
+# asgi_app.py: a waiting upstream call costs a coroutine, not a thread.
+# ============================================
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as ResultTimeout
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = 'https://image.pollinations.ai'
+
+
+class GenerationError(Exception):
+    pass
+
+
+class ImageGenerator:
+    def __init__(self, base_url=DEFAULT_BASE_URL, timeout=15.0, max_concurrency=8,
+                 cache_ttl=3600.0, cache_max_entries=1024, job_ttl=600.0, size=512,
+                 upstream_histogram=None, max_drain_bytes=4 * 1024 * 1024):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self.job_ttl = job_ttl
+        self.size = size
+        self.max_drain_bytes = max_drain_bytes
+        # Optional metrics.Histogram observing upstream call latency (ms)
+        self.upstream_histogram = upstream_histogram
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # prompt -> (url, expires)
+        self._inflight = {}           # prompt -> Future of the leader's call
+        self._jobs = {}               # job_id -> job dict
+
+        self.counters = {'requests': 0, 'cache_hits': 0, 'coalesced': 0,
+                         'upstream_calls': 0, 'upstream_errors': 0, 'jobs_submitted': 0}
+        self._open_transport()
+
+    def _open_transport(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='imagegen')
+
+    # --------------------------------------------
+    # URL building
+    # --------------------------------------------
+    def build_url(self, prompt):
+        # A seed derived from the prompt keeps the URL stable, so browsers,
+        # CDNs and our own cache can reuse the same image
+        seed = int.from_bytes(hashlib.blake2b(prompt.encode('utf-8'), digest_size=4).digest(), 'big')
+        encoded_prompt = requests.utils.quote(prompt)
+        return (f"{self.base_url}/prompt/{encoded_prompt}"
+                f"?width={self.size}&height={self.size}&nologo=true&seed={seed}")
+
+    # --------------------------------------------
+    # Cache lookup and coalescing (shared by both transports)
+    # --------------------------------------------
+    def _claim(self, prompt, new_future):
+        """(cached_url, future, leader): a cache hit, a follower of an in-flight call, or its leader."""
+        with self._lock:
+            self.counters['requests'] += 1
+            cached = self._cache_get(prompt)
+            if cached is not None:
+                self.counters['cache_hits'] += 1
+                return cached, None, False
+            future = self._inflight.get(prompt)
+            if future is not None:
+                self.counters['coalesced'] += 1
+                return None, future, False
+            future = self._inflight[prompt] = new_future()
+            return None, future, True
+
+    def _remember(self, prompt, url):
+        with self._lock:
+            self._cache_put(prompt, url)
+
+    def _forget(self, prompt):
+        # Always runs once the leader is done, even if it was cancelled
+        with self._lock:
+            self._inflight.pop(prompt, None)
+
+    def _upstream_call(self, prompt):
+        with self._lock:
+            self.counters['upstream_calls'] += 1
+        return self.build_url(prompt)
+
+    def _observe_upstream(self, started):
+        if self.upstream_histogram is not None:
+            self.upstream_histogram.observe((time.perf_counter() - started) * 1000.0)
+
+    def _check_status(self, status, image_url):
+        if status == 200:
+            return image_url
+        raise GenerationError(f"Generation failed: Pollinations returned {status}")
+
+    # --------------------------------------------
+    # Synchronous generation
+    # --------------------------------------------
+    def generate(self, prompt, timeout=None):
+        """Image URL for prompt; `timeout` (seconds) caps this call below self.timeout."""
+        cached, future, leader = self._claim(prompt, Future)
+        if cached is not None:
+            return cached
+        if not leader:
+            try:
+                return future.result(timeout=self.timeout * 2 if timeout is None else timeout)
+            except ResultTimeout:
+                raise GenerationError("Image generation timed out")
+
+        try:
+            url = self._fetch(prompt, timeout)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            self._remember(prompt, url)
+            future.set_result(url)
+            return url
+        finally:
+            self._forget(prompt)
+
+    def _fetch(self, prompt, timeout=None):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        deadline = time.monotonic() + timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise GenerationError("Generation failed: too many concurrent image requests")
+        try:
+            image_url = self._upstream_call(prompt)
+            # stream=True: we only need the status line, but the body is still
+            # drained so urllib3 can put the connection back in the pool
+            started = time.perf_counter()
+            try:
+                with self.session.get(image_url, timeout=max(0.001, deadline - time.monotonic()),
+                                      stream=True) as response:
+                    status = response.status_code
+                    self._drain(response)
+            finally:
+                self._observe_upstream(started)
+            return self._check_status(status, image_url)
+        except requests.exceptions.Timeout:
+            self._count_error()
+            raise GenerationError("Image generation timed out")
+        except GenerationError:
+            self._count_error()
+            raise
+        except Exception as e:
+            self._count_error()
+            raise GenerationError(f"Generation failed: {str(e)}")
+        finally:
+            self._slots.release()
+
+    def _drain(self, response):
+        # Past max_drain_bytes it is cheaper to drop the connection
+        drained = 0
+        for chunk in response.iter_content(64 * 1024):
+            drained += len(chunk)
+            if drained > self.max_drain_bytes:
+                break
+
+    def _count_error(self):
+        with self._lock:
+            self.counters['upstream_errors'] += 1
+
+    # --------------------------------------------
+    # Fire-and-poll jobs
+    # --------------------------------------------
+    def submit_job(self, prompt):
+        job_id = uuid.uuid4().hex
+        job = {'job_id': job_id, 'status': 'pending', 'prompt': prompt,
+               'image_url': None, 'error': None, 'created': time.time()}
+        with self._lock:
+            self._expire_jobs()
+            self._jobs[job_id] = job
+            self.counters['jobs_submitted'] += 1
+        self._start_job(job)
+        return job_id
+
+    def _start_job(self, job):
+        self._executor.submit(self._run_job, job)
+
+    def _run_job(self, job):
+        job['status'] = 'running'
+        try:
+            self._finish_job(job, self.generate(job['prompt']))
+        except Exception as e:
+            self._finish_job(job, error=e)
+
+    @staticmethod
+    def _finish_job(job, url=None, error=None):
+        if error is None:
+            job['image_url'] = url
+            job['status'] = 'done'
+        else:
+            job['error'] = str(error)
+            job['status'] = 'failed'
+        job['finished'] = time.time()
+
+    def job_status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _expire_jobs(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j for j, job in self._jobs.items() if job.get('finished', float('inf')) < cutoff]:
+            del self._jobs[job_id]
+
+    # --------------------------------------------
+    # Prompt -> URL cache (caller holds self._lock)
+    # --------------------------------------------
+    def _cache_get(self, prompt):
+        entry = self._cache.get(prompt)
+        if entry is None:
+            return None
+        url, expires = entry
+        if expires < time.monotonic():
+            del self._cache[prompt]
+            return None
+        self._cache.move_to_end(prompt)
+        return url
+
+    def _cache_put(self, prompt, url):
+        self._cache[prompt] = (url, time.monotonic() + self.cache_ttl)
+        self._cache.move_to_end(prompt)
+        while len(self._cache) > self.cache_max_entries:
+            self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, cached_prompts=len(self._cache),
+                        inflight=len(self._inflight), jobs=len(self._jobs))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class AsyncImageGenerator(ImageGenerator):
+    """ImageGenerator for an event loop: only the transport differs.
+
+    Upstream calls go through httpx.AsyncClient, waits are awaited and jobs
+    run as tasks on the serving loop. The lock is only held briefly, never
+    across an await.
+    """
+
+    def _open_transport(self):
+        import httpx
+
+        self.client = httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(
+            max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency))
+        self._slots = None            # asyncio.Semaphore, created on the serving loop
+        self._tasks = set()
+
+    async def agenerate(self, prompt):
+        cached, future, leader = self._claim(prompt, asyncio.get_running_loop().create_future)
+        if cached is not None:
+            return cached
+        if not leader:
+            # shield: a follower giving up must not cancel the leader's result
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout * 2)
+
+        try:
+            url = await self._afetch(prompt)
+        except Exception as e:
+            future.set_exception(e)
+            # Followers may all have timed out; don't warn about an unread exception
+            future.exception()
+            raise
+        else:
+            self._remember(prompt, url)
+            future.set_result(url)
+            return url
+        finally:
+            self._forget(prompt)
+
+    async def _afetch(self, prompt):
+        import httpx
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise GenerationError("Generation failed: too many concurrent image requests")
+        try:
+            image_url = self._upstream_call(prompt)
+            started = time.perf_counter()
+            try:
+                async with self.client.stream('GET', image_url) as response:
+                    status = response.status_code
+                    await self._adrain(response)
+            finally:
+                self._observe_upstream(started)
+            return self._check_status(status, image_url)
+        except httpx.TimeoutException:
+            self._count_error()
+            raise GenerationError("Image generation timed out")
+        except GenerationError:
+            self._count_error()
+            raise
+        except Exception as e:
+            self._count_error()
+            raise GenerationError(f"Generation failed: {str(e)}")
+        finally:
+            self._slots.release()
+
+    async def _adrain(self, response):
+        # Same as _drain: a fully read body lets httpx reuse the connection
+        drained = 0
+        async for chunk in response.aiter_raw():
+            drained += len(chunk)
+            if drained > self.max_drain_bytes:
+                break
+
+    def generate(self, prompt, timeout=None):
+        raise RuntimeError("AsyncImageGenerator.generate: await agenerate() instead")
+
+    def _start_job(self, job):
+        # Keep a reference: the loop only holds tasks weakly
+        task = asyncio.get_running_loop().create_task(self._run_job(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, job):
+        job['status'] = 'running'
+        try:
+            self._finish_job(job, await self.agenerate(job['prompt']))
+        except Exception as e:
+            self._finish_job(job, error=e)
+
+    async def aclose(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await self.client.aclose()
+
+    def close(self):
+        pass
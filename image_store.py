@@ -0,0 +1,192 @@
+# ============================================
+# CONTENT-ADDRESSED STORE FOR GENERATED IMAGES
+#   static/generated/
+#     <blake2b of bytes>.png     image, named by its content
+#     refs/<blake2b of prompt>   which image a (prompt, style) produced
+# - a repeated (prompt, style) is answered from disk, no upstream call
+# - identical images are stored once
+# - writes go to a temp file in the same directory, then os.replace(),
+#   so readers never see a partial file
+# - the directory (images and refs) is kept under max_bytes by deleting
+#   the least recently used images (hits bump the file's mtime) together
+#   with the refs that point at them; the same sweep drops refs whose
+#   image is already gone
+# - a file's name is its strong ETag and never changes, so it can be
+#   cached by clients for a year
+# Safe to share between processes: eviction rescans the directory and
+# losing a race to unlink a file is harmless.
+# ============================================
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+OBJECT_PATTERN = re.compile(r'^[0-9a-f]{32}\.png$')
+REFS_DIR = 'refs'
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ImageStore:
+    def __init__(self, root='static/generated', max_bytes=512 * 1024 * 1024, low_watermark=0.9,
+                 url_prefix='/static/generated'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self.url_prefix = url_prefix.rstrip('/')
+        os.makedirs(os.path.join(root, REFS_DIR), exist_ok=True)
+        self.counters = {'hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._bytes = (sum(size for _, _, size in self._scan())
+                       + sum(size for _, _, size in self._scan_refs()))
+
+    def key(self, prompt, style=''):
+        return _digest(f'{style}\0{prompt}'.encode())
+
+    def url(self, name):
+        return f'{self.url_prefix}/{name}'
+
+    def path(self, name):
+        """Filesystem path of a stored image, or None for names this store never issues."""
+        if not OBJECT_PATTERN.match(name):
+            return None
+        return os.path.join(self.root, name)
+
+    # --------------------------------------------
+    # Lookups and writes
+    # --------------------------------------------
+    def lookup(self, prompt, style=''):
+        """URL of the image stored for (prompt, style), or None."""
+        ref = os.path.join(self.root, REFS_DIR, self.key(prompt, style))
+        name = None
+        try:
+            with open(ref) as f:
+                name = f.read().strip()
+            # Bump for LRU
+            os.utime(os.path.join(self.root, name))
+        except OSError:
+            if name is not None:
+                # The image was evicted; forget the ref too
+                try:
+                    os.unlink(ref)
+                    with self._lock:
+                        self._bytes -= len(name)
+                except OSError:
+                    pass
+            with self._lock:
+                self.counters['misses'] += 1
+            return None
+        with self._lock:
+            self.counters['hits'] += 1
+        return self.url(name)
+
+    def put(self, prompt, style, data):
+        """Store image bytes for (prompt, style) and return their URL."""
+        name = _digest(data) + '.png'
+        path = os.path.join(self.root, name)
+        try:
+            # Bump an existing copy for LRU; another process may evict it
+            # at any moment, so a missing file is simply written again
+            os.utime(path)
+        except FileNotFoundError:
+            self._atomic_write(path, data)
+            with self._lock:
+                self.counters['writes'] += 1
+                self._bytes += len(data)
+        ref = os.path.join(self.root, REFS_DIR, self.key(prompt, style))
+        new_ref = not os.path.exists(ref)
+        self._atomic_write(ref, name.encode())
+        if new_ref:
+            with self._lock:
+                self._bytes += len(name)
+        if self._bytes > self.max_bytes:
+            self.evict()
+        return self.url(name)
+
+    def _atomic_write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    # --------------------------------------------
+    # Eviction
+    # --------------------------------------------
+    def _scan(self):
+        entries = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if OBJECT_PATTERN.match(entry.name):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, entry.name, st.st_size))
+        return entries
+
+    def _scan_refs(self):
+        # (ref file, image it names, ref size)
+        refs = []
+        refs_dir = os.path.join(self.root, REFS_DIR)
+        with os.scandir(refs_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        refs.append((entry.name, f.read().strip(), entry.stat().st_size))
+                except OSError:
+                    continue
+        return refs
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self):
+        """Delete least recently used images, and their refs, until under the low watermark."""
+        with self._lock:
+            # Other processes write here too: trust the directory, not the counter
+            entries = sorted(self._scan())
+            images = {name for _, name, _ in entries}
+            refs_by_image = {}
+            total = sum(size for _, _, size in entries)
+            for ref, name, size in self._scan_refs():
+                total += size
+                if name in images:
+                    refs_by_image.setdefault(name, []).append((ref, size))
+                elif (not os.path.exists(os.path.join(self.root, name))
+                      and self._unlink(os.path.join(self.root, REFS_DIR, ref))):
+                    total -= size  # its image is already gone
+            target = self.max_bytes * self.low_watermark
+            removed = 0
+            for _, name, size in entries:
+                if total <= target:
+                    break
+                removed += self._unlink(os.path.join(self.root, name))
+                total -= size
+                for ref, ref_size in refs_by_image.get(name, ()):
+                    self._unlink(os.path.join(self.root, REFS_DIR, ref))
+                    total -= ref_size
+            self._bytes = total
+            self.counters['evicted'] += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'bytes': self._bytes, 'max_bytes': self.max_bytes}
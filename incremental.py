@@ -0,0 +1,196 @@
+# ============================================
+# INCREMENTAL TRAINING FOR NEW CATEGORIES
+# Adds categories to a trained model without retraining it from scratch:
+#   - the existing model is loaded and its conv backbone frozen
+#     (--freeze all: everything but the head, none: nothing)
+#   - the final Dense(NUM_CLASSES) is widened; old columns keep their
+#     weights, new columns start from the usual initializer
+#   - fine-tuning sees every drawing of the new classes plus a small
+#     replay sample of the old ones (--replay-samples per class), which
+#     make up --replay-fraction of each batch
+#   - categories.json keeps the old class order and appends new ones, so
+#     old label indices (and clients caching them) stay valid
+# The result is published as a new model version (model_registry.py)
+# instead of overwriting sketch_model.h5; --output DIR writes it to a
+# plain directory instead.
+#
+#   python incremental.py giraffe zebra --epochs 3
+#   python bench_incremental.py giraffe zebra    # vs a full retrain
+# ============================================
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from quickdraw_data import QuickDrawStream
+
+FREEZE_MODES = ('all', 'conv', 'none')
+
+
+def fraction(value):
+    # argparse type for --replay-fraction: both 0 and 1 leave nothing to mix
+    value = float(value)
+    if not 0 < value < 1:
+        raise ValueError(value)
+    return value
+
+
+def merge_categories(old, requested):
+    # Old order is kept; new names are appended in the order given
+    return list(old) + [c for c in dict.fromkeys(requested) if c not in old]
+
+
+def widen_model(model, num_classes, freeze='conv'):
+    """Copy of model's layer stack with a num_classes head; old head weights kept."""
+    from tensorflow import keras
+
+    if freeze not in FREEZE_MODES:
+        raise ValueError(f"freeze must be one of {', '.join(FREEZE_MODES)}")
+    old_head = model.layers[-1]
+    kernel, bias = old_head.get_weights()
+    old_classes = kernel.shape[1]
+    if num_classes < old_classes:
+        raise ValueError(f"Model already has {old_classes} classes; cannot shrink to {num_classes}")
+
+    # The backbone layers are shared with model, not copied
+    backbone = model.layers[:-1]
+    for layer in backbone:
+        layer.trainable = freeze == 'none' or (freeze == 'conv' and type(layer).__name__ != 'Conv2D')
+    head = keras.layers.Dense(num_classes, activation='softmax', name=f'head_{num_classes}')
+    widened = keras.Sequential(backbone + [head])
+    widened.build((None, 28, 28, 1))
+
+    new_kernel, new_bias = head.get_weights()
+    new_kernel[:, :old_classes] = kernel
+    new_bias[:old_classes] = bias
+    # New classes start at the old classes' average prior
+    new_bias[old_classes:] = bias.mean()
+    head.set_weights([new_kernel, new_bias])
+    return widened
+
+
+def incremental_stream(categories, old_count, replay_samples=500, replay_fraction=0.3, batch_size=128,
+                       validation_samples_per_category=2000, data_dir='.'):
+    """New classes in full, old ones limited to replay_samples, mixed per replay_fraction."""
+    new = categories[old_count:]
+    limits = {c: replay_samples for c in categories[:old_count]}
+    # Each balanced round holds old classes once and new classes `repeat` times
+    repeat = max(1, round(old_count * (1 - replay_fraction) / (replay_fraction * max(1, len(new)))))
+    repeats = [1] * old_count + [repeat] * len(new)
+    stream = QuickDrawStream(categories, data_dir, batch_size=batch_size, samples_per_category=limits,
+                             validation_samples_per_category=validation_samples_per_category,
+                             class_repeats=repeats)
+    new_rows = sum(stop - start for start, stop in stream.train_ranges[old_count:])
+    steps = max(1, int(new_rows / (batch_size * (1 - replay_fraction))))
+    return stream, steps
+
+
+def evaluation_stream(categories, validation_samples=2000, data_dir='.', batch_size=1024):
+    # Tail rows of every full file: never among the replay rows, same as a full retrain
+    return QuickDrawStream(categories, data_dir, batch_size=batch_size,
+                           validation_samples_per_category=validation_samples)
+
+
+def evaluate(model, stream, old_count):
+    # One validation batch at a time: the whole set is ~3KB per drawing as float32
+    correct, seen = np.zeros(2, dtype=np.int64), np.zeros(2, dtype=np.int64)
+    for x, y in stream.validation_batches():
+        labels = y.argmax(axis=1)
+        hits = model(x, training=False).numpy().argmax(axis=1) == labels
+        is_new = (labels >= old_count).astype(np.int64)
+        correct += np.bincount(is_new, weights=hits, minlength=2).astype(np.int64)
+        seen += np.bincount(is_new, minlength=2)
+    return {
+        'accuracy': round(float(correct.sum() / max(1, seen.sum())), 4),
+        'old_classes_accuracy': round(float(correct[0] / seen[0]), 4) if seen[0] else None,
+        'new_classes_accuracy': round(float(correct[1] / seen[1]), 4) if seen[1] else None,
+    }
+
+
+def train_incremental(model, old_categories, requested, epochs=3, freeze='conv', replay_samples=500,
+                      replay_fraction=0.3, learning_rate=1e-3, batch_size=128, validation_samples=2000,
+                      data_dir='.'):
+    from tensorflow import keras
+
+    if not 0 < replay_fraction < 1:
+        raise ValueError(f"replay_fraction must be between 0 and 1 (exclusive), got {replay_fraction}")
+    if model.output_shape[-1] != len(old_categories):
+        raise ValueError(f"Model has {model.output_shape[-1]} outputs but {len(old_categories)} categories")
+    categories = merge_categories(old_categories, requested)
+    if len(categories) == len(old_categories):
+        raise ValueError("No new categories to add")
+    widened = widen_model(model, len(categories), freeze)
+    widened.compile(optimizer=keras.optimizers.Adam(learning_rate), loss='categorical_crossentropy',
+                    metrics=['accuracy'])
+
+    stream, steps = incremental_stream(categories, len(old_categories), replay_samples, replay_fraction,
+                                       batch_size, validation_samples, data_dir)
+    started = time.perf_counter()
+    widened.fit(stream.train_dataset(), steps_per_epoch=steps, epochs=epochs, verbose=1)
+    train_seconds = time.perf_counter() - started
+
+    evaluation = evaluation_stream(categories, validation_samples, data_dir)
+    report = {'categories': len(categories), 'new_categories': categories[len(old_categories):],
+              'freeze': freeze, 'epochs': epochs, 'steps_per_epoch': steps,
+              'train_seconds': round(train_seconds, 1), **evaluate(widened, evaluation, len(old_categories))}
+    return widened, categories, report
+
+
+def save_model(model, categories, accuracy, out_dir):
+    from inference import export_numpy_weights
+
+    os.makedirs(out_dir, exist_ok=True)
+    model.save(os.path.join(out_dir, 'sketch_model.h5'))
+    export_numpy_weights(model, os.path.join(out_dir, 'sketch_model.npz'))
+    with open(os.path.join(out_dir, 'categories.json'), 'w') as f:
+        json.dump(categories, f)
+    with open(os.path.join(out_dir, 'model_accuracy.txt'), 'w') as f:
+        f.write(str(accuracy))
+    return out_dir
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Add categories to a trained model without a full retrain")
+    parser.add_argument('categories', nargs='+', help="categories to add")
+    parser.add_argument('--model', default='sketch_model.h5')
+    parser.add_argument('--old-categories', default='categories.json')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--freeze', choices=FREEZE_MODES, default='conv')
+    parser.add_argument('--replay-samples', type=int, default=500,
+                        help="drawings read per old class (80%% trained on)")
+    parser.add_argument('--replay-fraction', type=fraction, default=0.3,
+                        help="share of each batch from old classes, between 0 and 1")
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--output', help="write the model files here instead of publishing a version")
+    parser.add_argument('--models-dir', default='models')
+    args = parser.parse_args()
+
+    from tensorflow import keras
+    from downloader import download_categories
+
+    with open(args.old_categories) as f:
+        old_categories = json.load(f)
+    download_categories(args.categories)
+    base = keras.models.load_model(args.model, compile=False)
+    model, categories, report = train_incremental(base, old_categories, args.categories, args.epochs,
+                                                  args.freeze, args.replay_samples, args.replay_fraction,
+                                                  args.learning_rate)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        save_model(model, categories, report['accuracy'], args.output)
+        print(f"✅ Model with {len(categories)} categories saved to {args.output}")
+    else:
+        from model_registry import publish_version
+        staging = tempfile.mkdtemp(prefix='incremental_')
+        try:
+            save_model(model, categories, report['accuracy'], staging)
+            version, _ = publish_version(args.models_dir, source_dir=staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        print(f"✅ Published model version {version} with {len(categories)} categories")
@@ -0,0 +1,334 @@
+# ============================================
+# SERVING BACKENDS
+# Interchangeable ways to run the sketch CNN, selected with
+# SKETCH_BACKEND:
+#   keras  - loads sketch_model.h5 once and calls a traced tf.function
+#            (no per-call tf.data pipeline like model.predict builds)
+#   numpy  - pure NumPy Conv2D/MaxPool/Dense forward pass over weights
+#            exported to .npz, so workers never import TensorFlow
+#   tflite - a quantized / pruned .tflite file from export_model.py
+#   cascade, centroid - scalable classification modes built on top of
+#            these (see cascade.py)
+# All expose predict(batch) taking float32 (N, 28, 28, 1) in [0, 1]
+# and returning float32 (N, num_classes) probabilities; keras and numpy
+# also expose embed(batch), the penultimate-layer activations.
+#
+#   python inference.py --export          # h5 -> npz
+#   python inference.py --verify          # numpy output == keras output (writes nothing)
+# ============================================
+import io
+import json
+import os
+import threading
+
+import numpy as np
+
+INPUT_SHAPE = (28, 28, 1)
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path='sketch_model.h5'):
+        import tensorflow as tf
+        from tensorflow import keras
+
+        self.model_path = model_path
+        self.model = keras.models.load_model(model_path, compile=False)
+        model = self.model
+
+        # One trace covers every batch size thanks to the None dimension
+        @tf.function(input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)])
+        def forward(x):
+            return model(x, training=False)
+
+        self._forward = forward
+        self._embed = None
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32).reshape((-1,) + INPUT_SHAPE)
+        return self._forward(batch).numpy()
+
+    def embed(self, batch):
+        if self._embed is None:
+            import tensorflow as tf
+            from tensorflow import keras
+            # Output of the last hidden Dense layer (Dropout is a no-op at inference)
+            dense = [layer for layer in self.model.layers if type(layer).__name__ == 'Dense']
+            embedder = keras.Model(self.model.inputs, dense[-2].output)
+            self._embed = tf.function(lambda x: embedder(x, training=False),
+                                      input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)])
+        batch = np.asarray(batch, dtype=np.float32).reshape((-1,) + INPUT_SHAPE)
+        return self._embed(batch).numpy()
+
+
+class TFLiteBackend:
+    name = 'tflite'
+    # Batches are zero-padded up to one of these sizes, each with its own
+    # interpreter, so a new batch size never re-allocates tensors; larger
+    # batches run in chunks of the biggest size
+    BATCH_SIZES = (1, 8, 32, 128)
+
+    def __init__(self, model_path='sketch_model.tflite', num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter  # small, TF-free wheel
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.model_path = model_path
+        self._new_interpreter = lambda: Interpreter(model_path=model_path, num_threads=num_threads)
+        self._interpreters = {}
+        self._lock = threading.Lock()  # an Interpreter is not thread-safe
+        self._interpreter(self.BATCH_SIZES[0])
+
+    def _interpreter(self, size):
+        # (interpreter, input index, output index) sized for `size` rows
+        if size not in self._interpreters:
+            interpreter = self._new_interpreter()
+            index = interpreter.get_input_details()[0]['index']
+            interpreter.resize_tensor_input(index, (size,) + INPUT_SHAPE)
+            interpreter.allocate_tensors()
+            self._interpreters[size] = (interpreter, index, interpreter.get_output_details()[0]['index'])
+        return self._interpreters[size]
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32).reshape((-1,) + INPUT_SHAPE)
+        largest = self.BATCH_SIZES[-1]
+        if len(batch) > largest:
+            return np.concatenate([self.predict(batch[i:i + largest]) for i in range(0, len(batch), largest)])
+        rows = len(batch)
+        size = next(size for size in self.BATCH_SIZES if size >= rows)
+        if size != rows:
+            batch = np.concatenate([batch, np.zeros((size - rows,) + INPUT_SHAPE, dtype=np.float32)])
+        with self._lock:
+            interpreter, input_index, output_index = self._interpreter(size)
+            interpreter.set_tensor(input_index, batch)
+            interpreter.invoke()
+            return interpreter.get_tensor(output_index)[:rows].copy()
+
+
+# ============================================
+# PURE NUMPY FORWARD PASS
+# ============================================
+def _activation(x, name):
+    if name in (None, 'linear'):
+        return x
+    if name == 'relu':
+        return np.maximum(x, 0, out=x)
+    if name == 'softmax':
+        x = x - x.max(axis=-1, keepdims=True)
+        np.exp(x, out=x)
+        x /= x.sum(axis=-1, keepdims=True)
+        return x
+    raise ValueError(f"Unsupported activation: {name}")
+
+
+def _pad_same(x, kh, kw, sh, sw):
+    h, w = x.shape[1], x.shape[2]
+    out_h, out_w = -(-h // sh), -(-w // sw)
+    pad_h = max((out_h - 1) * sh + kh - h, 0)
+    pad_w = max((out_w - 1) * sw + kw - w, 0)
+    return np.pad(x, ((0, 0),
+                      (pad_h // 2, pad_h - pad_h // 2),
+                      (pad_w // 2, pad_w - pad_w // 2),
+                      (0, 0)))
+
+
+def conv2d(x, kernel, bias, strides=(1, 1), padding='valid', matrix=None):
+    # `matrix` is the kernel pre-reshaped to (C*kh*kw, F); pass it to skip the transpose
+    kh, kw, cin, cout = kernel.shape
+    sh, sw = strides
+    if padding == 'same':
+        x = _pad_same(x, kh, kw, sh, sw)
+    # (N, H', W', C, kh, kw) view, no copy until the matmul
+    windows = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis=(1, 2))
+    windows = windows[:, ::sh, ::sw]
+    n, oh, ow = windows.shape[:3]
+    cols = windows.reshape(n * oh * ow, cin * kh * kw)
+    if matrix is None:
+        matrix = kernel.transpose(2, 0, 1, 3).reshape(cin * kh * kw, cout)
+    out = cols @ matrix
+    out += bias
+    return out.reshape(n, oh, ow, cout)
+
+
+def max_pool2d(x, pool_size=(2, 2), strides=None, padding='valid'):
+    ph, pw = pool_size
+    sh, sw = strides or pool_size
+    if padding == 'same':
+        x = _pad_same(x, ph, pw, sh, sw)
+    if (sh, sw) == (ph, pw):
+        n, h, w, c = x.shape
+        x = x[:, :h - h % ph, :w - w % pw]
+        return x.reshape(n, h // ph, ph, w // pw, pw, c).max(axis=(2, 4))
+    windows = np.lib.stride_tricks.sliding_window_view(x, (ph, pw), axis=(1, 2))
+    return windows[:, ::sh, ::sw].max(axis=(-2, -1))
+
+
+def export_numpy_weights(model, path):
+    """Write the layer stack and weights of a Keras Sequential model to .npz."""
+    spec, arrays = [], {}
+    for i, layer in enumerate(model.layers):
+        kind = type(layer).__name__
+        cfg = layer.get_config()
+        if kind == 'Conv2D':
+            kernel, bias = layer.get_weights()
+            spec.append({'type': 'conv2d', 'strides': list(cfg['strides']),
+                         'padding': cfg['padding'], 'activation': cfg['activation']})
+        elif kind == 'Dense':
+            kernel, bias = layer.get_weights()
+            spec.append({'type': 'dense', 'activation': cfg['activation']})
+        elif kind == 'MaxPooling2D':
+            spec.append({'type': 'maxpool2d', 'pool_size': list(cfg['pool_size']),
+                         'strides': list(cfg['strides'] or cfg['pool_size']),
+                         'padding': cfg['padding']})
+            continue
+        elif kind == 'Flatten':
+            spec.append({'type': 'flatten'})
+            continue
+        elif kind in ('Dropout', 'InputLayer'):
+            continue
+        else:
+            raise ValueError(f"Layer {layer.name} ({kind}) is not supported by the NumPy backend")
+        idx = len(spec) - 1
+        arrays[f'kernel_{idx}'] = kernel.astype(np.float32)
+        arrays[f'bias_{idx}'] = bias.astype(np.float32)
+
+    np.savez(path, __spec__=np.array(json.dumps(spec)), **arrays)
+    return path
+
+
+class NumpyBackend:
+    name = 'numpy'
+
+    def __init__(self, weights_path='sketch_model.npz', spec=None, weights=None):
+        self.weights_path = weights_path
+        if spec is None:
+            data = np.load(weights_path)
+            spec = json.loads(str(data['__spec__']))
+            weights = {k: data[k] for k in data.files if k != '__spec__'}
+        self.spec = spec
+        self.weights = dict(weights)
+        # Cached (C*kh*kw, F) matrices so conv layers skip the transpose per call
+        for idx, layer in enumerate(self.spec):
+            if layer['type'] == 'conv2d' and f'convmat_{idx}' not in self.weights:
+                k = self.weights[f'kernel_{idx}']
+                self.weights[f'convmat_{idx}'] = np.ascontiguousarray(
+                    k.transpose(2, 0, 1, 3).reshape(-1, k.shape[3]))
+
+    @classmethod
+    def from_arrays(cls, spec, weights):
+        # Build over existing buffers (e.g. shared memory) without copying
+        return cls(weights_path=None, spec=spec, weights=weights)
+
+    @property
+    def num_classes(self):
+        last = max(i for i, layer in enumerate(self.spec) if layer['type'] == 'dense')
+        return self.weights[f'bias_{last}'].shape[0]
+
+    def predict(self, batch):
+        return self._forward(batch, len(self.spec))
+
+    def embed(self, batch):
+        # Everything up to (not including) the classification layer
+        last = max(i for i, layer in enumerate(self.spec) if layer['type'] == 'dense')
+        return self._forward(batch, last)
+
+    def _forward(self, batch, stop):
+        x = np.asarray(batch, dtype=np.float32).reshape((-1,) + INPUT_SHAPE)
+        for idx, layer in enumerate(self.spec[:stop]):
+            kind = layer['type']
+            if kind == 'conv2d':
+                x = conv2d(x, self.weights[f'kernel_{idx}'], self.weights[f'bias_{idx}'],
+                           layer['strides'], layer['padding'], matrix=self.weights[f'convmat_{idx}'])
+                x = _activation(x, layer['activation'])
+            elif kind == 'maxpool2d':
+                x = max_pool2d(x, layer['pool_size'], layer['strides'], layer['padding'])
+            elif kind == 'flatten':
+                x = x.reshape(x.shape[0], -1)
+            elif kind == 'dense':
+                x = x @ self.weights[f'kernel_{idx}']
+                x += self.weights[f'bias_{idx}']
+                x = _activation(x, layer['activation'])
+        return x
+
+
+def load_backend(kind='keras', model_path='sketch_model.h5', weights_path='sketch_model.npz',
+                 tflite_path='sketch_model.tflite', fast_weights_path='sketch_model_fast.npz',
+                 centroids_path='sketch_centroids.npz', cascade_threshold=0.9, base_kind='keras'):
+    if kind in ('cascade', 'centroid'):
+        # base_kind picks the backend used for the full model / the embedding backbone
+        from cascade import CascadeBackend, CentroidBackend
+        base = load_backend(base_kind, model_path, weights_path, tflite_path)
+        if kind == 'cascade':
+            return CascadeBackend(NumpyBackend(fast_weights_path), base, threshold=cascade_threshold)
+        return CentroidBackend.load(centroids_path, base)
+    if kind == 'keras':
+        return KerasBackend(model_path)
+    if kind == 'tflite':
+        return TFLiteBackend(tflite_path)
+    if kind == 'numpy':
+        if not os.path.exists(weights_path) or (
+                os.path.exists(model_path) and os.path.getmtime(model_path) > os.path.getmtime(weights_path)):
+            # One-off export; needs TensorFlow, but only the first time
+            from tensorflow import keras
+            print(f"Exporting NumPy weights to {weights_path}...")
+            export_numpy_weights(keras.models.load_model(model_path, compile=False), weights_path)
+        return NumpyBackend(weights_path)
+    raise ValueError(f"Unknown inference backend: {kind!r} "
+                     f"(expected 'keras', 'numpy', 'tflite', 'cascade' or 'centroid')")
+
+
+def verify(model_path='sketch_model.h5', weights_path=None, samples=256, atol=1e-4):
+    """Check that the NumPy backend matches Keras on random and real inputs.
+
+    Read-only: checks weights_path if given, otherwise a fresh in-memory export.
+    """
+    from tensorflow import keras
+
+    model = keras.models.load_model(model_path, compile=False)
+    if weights_path is None:
+        weights_path = io.BytesIO()
+        export_numpy_weights(model, weights_path)
+        weights_path.seek(0)
+    np_backend = NumpyBackend(weights_path)
+
+    rng = np.random.default_rng(0)
+    batch = rng.random((samples,) + INPUT_SHAPE, dtype=np.float32)
+    try:
+        with open('categories.json') as f:
+            first = json.load(f)[0]
+        real = np.load(f'{first}.npy', mmap_mode='r')[:samples]
+        batch = np.concatenate([batch, real.reshape((-1,) + INPUT_SHAPE).astype(np.float32) / 255.0])
+    except (OSError, ValueError):
+        pass
+
+    expected = model(batch, training=False).numpy()
+    actual = np_backend.predict(batch)
+    max_err = float(np.abs(expected - actual).max())
+    argmax_agree = float((expected.argmax(1) == actual.argmax(1)).mean())
+    ok = max_err <= atol
+    print(f"{'✅' if ok else '❌'} max |keras - numpy| = {max_err:.2e} (atol {atol:.0e}), "
+          f"argmax agreement {argmax_agree:.2%} over {len(batch)} inputs")
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Export or verify the NumPy inference backend")
+    parser.add_argument('--model', default='sketch_model.h5')
+    parser.add_argument('--weights', default='sketch_model.npz',
+                        help="written by --export; checked by --verify when used together")
+    parser.add_argument('--export', action='store_true', help="write NumPy weights from the .h5 model")
+    parser.add_argument('--verify', action='store_true', help="compare NumPy and Keras outputs")
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    if args.export:
+        from tensorflow import keras
+        export_numpy_weights(keras.models.load_model(args.model, compile=False), args.weights)
+        print(f"✅ Exported {args.model} -> {args.weights}")
+    if args.verify:
+        sys.exit(0 if verify(args.model, args.weights if args.export else None, atol=args.atol) else 1)
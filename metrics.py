@@ -0,0 +1,190 @@
+# ============================================
+# LIGHTWEIGHT IN-PROCESS METRICS
+# Histograms and counters cheap enough for the request path (one lock,
+# no allocation per observation), rendered in the Prometheus text format
+# by Registry.render() for the /metrics endpoint. Each process keeps its
+# own values; under gunicorn every worker exposes its own series.
+# ============================================
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds; the last bucket is +Inf
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+LATENCY_MS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    """Fixed-bucket histogram, safe to observe from many threads."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time_ms(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - started) * 1000.0)
+
+    def raw(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def snapshot(self):
+        counts, total, count = self.raw()
+        labels = [str(b) for b in self.buckets] + ['+Inf']
+        return {
+            'count': count,
+            'sum': round(total, 4),
+            'mean': round(total / count, 4) if count else 0.0,
+            'buckets': dict(zip(labels, counts)),
+        }
+
+
+class Counter:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+# ============================================
+# LABELLED FAMILIES AND PROMETHEUS RENDERING
+# ============================================
+class _Family:
+    def __init__(self, name, help_text, metric_type, labelnames, factory):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        key = tuple(str(v) for v in values) or tuple(str(kwargs[n]) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+def _label_str(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + '}'
+
+
+def _fmt(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _render_histogram(lines, name, labelnames, labelvalues, histogram):
+    counts, total, count = histogram.raw()
+    cumulative = 0
+    for bound, n in zip(list(histogram.buckets) + [float('inf')], counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{_label_str(labelnames, labelvalues, [('le', _fmt(bound))])} {cumulative}")
+    lines.append(f"{name}_sum{_label_str(labelnames, labelvalues)} {_fmt(float(total))}")
+    lines.append(f"{name}_count{_label_str(labelnames, labelvalues)} {count}")
+
+
+class Registry:
+    """Named metric families plus callbacks for state owned elsewhere
+    (batcher, caches, worker pool), rendered on demand."""
+
+    def __init__(self, prefix='sketch'):
+        self.prefix = prefix
+        self._families = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _family(self, name, help_text, metric_type, labelnames, factory):
+        full_name = f"{self.prefix}_{name}"
+        with self._lock:
+            family = self._families.get(full_name)
+            if family is None:
+                family = self._families[full_name] = _Family(full_name, help_text, metric_type,
+                                                             labelnames, factory)
+        return family
+
+    def histogram(self, name, help_text, buckets=LATENCY_MS_BUCKETS, labelnames=()):
+        return self._family(name, help_text, 'histogram', labelnames, lambda: Histogram(buckets))
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._family(name, help_text, 'counter', labelnames, Counter)
+
+    def register_collector(self, fn):
+        """fn() -> iterable of (name, type, help, [(labels_dict, value_or_histogram), ...])"""
+        self._collectors.append(fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            for labelvalues, child in family.children():
+                if family.type == 'histogram':
+                    _render_histogram(lines, family.name, family.labelnames, labelvalues, child)
+                else:
+                    lines.append(f"{family.name}{_label_str(family.labelnames, labelvalues)} {child.value}")
+
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {metric_type}")
+                for labels, value in samples:
+                    names, values = tuple(labels), tuple(labels.values())
+                    if isinstance(value, Histogram):
+                        _render_histogram(lines, full_name, names, values, value)
+                    elif value is not None:
+                        lines.append(f"{full_name}{_label_str(names, values)} {_fmt(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Hot-path stage latencies: /api/predict (base64, decode, resize,
+# inference, serialize) and /api/generate-image (upstream)
+STAGE_LATENCY = REGISTRY.histogram('stage_duration_milliseconds', 'Time spent in each request stage',
+                                   labelnames=('endpoint', 'stage'))
+REQUEST_LATENCY = REGISTRY.histogram('request_duration_milliseconds', 'End-to-end request handling time',
+                                     labelnames=('endpoint', 'status'))
+REQUESTS = REGISTRY.counter('requests_total', 'Requests handled', labelnames=('endpoint', 'status'))
+
+
+def stage(endpoint, name):
+    return STAGE_LATENCY.labels(endpoint, name).time_ms()
@@ -0,0 +1,119 @@
+# ============================================
+# MODEL LOADING AND READINESS
+# Lets app.py import in milliseconds and bring the model up in one of
+# three startup modes (SKETCH_STARTUP):
+#   eager      - load at import time (default; pairs with gunicorn
+#                preload_app so forked workers share the weights)
+#   background - start a warmup thread at import, serve liveness at once
+#   lazy       - load on the first request that needs the model
+# ============================================
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STARTUP_MODES = ('eager', 'background', 'lazy')
+
+
+class ModelNotReady(Exception):
+    pass
+
+
+class StartupTimer:
+    """Records how long each named startup phase took, in milliseconds."""
+
+    def __init__(self):
+        self.phases = {}
+
+    def record(self, name, started):
+        self.phases[name] = round((time.perf_counter() - started) * 1000.0, 2)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+
+class ModelLoader:
+    def __init__(self, load_fn, mode='eager', timer=None):
+        if mode not in STARTUP_MODES:
+            raise ValueError(f"Unknown startup mode {mode!r}, expected one of {', '.join(STARTUP_MODES)}")
+        self.load_fn = load_fn
+        self.mode = mode
+        self.timer = timer or StartupTimer()
+        self.state = 'not_loaded'
+        self.error = None
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        if self.mode == 'eager':
+            self.load()
+        elif self.mode == 'background':
+            self._start_thread()
+
+    def _start_thread(self):
+        threading.Thread(target=self._load_quietly, name='model-warmup', daemon=True).start()
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception:
+            pass  # recorded in self.error, reported by readiness
+
+    def load(self):
+        with self._lock:
+            if self.ready:
+                return
+            self.state = 'loading'
+            started = time.perf_counter()
+            try:
+                self.load_fn()
+            except Exception as e:
+                self.state = 'failed'
+                self.error = str(e)
+                print(f"❌ Model load failed: {e}")
+                raise
+            self.timer.record('model_ready', started)
+            self.state = 'ready'
+            self.error = None
+            self._ready.set()
+
+    def ensure_ready(self, timeout=None):
+        if self.ready:
+            return
+        if self.mode == 'lazy' or self.state == 'failed':
+            try:
+                self.load()
+            except Exception as e:
+                raise ModelNotReady(f"Model failed to load: {e}")
+            return
+        if not self._ready.wait(timeout):
+            raise ModelNotReady("Model is still loading")
+
+    def after_fork(self):
+        # A warmup thread does not survive fork(); restart it in the child
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        if not self.ready and self.state == 'loading':
+            self.state = 'not_loaded'
+            if self.mode == 'background':
+                self._start_thread()
+
+    def status(self):
+        return {
+            'mode': self.mode,
+            'state': self.state,
+            'ready': self.ready,
+            'error': self.error,
+            'pid': self.pid,
+            'startup_ms': dict(self.timer.phases),
+        }
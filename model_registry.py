@@ -0,0 +1,508 @@
+# ============================================
+# MODEL REGISTRY WITH HOT RELOAD
+# Versioned model directories:
+#   models/
+#     CURRENT                 <- name of the version to serve
+#     20251208-093000/        <- sketch_model.h5 / .npz / .tflite,
+#     20251215-101500/           categories.json, model_accuracy.txt
+# Without a models/ directory the top-level files are a single version
+# called 'default'.
+#
+# A new version is loaded and warmed in a background thread, then swapped
+# in atomically. Requests hold a reference to the version they started
+# on, and a retired version is closed (batcher, worker pool, weights) as
+# soon as its last request finishes. Other versions can stay loaded next
+# to the active one for per-request A/B comparisons.
+#
+#   python model_registry.py --publish            # top-level files -> new version, make it CURRENT
+#   python model_registry.py --activate VERSION   # point CURRENT at an existing version
+#   python model_registry.py --list
+# ============================================
+import ctypes
+import gc
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+LEGACY_VERSION = 'default'
+CURRENT_FILE = 'CURRENT'
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+MODEL_FILES = ('sketch_model.h5', 'sketch_model.npz', 'sketch_model.tflite', 'sketch_model_fast.npz',
+               'sketch_centroids.npz', 'categories.json', 'model_accuracy.txt')
+
+
+def version_file(path, configured):
+    # Inside a version directory every file keeps its configured name
+    return configured if path is None else os.path.join(path, os.path.basename(configured))
+
+
+class UnknownModelVersion(KeyError):
+    pass
+
+
+# ============================================
+# MEMORY ACCOUNTING
+# ============================================
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def backend_nbytes(backend):
+    """Bytes of weights a backend holds (best effort, counted once at load)."""
+    if backend is None:
+        return 0
+    total = 0
+    weights = getattr(backend, 'weights', None)
+    if isinstance(weights, dict):
+        total += sum(getattr(w, 'nbytes', 0) for w in weights.values())
+    model = getattr(backend, 'model', None)
+    if model is not None and hasattr(model, 'weights'):
+        total += sum(int(w.numpy().nbytes) for w in model.weights)
+    if getattr(backend, 'name', None) == 'tflite':
+        total += os.path.getsize(backend.model_path)
+    centroids = getattr(backend, 'centroids', None)
+    if centroids is not None:
+        total += centroids.nbytes
+    # cascade / centroid backends wrap other backends
+    for attr in ('fast', 'full', 'embedder'):
+        total += backend_nbytes(getattr(backend, attr, None))
+    return total
+
+
+def release_memory():
+    # Collect dropped weights and hand freed heap pages back to the OS
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+# ============================================
+# ONE LOADED VERSION
+# ============================================
+class ModelVersion:
+    _generations = 0
+
+    def __init__(self, version, path, backend, categories, accuracy=0.0):
+        ModelVersion._generations += 1
+        self.version = version
+        self.path = path
+        self.backend = backend
+        self.categories = list(categories)
+        self.num_classes = len(self.categories)
+        self.accuracy = accuracy
+        # Distinguishes reloads of the same version name (prediction cache keys)
+        self.generation = ModelVersion._generations
+        self.batcher = None
+        self.pool = None
+        self.similar = None
+        self.weights_bytes = backend_nbytes(backend)
+        self.rss_delta_bytes = None
+        self.load_ms = None
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+        self.refs = 0
+        self.retired = False
+        self.released = False
+        self.closed = False
+
+    @property
+    def cache_namespace(self):
+        return f'{self.version}#{self.generation}'.encode()
+
+    def predict(self, batch):
+        return self.backend.predict(batch)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.pool is not None:
+            self.pool.close()
+        self.batcher = self.pool = self.backend = self.similar = None
+
+    def info(self):
+        return {
+            'version': self.version,
+            'backend': self.backend.name if self.backend is not None else None,
+            'num_categories': self.num_classes,
+            'accuracy': self.accuracy,
+            'weights_bytes': self.weights_bytes,
+            'rss_delta_bytes': self.rss_delta_bytes,
+            'load_ms': self.load_ms,
+            'loaded_at': self.loaded_at,
+            'in_flight': self.refs,
+            'worker_pool': self.pool is not None,
+            'similar_index': self.similar.stats() if self.similar is not None else None,
+        }
+
+
+# ============================================
+# REGISTRY
+# ============================================
+class ModelRegistry:
+    """Loads, swaps and releases ModelVersions.
+
+    `build_fn(version, path, serving)` loads and warms one version and
+    returns a ModelVersion; `path` is None for the legacy top-level layout
+    and `serving` is True when the version is about to become active.
+    `attach_fn(model)` readies an already-loaded version (see load()) for
+    serving before it becomes active; `on_activate(model)` runs right
+    after each swap.
+    """
+
+    def __init__(self, build_fn, root='models', max_loaded=2, watch_interval=0.0,
+                 legacy_files=(), on_activate=None, attach_fn=None):
+        self.build_fn = build_fn
+        self.attach_fn = attach_fn
+        self.root = root
+        self.max_loaded = max(1, max_loaded)
+        self.watch_interval = watch_interval
+        self.legacy_files = tuple(legacy_files)
+        self.on_activate = on_activate
+
+        self._active = None
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()   # one load at a time; serving never waits on it
+        self._pending = None
+        self._watcher = None
+        self._stop = threading.Event()
+        self.counters = {'activations': 0, 'releases': 0, 'load_failures': 0, 'released_rss_bytes': 0}
+
+    # --------------------------------------------
+    # Layout
+    # --------------------------------------------
+    @property
+    def versioned(self):
+        return os.path.isdir(self.root)
+
+    def available(self):
+        if not self.versioned:
+            return [LEGACY_VERSION]
+        return sorted(name for name in os.listdir(self.root)
+                      if VERSION_PATTERN.match(name)
+                      and os.path.isfile(os.path.join(self.root, name, 'categories.json')))
+
+    def path_for(self, version):
+        if not self.versioned:
+            if version != LEGACY_VERSION:
+                raise UnknownModelVersion(version)
+            return None
+        if not VERSION_PATTERN.match(version or '') or version not in self.available():
+            raise UnknownModelVersion(version)
+        return os.path.join(self.root, version)
+
+    def current_version(self):
+        if not self.versioned:
+            return LEGACY_VERSION
+        available = self.available()
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                current = f.read().strip()
+            if current in available:
+                return current
+        except OSError:
+            pass
+        if not available:
+            raise FileNotFoundError(f"No model versions in {self.root}/")
+        return available[-1]
+
+    # --------------------------------------------
+    # Loading and swapping
+    # --------------------------------------------
+    @property
+    def active(self):
+        return self._active
+
+    def loaded(self):
+        with self._lock:
+            return list(self._loaded.values())
+
+    def _build(self, version, serving):
+        path = self.path_for(version)
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        try:
+            model = self.build_fn(version, path, serving)
+        except Exception:
+            self.counters['load_failures'] += 1
+            raise
+        model.load_ms = round((time.perf_counter() - started) * 1000.0, 2)
+        rss_after = rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            model.rss_delta_bytes = rss_after - rss_before
+        return model
+
+    def activate(self, version=None, reload=False):
+        """Load (or reuse) `version`, then make it the one unpinned requests get."""
+        version = version or self.current_version()
+        with self._load_lock:
+            model = None if reload else self._loaded.get(version)
+            if model is None:
+                model = self._build(version, serving=True)
+            elif self.attach_fn is not None:
+                self.attach_fn(model)
+            with self._lock:
+                previous = self._active
+                replaced = self._loaded.get(version)
+                self._loaded[version] = model
+                self._active = model
+                self.counters['activations'] += 1
+            if self.on_activate is not None:
+                self.on_activate(model)
+            for old in {previous, replaced} - {None, model}:
+                self._retire(old)
+            self._evict()
+        return model
+
+    def load(self, version):
+        """Load `version` next to the active one (for per-request selection)."""
+        with self._load_lock:
+            model = self._loaded.get(version)
+            if model is None:
+                model = self._build(version, serving=False)
+                with self._lock:
+                    self._loaded[version] = model
+                self._evict(keep=model)
+        return model
+
+    def unload(self, version):
+        with self._lock:
+            model = self._loaded.get(version)
+            if model is None:
+                raise UnknownModelVersion(version)
+            if model is self._active:
+                raise ValueError(f"Version {version} is active; activate another version first")
+        self._retire(model)
+
+    def _evict(self, keep=None):
+        # Least recently used extra versions go first; the active one never does
+        while True:
+            with self._lock:
+                if len(self._loaded) <= self.max_loaded:
+                    return
+                candidates = [m for m in self._loaded.values() if m is not self._active and m is not keep]
+                if not candidates:
+                    return
+                victim = min(candidates, key=lambda m: m.last_used)
+            self._retire(victim)
+
+    def _retire(self, model):
+        with self._lock:
+            if self._loaded.get(model.version) is model:
+                del self._loaded[model.version]
+            model.retired = True
+            idle = model.refs == 0
+        if idle:
+            self._release(model)
+
+    def _release(self, model):
+        with self._lock:
+            if model.released:
+                return
+            model.released = True
+        before = rss_bytes()
+        model.close()
+        release_memory()
+        after = rss_bytes()
+        self.counters['releases'] += 1
+        if before is not None and after is not None:
+            self.counters['released_rss_bytes'] += max(0, before - after)
+
+    @contextmanager
+    def acquire(self, version=None):
+        """Pin a version for the duration of one request."""
+        with self._lock:
+            model = self._active if not version else self._loaded.get(version)
+            if model is None:
+                if version:
+                    raise UnknownModelVersion(version)
+                raise RuntimeError("No model version is active")
+            model.refs += 1
+            model.last_used = time.monotonic()
+        try:
+            yield model
+        finally:
+            with self._lock:
+                model.refs -= 1
+                release = model.retired and model.refs == 0
+            if release:
+                self._release(model)
+
+    # --------------------------------------------
+    # Background reloads
+    # --------------------------------------------
+    def reload_async(self, version=None, activate=True):
+        """Start loading in the background; returns the pending-load status."""
+        with self._lock:
+            if self._pending is not None and self._pending['state'] == 'loading':
+                raise RuntimeError(f"Version {self._pending['version']} is already loading")
+            version = version or self.current_version()
+            self.path_for(version)  # validate before starting the thread
+            self._pending = {'version': version, 'activate': activate, 'state': 'loading',
+                             'error': None, 'started_at': time.time()}
+            pending = dict(self._pending)
+
+        def run():
+            try:
+                if activate:
+                    # A version already loaded for A/B is promoted as is; the active
+                    # one (or the legacy files, changed in place) is read again
+                    active = self._active
+                    reload = not self.versioned or (active is not None and active.version == version)
+                    self.activate(version, reload=reload)
+                else:
+                    self.load(version)
+                state, error = 'ready', None
+            except Exception as e:
+                state, error = 'failed', str(e)
+                print(f"❌ Loading model version {version} failed: {e}")
+            with self._lock:
+                self._pending.update(state=state, error=error, finished_at=time.time())
+
+        threading.Thread(target=run, name=f'model-load-{version}', daemon=True).start()
+        return pending
+
+    # --------------------------------------------
+    # File watching
+    # --------------------------------------------
+    def _fingerprint(self):
+        paths = [os.path.join(self.root, CURRENT_FILE), self.root] if self.versioned else list(self.legacy_files)
+        fingerprint = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                fingerprint.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+    def start_watcher(self):
+        if self.watch_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def _watch(self):
+        seen = self._fingerprint()
+        while not self._stop.wait(self.watch_interval):
+            fingerprint = self._fingerprint()
+            if fingerprint == seen:
+                continue
+            # Files still being written: wait until two polls agree
+            if self._stop.wait(self.watch_interval) or fingerprint != self._fingerprint():
+                continue
+            seen = fingerprint
+            try:
+                version = self.current_version()
+                active = self._active
+                if self.versioned and active is not None and active.version == version:
+                    continue
+                print(f"🔄 Model change detected, loading version {version}")
+                self.reload_async(version)
+            except Exception as e:
+                print(f"❌ Model watcher: {e}")
+
+    def after_fork(self):
+        # Locks and threads do not survive fork(); loaded weights do
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        if self._pending is not None and self._pending['state'] == 'loading':
+            self._pending.update(state='failed', error='interrupted by fork')
+        self.start_watcher()
+
+    def stats(self):
+        with self._lock:
+            loaded = [m.info() for m in self._loaded.values()]
+            active = self._active.version if self._active is not None else None
+            pending = dict(self._pending) if self._pending is not None else None
+        return {
+            'layout': 'versioned' if self.versioned else 'legacy',
+            'root': self.root,
+            'active': active,
+            'available': self.available(),
+            'loaded': loaded,
+            'pending': pending,
+            'process_rss_bytes': rss_bytes(),
+            **self.counters,
+        }
+
+
+# ============================================
+# PUBLISHING VERSIONS
+# ============================================
+def publish_version(root='models', version=None, source_dir='.', files=MODEL_FILES, activate=True):
+    """Copy trained artifacts into root/<version>/ and (atomically) point CURRENT at it."""
+    version = version or time.strftime('%Y%m%d-%H%M%S')
+    if not VERSION_PATTERN.match(version):
+        raise ValueError(f"Invalid version name {version!r}")
+    final = os.path.join(root, version)
+    if os.path.exists(final):
+        raise FileExistsError(f"{final} already exists")
+
+    staging = os.path.join(root, f'.{version}.tmp')
+    os.makedirs(staging, exist_ok=True)
+    copied = []
+    for name in files:
+        src = os.path.join(source_dir, name)
+        if os.path.exists(src):
+            shutil.copy2(src, os.path.join(staging, name))
+            copied.append(name)
+    if 'categories.json' not in copied:
+        shutil.rmtree(staging)
+        raise FileNotFoundError(f"No categories.json in {source_dir}")
+    # The watcher only sees the directory once it is complete
+    os.rename(staging, final)
+    if activate:
+        set_current(root, version)
+    return version, copied
+
+
+def set_current(root, version):
+    if not os.path.isfile(os.path.join(root, version, 'categories.json')):
+        raise FileNotFoundError(f"{root}/{version} is not a model version")
+    tmp = os.path.join(root, f'.{CURRENT_FILE}.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Manage versioned model directories")
+    parser.add_argument('--root', default=os.environ.get('SKETCH_MODELS_DIR', 'models'))
+    parser.add_argument('--publish', action='store_true', help="copy the top-level model files into a new version")
+    parser.add_argument('--version', help="version name for --publish (default: timestamp)")
+    parser.add_argument('--no-activate', action='store_true', help="publish without updating CURRENT")
+    parser.add_argument('--activate', metavar='VERSION', help="point CURRENT at VERSION")
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args()
+
+    if args.publish:
+        version, copied = publish_version(args.root, args.version, activate=not args.no_activate)
+        print(f"✅ Published {args.root}/{version}: {', '.join(copied)}")
+    if args.activate:
+        set_current(args.root, args.activate)
+        print(f"✅ {args.root}/{CURRENT_FILE} -> {args.activate}")
+    if args.list or not (args.publish or args.activate):
+        registry = ModelRegistry(build_fn=None, root=args.root)
+        current = registry.current_version() if registry.available() else None
+        print(json.dumps({'current': current, 'available': registry.available()}, indent=2))
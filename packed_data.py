@@ -0,0 +1,263 @@
+# ============================================
+# PACKED, SHARDED QUICKDRAW DATASET
+# Packs <category>.npy bitmaps into fixed-size raw uint8 shards plus one
+# small index, so opening the whole dataset is one JSON read and every
+# row is a memory-mapped slice:
+#   quickdraw_packed/
+#     index.json          row size, shard size and, per category, the
+#                         segments (shard, offset, count, crc32) it occupies
+#     shard-00000.bin     shard_rows x 784 bytes, no header
+#     shard-00001.bin     ...
+# Shards are append-only: packing a new category fills the free tail of
+# the last shard and then opens new ones; bytes already written never
+# change. The index is replaced atomically after the data is on disk, so
+# a crashed pack leaves the previous dataset intact.
+# quickdraw_data.open_category() reads from here when a category is
+# packed, so QuickDrawStream, cascade.py and similarity.py pick it up.
+#
+#   python packed_data.py --pack                  # every category in categories.json
+#   python packed_data.py --pack giraffe zebra    # append two more
+#   python packed_data.py --verify
+#   python packed_data.py --bench                 # open + first batch: .npy vs packed
+# ============================================
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+PACKED_DIR = 'quickdraw_packed'
+INDEX_FILE = 'index.json'
+ROW_BYTES = 28 * 28
+SHARD_ROWS = 65536  # 51 MB per shard
+
+
+def shard_name(shard):
+    return f'shard-{shard:05d}.bin'
+
+
+class _Segments:
+    """Row-indexable view of a category that spans several shards."""
+
+    dtype = np.dtype(np.uint8)
+    ndim = 2
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.starts = np.cumsum([0] + [len(p) for p in parts])
+        self.shape = (int(self.starts[-1]), ROW_BYTES)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                pieces = [part[max(start - begin, 0):max(min(stop - begin, len(part)), 0)]
+                          for part, begin in zip(self.parts, self.starts)]
+                return np.concatenate(pieces) if pieces else np.empty((0, ROW_BYTES), np.uint8)
+            key = np.arange(start, stop, step)
+        if np.isscalar(key):
+            row = int(key) % len(self)
+            part = int(np.searchsorted(self.starts, row, side='right')) - 1
+            return self.parts[part][row - self.starts[part]]
+        rows = np.asarray(key, dtype=np.int64) % len(self)
+        which = np.searchsorted(self.starts, rows, side='right') - 1
+        out = np.empty((len(rows), ROW_BYTES), dtype=np.uint8)
+        for part in np.unique(which):
+            mask = which == part
+            out[mask] = self.parts[part][rows[mask] - self.starts[part]]
+        return out
+
+
+class PackedDataset:
+    def __init__(self, root=PACKED_DIR):
+        self.root = root
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.shard_rows = self.index['shard_rows']
+        self._shards = {}
+        self._mtime = os.path.getmtime(os.path.join(root, INDEX_FILE))
+
+    def __contains__(self, category):
+        return category in self.index['categories']
+
+    @property
+    def categories(self):
+        return list(self.index['categories'])
+
+    def count(self, category):
+        return sum(segment[2] for segment in self.index['categories'][category])
+
+    def stale(self):
+        try:
+            return os.path.getmtime(os.path.join(self.root, INDEX_FILE)) != self._mtime
+        except OSError:
+            return True
+
+    def _shard(self, shard):
+        # Only the rows the index knows about; a half-written tail is ignored
+        rows = self.index['shards'][shard]
+        mapped = self._shards.get(shard)
+        if mapped is None or len(mapped) != rows:
+            mapped = np.memmap(os.path.join(self.root, shard_name(shard)), dtype=np.uint8, mode='r',
+                               shape=(rows, ROW_BYTES))
+            self._shards[shard] = mapped
+        return mapped
+
+    def category(self, category):
+        """N x 784 uint8 rows of a category; a plain memmap slice when in one shard."""
+        parts = [self._shard(shard)[offset:offset + count]
+                 for shard, offset, count, _ in self.index['categories'][category]]
+        return parts[0] if len(parts) == 1 else _Segments(parts)
+
+    def sample(self, per_class, categories=None, seed=0):
+        """Class-balanced random sample: (uint8 rows, labels), without reading whole classes."""
+        rng = np.random.default_rng(seed)
+        categories = categories or self.categories
+        pixels, labels = [], []
+        for label, category in enumerate(categories):
+            array = self.category(category)
+            rows = np.sort(rng.choice(len(array), min(per_class, len(array)), replace=False))
+            pixels.append(np.asarray(array[rows]))
+            labels.append(np.full(len(rows), label, dtype=np.int64))
+        return np.concatenate(pixels), np.concatenate(labels)
+
+    def verify(self):
+        """Names of categories whose bytes no longer match their checksums."""
+        bad = []
+        for category, segments in self.index['categories'].items():
+            for shard, offset, count, checksum in segments:
+                if zlib.crc32(self._shard(shard)[offset:offset + count]) != checksum:
+                    bad.append(category)
+                    break
+        return bad
+
+
+_opened = {}
+
+
+def packed_dataset(data_dir='.'):
+    """The packed dataset under data_dir (cached, reopened when the index changes), or None."""
+    root = os.path.join(data_dir, PACKED_DIR)
+    dataset = _opened.get(root)
+    if dataset is None or dataset.stale():
+        if not os.path.isfile(os.path.join(root, INDEX_FILE)):
+            return None
+        dataset = _opened[root] = PackedDataset(root)
+    return dataset
+
+
+# ============================================
+# PACKING
+# ============================================
+def _write_index(root, index):
+    tmp = os.path.join(root, f'.{INDEX_FILE}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, INDEX_FILE))
+
+
+def pack_categories(categories, data_dir='.', root=None, shard_rows=SHARD_ROWS, chunk_rows=8192):
+    """Append every category not packed yet; returns the names that were added."""
+    root = root or os.path.join(data_dir, PACKED_DIR)
+    os.makedirs(root, exist_ok=True)
+    try:
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        index = {'version': 1, 'row_bytes': ROW_BYTES, 'shard_rows': shard_rows, 'shards': [], 'categories': {}}
+    shard_rows = index['shard_rows']
+
+    added = []
+    for category in categories:
+        if category in index['categories']:
+            continue
+        source = np.load(os.path.join(data_dir, f'{category}.npy'), mmap_mode='r')
+        if source.ndim != 2 or source.shape[1] != ROW_BYTES or source.dtype != np.uint8:
+            raise ValueError(f"{category}.npy is not an N x 784 uint8 QuickDraw bitmap file")
+
+        segments, done = [], 0
+        while done < len(source):
+            if not index['shards'] or index['shards'][-1] >= shard_rows:
+                index['shards'].append(0)
+            shard, offset = len(index['shards']) - 1, index['shards'][-1]
+            count = min(shard_rows - offset, len(source) - done)
+            path = os.path.join(root, shard_name(shard))
+            checksum = 0
+            with open(path, 'ab') as f:
+                # Drop bytes a crashed pack left past the indexed rows
+                f.truncate(offset * ROW_BYTES)
+                for start in range(done, done + count, chunk_rows):
+                    block = np.ascontiguousarray(source[start:min(start + chunk_rows, done + count)])
+                    f.write(block.data)
+                    checksum = zlib.crc32(block, checksum)
+                f.flush()
+                os.fsync(f.fileno())
+            segments.append([shard, offset, count, checksum])
+            index['shards'][-1] = offset + count
+            done += count
+
+        index['categories'][category] = segments
+        _write_index(root, index)
+        added.append(category)
+        print(f"  {category}: {len(source)} drawings in {len(segments)} segment(s)")
+    return added
+
+
+def bench_open(categories, data_dir='.', batch_size=128):
+    """Time to open every category and produce a first training batch, .npy vs packed."""
+    from quickdraw_data import QuickDrawStream
+
+    results = {}
+    for name, use_packed in (('npy', False), ('packed', True)):
+        started = time.perf_counter()
+        stream = QuickDrawStream(categories, data_dir, batch_size=batch_size, packed=use_packed)
+        opened = time.perf_counter()
+        next(stream.train_batches())
+        results[name] = {'open_ms': round((opened - started) * 1000.0, 3),
+                         'first_batch_ms': round((time.perf_counter() - opened) * 1000.0, 3)}
+    dataset = packed_dataset(data_dir)
+    started = time.perf_counter()
+    dataset.sample(100, categories)
+    results['packed']['balanced_sample_100_per_class_ms'] = round((time.perf_counter() - started) * 1000.0, 3)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack QuickDraw .npy files into indexed shards")
+    parser.add_argument('categories', nargs='*', help="default: categories.json")
+    parser.add_argument('--pack', action='store_true')
+    parser.add_argument('--verify', action='store_true', help="check every segment's crc32")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--shard-rows', type=int, default=SHARD_ROWS, help="only used for a new dataset")
+    args = parser.parse_args()
+
+    categories = args.categories
+    if not categories:
+        with open('categories.json') as f:
+            categories = json.load(f)
+
+    if args.pack:
+        started = time.perf_counter()
+        added = pack_categories(categories, args.data_dir, shard_rows=args.shard_rows)
+        print(f"✅ Packed {len(added)} new categories in {time.perf_counter() - started:.1f}s")
+    dataset = packed_dataset(args.data_dir)
+    if dataset is None:
+        raise SystemExit(f"No packed dataset in {os.path.join(args.data_dir, PACKED_DIR)} (run with --pack)")
+    if args.verify:
+        bad = dataset.verify()
+        print(f"❌ Checksum mismatch: {', '.join(bad)}" if bad else
+              f"✅ {len(dataset.categories)} categories verified")
+    if args.bench:
+        print(json.dumps(bench_open(categories, args.data_dir), indent=2))
+    if not (args.pack or args.verify or args.bench):
+        print(json.dumps({'categories': {c: dataset.count(c) for c in dataset.categories},
+                          'shards': len(dataset.index['shards']), 'shard_rows': dataset.shard_rows}, indent=2))
@@ -0,0 +1,115 @@
+# ============================================
+# PREDICTION RESULT CACHE
+# LRU + TTL cache of model outputs keyed on a hash of the quantized
+# 28x28 input bitmap, so re-submitted (or nearly identical) sketches skip
+# the forward pass. Entries are dropped whenever one of the watched files
+# (the model and categories.json) changes on disk.
+# ============================================
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    def __init__(self, max_entries=4096, ttl_seconds=600.0, quantize_bits=4,
+                 watch_files=(), check_interval=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.shift = max(0, 8 - quantize_bits)
+        self.watch_files = tuple(watch_files)
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = self._file_fingerprint()
+        self._last_check = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def key(self, bitmap, namespace=b''):
+        # namespace keeps results of different model versions apart
+        quantized = np.ascontiguousarray(bitmap, dtype=np.uint8) >> self.shift
+        return hashlib.blake2b(namespace + quantized.tobytes(), digest_size=16).digest()
+
+    def encoded_key(self, data, namespace=b''):
+        # Exact bytes of an encoded image, for callers that never decode it;
+        # the person tag keeps these apart from bitmap keys
+        return hashlib.blake2b(namespace + data, digest_size=16, person=b'encoded').digest()
+
+    def get(self, key):
+        self._check_files()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires < now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        value = np.array(value, copy=True)
+        value.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    # --------------------------------------------
+    # Invalidation on model / categories change
+    # --------------------------------------------
+    def _file_fingerprint(self):
+        fingerprint = []
+        for path in self.watch_files:
+            try:
+                st = os.stat(path)
+                fingerprint.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+    def _check_files(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        fingerprint = self._file_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.clear()
@@ -0,0 +1,90 @@
+# ============================================
+# ON-DEMAND PROFILING OF A LIVE WORKER (opt-in, SKETCH_PROFILING)
+# - sample_stacks(): samples every thread's stack via sys._current_frames()
+#   and returns collapsed stacks ("a;b;c 42" lines), the input format of
+#   flamegraph.pl and speedscope. Costs nothing while not running.
+# - ProfileSession: cProfile of every request that starts during a window,
+#   merged into one pstats report. cProfile only sees the thread that
+#   enabled it, so each request thread gets its own profiler.
+# ============================================
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+
+def sample_stacks(duration=5.0, interval=0.005):
+    """Collapsed stacks of all other threads over `duration` seconds."""
+    own = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = Counter()
+    deadline = time.perf_counter() + duration
+    samples = 0
+    while time.perf_counter() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}'))
+            stacks[';'.join(reversed(stack))] += 1
+        samples += 1
+        time.sleep(interval)
+    lines = [f'{stack} {count}' for stack, count in stacks.most_common()]
+    return '\n'.join(lines) + '\n', samples
+
+
+class ProfileSession:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deadline = 0.0
+        self._profiles = []
+
+    @property
+    def active(self):
+        return time.monotonic() < self._deadline
+
+    def start(self, duration):
+        with self._lock:
+            if self.active:
+                raise RuntimeError("A profile is already being recorded")
+            self._profiles = []
+            self._deadline = time.monotonic() + duration
+
+    def begin_request(self):
+        if not self.active:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def end_request(self, profiler):
+        if profiler is None:
+            return
+        profiler.disable()
+        with self._lock:
+            self._profiles.append(profiler)
+
+    def report(self, sort='cumulative', limit=50):
+        """Wait for the window to close, then return (pstats text, requests profiled)."""
+        time.sleep(max(0.0, self._deadline - time.monotonic()))
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        if not profiles:
+            return "No requests were profiled\n", 0
+        out = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=out)
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue(), len(profiles)
@@ -0,0 +1,166 @@
+# ============================================
+# STREAMING QUICKDRAW LOADER
+# Opens each <category>.npy with mmap_mode='r' and streams shuffled,
+# class-balanced batches, converting to float32 one batch at a time.
+# Memory use depends on batch size, not on how many drawings or
+# categories are trained on.
+# Categories packed with packed_data.py are read from the shards instead
+# of their .npy files.
+#   stream = QuickDrawStream(CATEGORIES, batch_size=128)
+#   model.fit(stream.train_dataset(), steps_per_epoch=stream.steps_per_epoch,
+#             validation_data=stream.validation_dataset())
+# ============================================
+import os
+
+import numpy as np
+
+from packed_data import packed_dataset
+
+IMG_SIZE = 28
+
+
+def open_category(category, data_dir='.', packed=True):
+    dataset = packed_dataset(data_dir) if packed else None
+    if dataset is not None and category in dataset:
+        return dataset.category(category)
+    return np.load(os.path.join(data_dir, f'{category}.npy'), mmap_mode='r')
+
+
+class _ClassSampler:
+    """Shuffled reads from one class's rows without a full permutation.
+
+    Rows are visited chunk by chunk: the chunk order is shuffled each pass
+    and rows are shuffled inside a chunk, so reads stay local on disk and
+    the bookkeeping is n / chunk_size integers.
+    """
+
+    def __init__(self, start, stop, rng, chunk_size=512):
+        self.start, self.stop = start, stop
+        self.rng = rng
+        self.chunk_size = chunk_size
+        self._chunks = np.arange(start, stop, chunk_size)
+        self._order = np.empty(0, dtype=np.int64)
+        self._pending = []
+
+    def take(self, count):
+        out = []
+        while count > 0:
+            if len(self._order) == 0:
+                self._next_chunk()
+            n = min(count, len(self._order))
+            out.append(self._order[:n])
+            self._order = self._order[n:]
+            count -= n
+        return np.concatenate(out)
+
+    def _next_chunk(self):
+        if not self._pending:
+            self._pending = list(self.rng.permutation(self._chunks))
+        begin = self._pending.pop()
+        self._order = begin + self.rng.permutation(min(self.chunk_size, self.stop - begin))
+
+
+class QuickDrawStream:
+    def __init__(self, categories, data_dir='.', batch_size=128, samples_per_category=None,
+                 validation_fraction=0.2, validation_samples_per_category=2000, seed=42, packed=True,
+                 class_repeats=None):
+        # samples_per_category may also be a {category: limit} dict (others: all rows);
+        # class_repeats[i] is how many times class i appears per balanced round
+        self.categories = list(categories)
+        self.num_classes = len(self.categories)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.class_repeats = np.ones(self.num_classes, dtype=np.int64) if class_repeats is None else \
+            np.asarray(class_repeats, dtype=np.int64)
+
+        self.arrays = [open_category(c, data_dir, packed) for c in self.categories]
+        self.train_ranges, self.val_ranges = [], []
+        for category, array in zip(self.categories, self.arrays):
+            if array.ndim != 2 or array.shape[1] != IMG_SIZE * IMG_SIZE or array.dtype != np.uint8:
+                raise ValueError(f"{category}.npy is not an N x 784 uint8 QuickDraw bitmap file")
+            limit = samples_per_category.get(category) if isinstance(samples_per_category, dict) \
+                else samples_per_category
+            total = len(array) if limit is None else min(len(array), limit)
+            n_val = int(total * validation_fraction)
+            if validation_samples_per_category is not None:
+                n_val = min(n_val, validation_samples_per_category)
+            # The tail of each file is held out for validation
+            self.train_ranges.append((0, total - n_val))
+            self.val_ranges.append((total - n_val, total))
+
+        self.train_samples = sum(stop - start for start, stop in self.train_ranges)
+        self.val_samples = sum(stop - start for start, stop in self.val_ranges)
+
+    @property
+    def steps_per_epoch(self):
+        return max(1, self.train_samples // self.batch_size)
+
+    @property
+    def validation_steps(self):
+        return max(1, -(-self.val_samples // self.batch_size))
+
+    def _to_batch(self, pixels, labels):
+        x = pixels.reshape(-1, IMG_SIZE, IMG_SIZE, 1).astype(np.float32)
+        x *= 1.0 / 255.0
+        y = np.zeros((len(labels), self.num_classes), dtype=np.float32)
+        y[np.arange(len(labels)), labels] = 1.0
+        return x, y
+
+    def _gather(self, labels, rows):
+        pixels = np.empty((len(labels), IMG_SIZE * IMG_SIZE), dtype=np.uint8)
+        for cls in np.unique(labels):
+            mask = labels == cls
+            idx = rows[mask]
+            order = np.argsort(idx)  # sorted reads are friendlier to the page cache
+            pixels[np.flatnonzero(mask)[order]] = self.arrays[cls][idx[order]]
+        return pixels
+
+    def train_batches(self, epochs=None):
+        """Endless (or `epochs`-long) stream of class-balanced (x, y) batches."""
+        rng = np.random.default_rng(self.seed)
+        samplers = [_ClassSampler(start, stop, rng) for start, stop in self.train_ranges]
+        active = np.array([i for i, s in enumerate(samplers) if s.stop > s.start])
+        round_labels = np.repeat(active, self.class_repeats[active])
+        label_cycle = np.empty(0, dtype=np.int64)
+
+        step = 0
+        total_steps = None if epochs is None else epochs * self.steps_per_epoch
+        while total_steps is None or step < total_steps:
+            # Walk through shuffled rounds of every class so each class
+            # appears equally often regardless of its file size
+            while len(label_cycle) < self.batch_size:
+                label_cycle = np.concatenate([label_cycle, rng.permutation(round_labels)])
+            labels, label_cycle = label_cycle[:self.batch_size], label_cycle[self.batch_size:]
+
+            rows = np.empty(len(labels), dtype=np.int64)
+            for cls in np.unique(labels):
+                mask = labels == cls
+                rows[mask] = samplers[cls].take(int(mask.sum()))
+            yield self._to_batch(self._gather(labels, rows), labels)
+            step += 1
+
+    def validation_batches(self):
+        """One deterministic pass over the held-out rows of every class."""
+        for cls, (start, stop) in enumerate(self.val_ranges):
+            for begin in range(start, stop, self.batch_size):
+                end = min(begin + self.batch_size, stop)
+                yield self._to_batch(np.asarray(self.arrays[cls][begin:end]),
+                                     np.full(end - begin, cls, dtype=np.int64))
+
+    # --------------------------------------------
+    # tf.data wrappers
+    # --------------------------------------------
+    def _signature(self):
+        import tensorflow as tf
+        return (tf.TensorSpec((None, IMG_SIZE, IMG_SIZE, 1), tf.float32),
+                tf.TensorSpec((None, self.num_classes), tf.float32))
+
+    def train_dataset(self, prefetch=2):
+        import tensorflow as tf
+        dataset = tf.data.Dataset.from_generator(self.train_batches, output_signature=self._signature())
+        return dataset.prefetch(prefetch)
+
+    def validation_dataset(self, prefetch=2):
+        import tensorflow as tf
+        dataset = tf.data.Dataset.from_generator(self.validation_batches, output_signature=self._signature())
+        return dataset.prefetch(prefetch)
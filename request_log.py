@@ -0,0 +1,56 @@
+# ============================================
+# SAMPLED, NON-BLOCKING REQUEST LOGGING
+# Log records go through a QueueHandler; a background listener thread does
+# the actual stdout write, so request threads never block on the terminal.
+# Per-request lines are sampled (SKETCH_LOG_SAMPLE_RATE, 0 = off); errors
+# are always logged.
+# ============================================
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+log = logging.getLogger('sketch')
+_listener = None
+_sample_rate = 0.0
+
+
+def setup(sample_rate=0.0, level='INFO'):
+    global _listener, _sample_rate
+    _sample_rate = max(0.0, min(1.0, sample_rate))
+    if _listener is not None:
+        return log
+
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+    log.handlers[:] = [logging.handlers.QueueHandler(records)]
+    log.setLevel(level)
+    log.propagate = False
+    return log
+
+
+def restart():
+    # The listener thread does not survive fork(); the queue does
+    if _listener is not None and not (_listener._thread and _listener._thread.is_alive()):
+        _listener._thread = None
+        _listener.start()
+
+
+def stop():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def sampled():
+    return _sample_rate > 0.0 and random.random() < _sample_rate
+
+
+def request(endpoint, status, elapsed_ms, **fields):
+    if sampled():
+        extra = ' '.join(f'{k}={v}' for k, v in fields.items())
+        log.info(f"{endpoint} {status} {elapsed_ms:.1f}ms {extra}".rstrip())
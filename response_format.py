@@ -0,0 +1,113 @@
+# ============================================
+# PREDICTION RESPONSE ENCODING
+# Keeps /api/predict payloads small:
+#   top_k               - only the k most likely classes (np.argpartition)
+#   include_categories  - false drops the static category list; clients
+#                         fetch /api/categories once and revalidate by ETag
+#   Accept header       - application/json (default),
+#                         application/x-msgpack (if msgpack is installed),
+#                         application/octet-stream (raw little-endian float16)
+# Octet-stream layout, described by the X-Layout header:
+#   float16[N,C]                 - every class, in /api/categories order
+#   uint16[N,K] + float16[N,K]   - top-k class indices, then their values
+# ============================================
+import hashlib
+import json
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install msgpack
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+FLOAT16 = 'application/octet-stream'
+
+
+def available_encodings():
+    return [JSON, MSGPACK, FLOAT16] if msgpack is not None else [JSON, FLOAT16]
+
+
+def negotiate(accept_mimetypes):
+    """Pick the response encoding from a werkzeug Accept header object."""
+    return accept_mimetypes.best_match(available_encodings(), default=JSON) or JSON
+
+
+def parse_top_k(value):
+    if value in (None, '', 0, '0'):
+        return None
+    k = int(value)
+    if k < 1:
+        raise ValueError("top_k must be a positive integer")
+    return k
+
+
+def parse_bool(value, default=True):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def categories_etag(categories):
+    # Unquoted entity tag; werkzeug adds the quotes (response.set_etag)
+    return hashlib.blake2b(json.dumps(categories).encode('utf-8'), digest_size=8).hexdigest()
+
+
+# ============================================
+# TOP-K SELECTION
+# ============================================
+def top_k_indices(predictions, k):
+    # argpartition is O(n); only the k winners get sorted
+    k = max(1, min(int(k), len(predictions)))
+    top = np.argpartition(predictions, -k)[-k:]
+    return top[np.argsort(predictions[top])[::-1]]
+
+
+def top_k_matrix(predictions, k):
+    """Row-wise top-k of an (N, C) array -> (indices, values), both (N, k), best first."""
+    k = max(1, min(int(k), predictions.shape[1]))
+    top = np.argpartition(predictions, -k, axis=1)[:, -k:]
+    values = np.take_along_axis(predictions, top, axis=1)
+    order = np.argsort(-values, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def prediction_fields(predictions, categories, top_k=None):
+    """The per-drawing part of a /api/predict JSON response."""
+    predicted_idx = int(np.argmax(predictions))
+    confidence = float(predictions[predicted_idx])
+    if top_k is None:
+        indices = range(len(categories))
+    else:
+        indices = top_k_indices(predictions, top_k)
+    return {
+        'prediction': categories[predicted_idx],
+        'confidence': f"{confidence:.1%}",
+        'confidence_value': confidence,
+        'all_predictions': {categories[i]: f"{float(predictions[i]):.1%}" for i in indices}
+    }
+
+
+# ============================================
+# BINARY ENCODINGS
+# ============================================
+def encode_msgpack(payload):
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def encode_float16(predictions, top_k=None):
+    """Return (body, headers) for an (N, C) probability matrix."""
+    predictions = np.atleast_2d(np.asarray(predictions, dtype=np.float32))
+    n, c = predictions.shape
+    if top_k is None:
+        body = predictions.astype('<f2').tobytes()
+        layout = f'float16[{n},{c}]'
+    else:
+        indices, values = top_k_matrix(predictions, top_k)
+        body = indices.astype('<u2').tobytes() + values.astype('<f2').tobytes()
+        layout = f'uint16[{n},{indices.shape[1]}]+float16[{n},{indices.shape[1]}]'
+    return body, {'X-Layout': layout}
@@ -21,9 +21,16 @@ import base64
 from io import BytesIO
 from datetime import datetime
 
+from response_format import parse_top_k, parse_bool, categories_etag, top_k_indices
+import config
+from image_store import ImageStore
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Global CORS, removes the need for @cross_origin
 
+# Generated images, keyed by prompt + style and capped in size (see image_store.py)
+image_store = ImageStore(config.IMAGE_STORE_DIR, config.IMAGE_STORE_MAX_BYTES)
+
 # Prevent TensorFlow from allocating all GPU memory at once (optional, only if training crashes)
 # physical_devices = tf.config.list_physical_devices('GPU')
 # if physical_devices:
@@ -160,18 +167,31 @@ def predict():
         except Exception as e:
             return jsonify({'error': f'Invalid image data: {str(e)}', 'success': False}), 400
 
+        try:
+            top_k = parse_top_k(data.get('top_k'))
+        except ValueError as e:
+            return jsonify({'error': str(e), 'success': False}), 400
+
         result = predict_drawing(img_array)
+        shown = result['all_predictions']
+        if top_k is not None:
+            values = np.array([shown[c] for c in CATEGORIES])
+            shown = {CATEGORIES[i]: float(values[i]) for i in top_k_indices(values, top_k)}
+
         response_data = {
             'success': True,
             'prediction': result['prediction'],
             'confidence': f"{result['confidence']:.1%}",
             'confidence_value': result['confidence'],
-            'all_predictions': {k: f"{v:.1%}" for k, v in result['all_predictions'].items()},
-            'all_predictions_values': result['all_predictions'],
+            'all_predictions': {k: f"{v:.1%}" for k, v in shown.items()},
+            'all_predictions_values': shown,
             'description': description,
-            'timestamp': datetime.now().isoformat(),
-            'categories': CATEGORIES
+            'timestamp': datetime.now().isoformat()
         }
+        if top_k is not None:
+            response_data['top_k'] = top_k
+        if parse_bool(data.get('include_categories')):
+            response_data['categories'] = CATEGORIES
 
         print(f"✅ Prediction: {result['prediction']} | Confidence: {result['confidence']:.1%} | Description: {description}")
         return jsonify(response_data), 200
@@ -182,10 +202,17 @@ def predict():
 
 @app.route('/api/categories', methods=['GET'])
 def get_categories():
-    return jsonify({
-        'categories': CATEGORIES,
-        'count': NUM_CLASSES
-    }), 200
+    etag = categories_etag(CATEGORIES)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify({
+            'categories': CATEGORIES,
+            'count': NUM_CLASSES
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=300, must-revalidate'
+    return response
 
 @app.route('/', methods=['GET'])
 def index():
@@ -216,10 +243,23 @@ def generate_image():
         }
         prompt = prompts.get(style, prompts['realistic'])
 
+        # Same prompt and style as an earlier request: serve the stored image
+        image_url = image_store.lookup(prompt, style)
+        if image_url:
+            return jsonify({
+                'success': True,
+                'image_url': image_url,
+                'prompt': prompt,
+                'prediction': prediction,
+                'style': style,
+                'method': 'huggingface',
+                'cached': True
+            }), 200
+
         print(f"🎨 Generating image for: {prediction} (style: {style})")
         # Try Hugging Face, fallback to Pollinations, else error
         try:
-            image_url = generate_with_huggingface(prompt)
+            image_url = generate_with_huggingface(prompt, style)
             if image_url:
                 return jsonify({
                     'success': True,
@@ -227,7 +267,8 @@ def generate_image():
                     'prompt': prompt,
                     'prediction': prediction,
                     'style': style,
-                    'method': 'huggingface'
+                    'method': 'huggingface',
+                    'cached': False
                 }), 200
         except Exception as e:
             print(f"Hugging Face failed: {e}")
@@ -263,7 +304,7 @@ def generate_with_pollinations(prompt):
     except Exception as e:
         raise Exception(f"Generation failed: {str(e)}")
 
-def generate_with_huggingface(prompt):
+def generate_with_huggingface(prompt, style=''):
     API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-2-1"
     HF_TOKEN = None  # Optionally add your HuggingFace token here for higher rate limit
     headers = {}
@@ -274,19 +315,32 @@ def generate_with_huggingface(prompt):
 
     response = requests.post(API_URL, headers=headers, json=payload, timeout=30)
     if response.status_code == 200:
-        image_filename = os.path.join('static', f"generated_{int(time.time())}.png")
-        with open(image_filename, 'wb') as f:
-            f.write(response.content)
-        return f"/static/{os.path.basename(image_filename)}"
+        return image_store.put(prompt, style, response.content)
     elif response.status_code == 503:
         raise Exception("Hugging Face model is loading. Try again in 30 seconds.")
     else:
         raise Exception(f"HuggingFace API error: {response.status_code}")
 
+@app.route('/static/generated/<name>')
+def serve_generated_image(name):
+    # Names are content hashes: strong ETag, cacheable forever. send_file
+    # handles If-None-Match and Range, and hands the file to the server's
+    # sendfile() via wsgi.file_wrapper.
+    path = image_store.path(name)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'Image not found'}), 404
+    try:
+        response = send_file(os.path.abspath(path), mimetype='image/png', conditional=True, etag=name[:-4],
+                             max_age=365 * 24 * 3600)
+    except FileNotFoundError:
+        return jsonify({'error': 'Image not found'}), 404
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/static/<filename>')
 def serve_image(filename):
     try:
-        return send_file(os.path.join('static', filename), mimetype='image/png')
+        return send_file(os.path.join('static', filename), mimetype='image/png', conditional=True)
     except:
         return jsonify({'error': 'Image not found'}), 404
 
@@ -0,0 +1,158 @@
+# ============================================
+# LIVE PREDICTION STREAMING (Server-Sent Events)
+# While the user draws, the client POSTs only the new stroke segments;
+# the server keeps a 28x28 raster per session and rasterizes just those
+# segments into it. One SSE connection per session pushes top-k guesses.
+# Bursts of deltas are coalesced: after a change the stream waits a short
+# debounce window, then predicts only the newest raster.
+#
+#   POST   /api/stream/sessions          {width, height, line_width?, top_k?}
+#   GET    /api/stream/<id>/events       text/event-stream of 'prediction'
+#   POST   /api/stream/<id>/strokes      {strokes: [[xs], [ys]]..., clear?}
+#   DELETE /api/stream/<id>
+#
+# Sessions live in the memory of the process that created them. Under
+# gunicorn with several workers, a load balancer must keep each client on
+# one worker (sticky sessions, e.g. by client IP); otherwise stroke and
+# event requests land on a worker that never saw the session and get 404.
+# Each open event stream also holds one gthread thread for its lifetime,
+# so SessionManager caps open streams below the thread count and leaves
+# the rest for ordinary requests.
+# ============================================
+import json
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from canvas_decode import IMG_SIZE, rasterize_segments, strokes_to_segments
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamSession:
+    def __init__(self, session_id, width, height, line_width=1.8, top_k=3):
+        if width <= 0 or height <= 0:
+            raise ValueError("width and height must be positive")
+        self.session_id = session_id
+        self.width, self.height = float(width), float(height)
+        self.line_width = float(line_width)
+        self.top_k = int(top_k)
+        self.raster = np.zeros((IMG_SIZE, IMG_SIZE), dtype=np.uint8)
+        self.version = 0
+        self.predicted_version = 0
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _to_grid(self, segments):
+        # Same mapping as resizing the whole canvas to 28x28 (the PNG path)
+        scaled = segments.copy()
+        scaled[:, [0, 2]] = (segments[:, [0, 2]] + 0.5) * (IMG_SIZE / self.width) - 0.5
+        scaled[:, [1, 3]] = (segments[:, [1, 3]] + 0.5) * (IMG_SIZE / self.height) - 0.5
+        return scaled
+
+    def apply(self, strokes=(), clear=False):
+        segments = self._to_grid(strokes_to_segments(strokes))
+        with self._cond:
+            if clear:
+                self.raster[:] = 0
+            rasterize_segments(segments, line_width=self.line_width, out=self.raster)
+            self.version += 1
+            self.last_seen = time.monotonic()
+            self._cond.notify_all()
+        return self.version
+
+    def wait_for_change(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.closed or self.version != self.predicted_version, timeout)
+
+    def snapshot(self):
+        with self._cond:
+            return self.version, self.raster.copy()
+
+    def mark_predicted(self, version):
+        with self._cond:
+            self.predicted_version = version
+            self.last_seen = time.monotonic()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class SessionManager:
+    def __init__(self, max_sessions=1000, idle_ttl=300.0, max_streams=4):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_streams = max_streams
+        self.open_streams = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, width, height, line_width=1.8, top_k=3):
+        with self._lock:
+            self._reap()
+            if len(self._sessions) >= self.max_sessions:
+                raise RuntimeError("Too many live sessions")
+            session = StreamSession(uuid.uuid4().hex, width, height, line_width, top_k)
+            self._sessions[session.session_id] = session
+            return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session is not None
+
+    def open_stream(self):
+        # One serving thread per open event stream; False when at the cap
+        with self._lock:
+            if self.open_streams >= self.max_streams:
+                return False
+            self.open_streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self.open_streams -= 1
+
+    def _reap(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for session_id in [s for s, session in self._sessions.items() if session.last_seen < cutoff]:
+            self._sessions.pop(session_id).close()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+def event_stream(session, predict_fn, debounce=0.05, keepalive=15.0):
+    """SSE generator: one 'prediction' event per coalesced raster change.
+
+    `predict_fn(raster, top_k)` returns a JSON-serializable payload.
+    """
+    yield "retry: 1000\n\n"
+    yield sse_event('ready', {'session_id': session.session_id})
+    while not session.closed:
+        if not session.wait_for_change(keepalive):
+            yield ": keep-alive\n\n"
+            continue
+        if session.closed:
+            break
+        time.sleep(debounce)  # let the rest of a burst of deltas land
+        version, raster = session.snapshot()
+        payload = predict_fn(raster, session.top_k)
+        session.mark_predicted(version)
+        payload['version'] = version
+        yield sse_event('prediction', payload)
+    yield sse_event('closed', {'session_id': session.session_id})
@@ -0,0 +1,27 @@
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+# The modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def http_server():
+    """start(handler_class) -> base URL of a local HTTP/1.1 server, stopped after the test."""
+    servers = []
+
+    def start(handler_class):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
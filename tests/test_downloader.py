@@ -0,0 +1,189 @@
+import hashlib
+import http.server
+import io
+import json
+import threading
+
+import numpy as np
+import pytest
+
+import downloader
+from downloader import DatasetDownloader, InvalidDataset
+
+
+def npy_bytes(rows=40, seed=0):
+    bitmaps = np.random.default_rng(seed).integers(0, 256, (rows, downloader.ROW_BYTES), dtype=np.uint8)
+    buf = io.BytesIO()
+    np.save(buf, bitmaps)
+    return buf.getvalue()
+
+
+def quickdraw_stub(files, plan=None):
+    """Serves files[name] with Range support.
+
+    plan is a list of per-request behaviours used in order, then 'ok':
+    'ok', 'error' (503), 'cut' (half the body, then hang up) or 'corrupt'
+    (a body whose .npy header promises more rows than it holds).
+    """
+    seen = {'requests': []}
+    plan = list(plan or [])
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with lock:
+                behaviour = plan.pop(0) if plan else 'ok'
+                seen['requests'].append((self.path, self.headers.get('Range'), behaviour))
+            name = self.path.rsplit('/', 1)[1]
+            if name not in files:
+                self.send_error(404)
+                return
+            if behaviour == 'error':
+                self.send_error(503)
+                return
+            body = files[name]
+            if behaviour == 'corrupt':
+                body = body[:len(body) // 2]
+
+            start = 0
+            if self.headers.get('Range'):
+                start = int(self.headers['Range'].split('=')[1].split('-')[0])
+                if start >= len(body):
+                    self.send_error(416)
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body) - start))
+            self.end_headers()
+            if behaviour == 'cut':
+                self.wfile.write(body[start:start + (len(body) - start) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(body[start:])
+
+        def log_message(self, *args):
+            pass
+
+    return Handler, seen
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader.time, 'sleep', lambda seconds: None)
+
+
+@pytest.fixture
+def downloader_for(http_server, tmp_path):
+    def make(files, plan=None, **kwargs):
+        handler, seen = quickdraw_stub(files, plan)
+        dl = DatasetDownloader(base_url=http_server(handler), data_dir=str(tmp_path), max_workers=2,
+                               chunk_size=1024, timeout=5, **kwargs)
+        return dl, seen
+
+    return make
+
+
+def test_download_verifies_and_records_manifest(downloader_for, tmp_path):
+    body = npy_bytes()
+    dl, seen = downloader_for({'cloud.npy': body})
+
+    result = dl.download('cloud')
+    assert result['status'] == 'downloaded' and result['rows'] == 40
+    assert (tmp_path / 'cloud.npy').read_bytes() == body
+    manifest = json.loads((tmp_path / downloader.MANIFEST_NAME).read_text())
+    assert manifest['cloud']['sha256'] == hashlib.sha256(body).hexdigest()
+
+    assert dl.download('cloud')['status'] == 'cached'
+    assert len(seen['requests']) == 1
+
+
+def test_resumes_partial_file_with_range_request(downloader_for, tmp_path):
+    body = npy_bytes()
+    (tmp_path / 'sun.npy.part').write_bytes(body[:1000])
+    dl, seen = downloader_for({'sun.npy': body})
+
+    result = dl.download('sun')
+    assert result['status'] == 'resumed'
+    assert result['bytes'] == len(body) - 1000
+    assert seen['requests'][0][1] == 'bytes=1000-'
+    assert (tmp_path / 'sun.npy').read_bytes() == body
+    assert not (tmp_path / 'sun.npy.part').exists()
+    # The digest covers the bytes already on disk as well as the new ones
+    assert dl.manifest['sun']['sha256'] == hashlib.sha256(body).hexdigest()
+
+
+def test_dropped_connection_resumes_on_retry(downloader_for, tmp_path):
+    body = npy_bytes(rows=200)
+    dl, seen = downloader_for({'tree.npy': body}, plan=['cut'])
+
+    result = dl.download('tree')
+    assert result['status'] == 'resumed'
+    assert [r[2] for r in seen['requests']] == ['cut', 'ok']
+    # Picks up from whatever reached the .part file before the hang-up
+    resumed_from = int(seen['requests'][1][1][len('bytes='):-1])
+    assert 0 < resumed_from <= len(body) // 2
+    assert (tmp_path / 'tree.npy').read_bytes() == body
+
+
+def test_retries_server_errors(downloader_for, tmp_path):
+    body = npy_bytes()
+    dl, seen = downloader_for({'cat.npy': body}, plan=['error', 'error'])
+
+    assert dl.download('cat')['status'] == 'downloaded'
+    assert len(seen['requests']) == 3
+    assert (tmp_path / 'cat.npy').read_bytes() == body
+
+
+def test_gives_up_after_retries(downloader_for, tmp_path):
+    dl, seen = downloader_for({'dog.npy': npy_bytes()}, plan=['error'] * 3)
+
+    with pytest.raises(InvalidDataset, match='after 3 attempts'):
+        dl.download('dog')
+    assert len(seen['requests']) == 3
+    assert not (tmp_path / 'dog.npy').exists()
+
+
+def test_corrupt_body_is_discarded_and_fetched_again(downloader_for, tmp_path):
+    body = npy_bytes()
+    dl, seen = downloader_for({'fish.npy': body}, plan=['corrupt'])
+
+    assert dl.download('fish')['status'] == 'downloaded'
+    assert [r[1] for r in seen['requests']] == [None, None]  # the bad .part was not resumed
+    assert (tmp_path / 'fish.npy').read_bytes() == body
+
+
+def test_file_changed_since_manifest_is_downloaded_again(downloader_for, tmp_path):
+    body = npy_bytes()
+    dl, seen = downloader_for({'moon.npy': body})
+    dl.download('moon')
+
+    path = tmp_path / 'moon.npy'
+    path.write_bytes(body[:-downloader.ROW_BYTES])  # size no longer matches the manifest or the header
+    assert not dl.is_verified('moon')
+    assert dl.download('moon')['status'] == 'downloaded'
+    assert path.read_bytes() == body
+    assert len(seen['requests']) == 2
+
+
+def test_validate_npy_rejects_non_bitmap_files(tmp_path):
+    path = tmp_path / 'pointer.npy'
+    path.write_bytes(b'version https://git-lfs.github.com/spec/v1\n')
+    with pytest.raises(InvalidDataset, match='not a .npy file'):
+        downloader.validate_npy(str(path))
+
+    np.save(tmp_path / 'floats.npy', np.zeros((3, downloader.ROW_BYTES), dtype=np.float32))
+    with pytest.raises(InvalidDataset, match='expected uint8'):
+        downloader.validate_npy(str(tmp_path / 'floats.npy'))
+
+
+def test_download_all_reports_failures(downloader_for):
+    dl, _ = downloader_for({'a.npy': npy_bytes()})
+    with pytest.raises(InvalidDataset, match='1 categories failed: b'):
+        dl.download_all(['a', 'b'])
+    assert dl.is_verified('a')
+
@@ -0,0 +1,168 @@
+import asyncio
+import http.server
+import threading
+import time
+
+import pytest
+
+from image_gen import GenerationError, ImageGenerator
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 2048
+
+
+def pollinations_stub(delay=0.0, status=200):
+    """Handler class plus the record of requests and client connections it saw."""
+    seen = {'paths': [], 'connections': set()}
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is visible
+
+        def do_GET(self):
+            with lock:
+                seen['paths'].append(self.path)
+                seen['connections'].add(self.client_address)
+            time.sleep(delay)
+            self.send_response(status)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(PNG)))
+            self.end_headers()
+            self.wfile.write(PNG)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler, seen
+
+
+@pytest.fixture
+def generator_for(http_server):
+    generators = []
+
+    def make(delay=0.0, status=200, **kwargs):
+        handler, seen = pollinations_stub(delay, status)
+        generator = ImageGenerator(base_url=http_server(handler), **kwargs)
+        generators.append(generator)
+        return generator, seen
+
+    yield make
+    for generator in generators:
+        generator.close()
+
+
+def test_generate_returns_stable_url_and_caches(generator_for):
+    generator, seen = generator_for()
+    url = generator.generate('a cat')
+    assert url.startswith(generator.base_url + '/prompt/a%20cat?')
+    assert generator.generate('a cat') == url
+    assert len(seen['paths']) == 1
+    assert generator.stats()['cache_hits'] == 1
+
+
+def test_connections_are_reused(generator_for):
+    generator, seen = generator_for()
+    for i in range(5):
+        generator.generate(f'prompt {i}')
+    assert len(seen['paths']) == 5
+    assert len(seen['connections']) == 1
+
+
+def test_identical_inflight_prompts_coalesce(generator_for):
+    generator, seen = generator_for(delay=0.3)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(generator.generate('same'))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(results)) == 1 and len(results) == 4
+    assert len(seen['paths']) == 1
+    assert generator.stats()['coalesced'] == 3
+
+
+def test_upstream_error_is_reported(generator_for):
+    generator, _ = generator_for(status=500)
+    with pytest.raises(GenerationError, match='returned 500'):
+        generator.generate('broken')
+    assert generator.stats()['upstream_errors'] == 1
+    assert generator.stats()['cached_prompts'] == 0
+
+
+def test_upstream_timeout(generator_for):
+    generator, _ = generator_for(delay=1.0, timeout=0.2)
+    with pytest.raises(GenerationError, match='timed out'):
+        generator.generate('slow')
+
+
+def test_per_call_timeout_caps_the_wait(generator_for):
+    # e.g. what is left of the request's admission deadline
+    generator, _ = generator_for(delay=1.0, timeout=10.0)
+    started = time.perf_counter()
+    with pytest.raises(GenerationError, match='timed out'):
+        generator.generate('slow', timeout=0.2)
+    assert time.perf_counter() - started < 0.9
+
+
+def test_jobs_run_in_the_background(generator_for):
+    generator, _ = generator_for(delay=0.1)
+    job_id = generator.submit_job('later')
+    assert generator.job_status(job_id)['status'] in ('pending', 'running')
+    deadline = time.time() + 5
+    while generator.job_status(job_id)['status'] not in ('done', 'failed') and time.time() < deadline:
+        time.sleep(0.02)
+    job = generator.job_status(job_id)
+    assert job['status'] == 'done'
+    assert job['image_url'] == generator.build_url('later')
+    assert generator.job_status('missing') is None
+
+
+# --------------------------------------------
+# AsyncImageGenerator: same pipeline, httpx transport
+# --------------------------------------------
+def run_async(http_server, scenario, delay=0.0, status=200, **kwargs):
+    pytest.importorskip('httpx')
+    from image_gen import AsyncImageGenerator
+
+    handler, seen = pollinations_stub(delay, status)
+    base_url = http_server(handler)
+
+    async def main():
+        generator = AsyncImageGenerator(base_url=base_url, **kwargs)
+        try:
+            return await scenario(generator)
+        finally:
+            await generator.aclose()
+
+    return asyncio.run(main()), seen
+
+
+def test_async_caches_coalesces_and_reuses_connections(http_server):
+    async def scenario(generator):
+        urls = await asyncio.gather(*[generator.agenerate('same') for _ in range(4)])
+        for i in range(3):
+            await generator.agenerate(f'prompt {i}')
+        assert await generator.agenerate('same') == urls[0]
+        return urls, generator.stats()
+
+    (urls, stats), seen = run_async(http_server, scenario, delay=0.2)
+    assert len(set(urls)) == 1 and '/prompt/same?' in urls[0]
+    assert stats['coalesced'] == 3 and stats['cache_hits'] == 1
+    assert len(seen['paths']) == 4
+    assert len(seen['connections']) == 1  # bodies are drained, so the connection goes back to the pool
+
+
+def test_async_upstream_error_and_jobs(http_server):
+    async def scenario(generator):
+        with pytest.raises(GenerationError, match='returned 503'):
+            await generator.agenerate('broken')
+        job_id = generator.submit_job('later')
+        assert generator.job_status(job_id)['status'] == 'pending'
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if generator.job_status(job_id)['status'] == 'failed':
+                break
+        return generator.job_status(job_id), generator.stats()
+
+    (job, stats), _ = run_async(http_server, scenario, status=503)
+    assert job['status'] == 'failed' and 'returned 503' in job['error']
+    assert stats['upstream_errors'] == 2 and stats['inflight'] == 0
@@ -0,0 +1,74 @@
+import os
+
+from image_store import REFS_DIR, ImageStore
+
+
+def image(n, size=1000):
+    return bytes([n]) * size
+
+
+def refs(store):
+    return sorted(os.listdir(os.path.join(store.root, REFS_DIR)))
+
+
+def test_put_and_lookup(tmp_path):
+    store = ImageStore(str(tmp_path))
+    url = store.put('a cat', 'realistic', image(1))
+    assert store.lookup('a cat', 'realistic') == url
+    assert store.lookup('a cat', 'cartoon') is None
+    # Identical bytes are stored once
+    assert store.put('a kitten', 'realistic', image(1)) == url
+    assert store.stats()['writes'] == 1
+
+
+def test_put_rewrites_image_evicted_by_another_process(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path))
+    url = store.put('a cat', '', image(1))
+    path = store.path(url.rsplit('/', 1)[1])
+
+    real_utime = os.utime
+
+    def evicted_first(target, *args, **kwargs):
+        # Another process evicts the image just before put() touches it
+        if target == path and os.path.exists(path):
+            os.unlink(path)
+        return real_utime(target, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'utime', evicted_first)
+    assert store.put('a kitten', '', image(1)) == url
+    monkeypatch.undo()
+    assert open(path, 'rb').read() == image(1)
+    assert store.lookup('a kitten', '') == url
+
+
+def test_refs_count_towards_size(tmp_path):
+    store = ImageStore(str(tmp_path))
+    store.put('a cat', '', image(1))
+    store.put('a kitten', '', image(1))
+    ref_bytes = sum(os.path.getsize(os.path.join(store.root, REFS_DIR, r)) for r in refs(store))
+    assert store.stats()['bytes'] == 1000 + ref_bytes
+    # A fresh store over the same directory agrees
+    assert ImageStore(str(tmp_path)).stats()['bytes'] == store.stats()['bytes']
+
+
+def test_eviction_deletes_refs_of_evicted_images(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=3500, low_watermark=0.6)
+    for n in range(3):
+        store.put(f'prompt {n}', '', image(n))
+        os.utime(store.path(store.lookup(f'prompt {n}', '').rsplit('/', 1)[1]), (n, n))
+    store.put('prompt 3', '', image(3))  # over the limit: the oldest images go
+
+    assert store.stats()['evicted'] == 2
+    assert len(refs(store)) == 2
+    assert store.lookup('prompt 0', '') is None and store.lookup('prompt 1', '') is None
+    assert store.lookup('prompt 3', '') is not None
+    assert store.stats()['bytes'] <= 3500 * 0.6
+
+
+def test_sweep_drops_refs_to_missing_images(tmp_path):
+    store = ImageStore(str(tmp_path))
+    url = store.put('a cat', '', image(1))
+    os.unlink(store.path(url.rsplit('/', 1)[1]))  # e.g. evicted by another process
+    store.evict()
+    assert refs(store) == []
+    assert store.stats()['bytes'] == 0
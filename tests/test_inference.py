@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from inference import NumpyBackend, export_numpy_weights
+
+keras = pytest.importorskip('tensorflow').keras
+
+
+def small_model(num_classes=5):
+    # Every layer type the NumPy backend supports, both padding modes
+    model = keras.Sequential([
+        keras.layers.Input((28, 28, 1)),
+        keras.layers.Conv2D(4, (3, 3), activation='relu', padding='same'),
+        keras.layers.MaxPooling2D((2, 2)),
+        keras.layers.Conv2D(6, (3, 3), strides=(2, 2), activation='relu'),
+        keras.layers.Flatten(),
+        keras.layers.Dropout(0.5),
+        keras.layers.Dense(16, activation='relu'),
+        keras.layers.Dense(num_classes, activation='softmax'),
+    ])
+    # Non-zero biases so a missing bias add would show up
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if weights:
+            layer.set_weights([weights[0], np.linspace(-0.1, 0.1, len(weights[1])).astype(np.float32)])
+    return model
+
+
+def test_numpy_backend_matches_keras(tmp_path):
+    model = small_model()
+    path = export_numpy_weights(model, str(tmp_path / 'weights.npz'))
+    backend = NumpyBackend(path)
+
+    batch = np.random.default_rng(0).random((32, 28, 28, 1), dtype=np.float32)
+    expected = model.predict(batch, verbose=0)
+    actual = backend.predict(batch)
+
+    assert actual.shape == expected.shape
+    assert np.allclose(actual, expected, atol=1e-5)
+    assert backend.num_classes == 5
+
+
+def test_verify_writes_nothing(tmp_path):
+    from inference import verify
+
+    model_path = str(tmp_path / 'model.h5')
+    small_model().save(model_path)
+    assert verify(model_path, samples=8)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['model.h5']
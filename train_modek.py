@@ -1,13 +1,12 @@
-import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Dropout, Flatten, Dense
-from sklearn.model_selection import train_test_split
-import requests
-import os
 import json
 
+from downloader import download_categories
+from quickdraw_data import QuickDrawStream
+
 print("Setup complete! TensorFlow version:", tf.__version__)
 
 # ============================================
@@ -21,40 +20,37 @@ CATEGORIES = [
 
 NUM_CLASSES = len(CATEGORIES)
 IMG_SIZE = 28
-SAMPLES_PER_CATEGORY = 2000  # Reduce if you get memory errors
+SAMPLES_PER_CATEGORY = None  # None = every drawing; files are streamed, not loaded into RAM
+VALIDATION_SAMPLES_PER_CATEGORY = 2000
+BATCH_SIZE = 128
+EXPORT_VARIANTS = True  # write int8 / pruned .tflite variants after training (export_model.py)
+PACK_DATA = True  # append new categories to the indexed shards in quickdraw_packed/ (packed_data.py)
+BUILD_CASCADE = False  # tiny fast model + centroid index for SKETCH_BACKEND=cascade / centroid (cascade.py)
+PUBLISH_VERSION = True  # copy the artifacts to models/<timestamp>/ and point models/CURRENT at it (model_registry.py)
 BASE_URL = 'https://storage.googleapis.com/quickdraw_dataset/full/numpy_bitmap/'
 
 print(f"Training model for {NUM_CLASSES} categories: {CATEGORIES}")
 
-def download_category(category):
-    url = BASE_URL + category.replace('_', '%20') + '.npy'
-    filename = f'{category}.npy'
-    if not os.path.exists(filename):
-        print(f"Downloading {category}...")
-        response = requests.get(url)
-        with open(filename, 'wb') as f:
-            f.write(response.content)
-    return filename
-
-for category in CATEGORIES:
-    download_category(category)
+# Parallel, resumable, verified downloads (see downloader.py)
+download_categories(CATEGORIES, base_url=BASE_URL)
 print("Download complete!")
 
-def load_data(categories, samples_per_category):
-    X, y = [], []
-    for idx, category in enumerate(categories):
-        data = np.load(f'{category}.npy')[:samples_per_category]
-        X.append(data)
-        y.append([idx] * len(data))
-        print(f"Loaded {len(data)} samples for {category}")
-    
-    X = np.concatenate(X).reshape(-1, 28, 28, 1).astype('float32') / 255.0
-    y = keras.utils.to_categorical(np.concatenate(y), NUM_CLASSES)
-    return X, y
-
-X, y = load_data(CATEGORIES, SAMPLES_PER_CATEGORY)
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-print(f"Training: {X_train.shape}, Testing: {X_test.shape}")
+# Only categories that are not packed yet are read and appended
+if PACK_DATA:
+    from packed_data import pack_categories
+    pack_categories(CATEGORIES)
+
+# Memory-mapped, class-balanced batches (see quickdraw_data.py)
+stream = QuickDrawStream(
+    CATEGORIES,
+    batch_size=BATCH_SIZE,
+    samples_per_category=SAMPLES_PER_CATEGORY,
+    validation_samples_per_category=VALIDATION_SAMPLES_PER_CATEGORY,
+)
+train_data = stream.train_dataset()
+val_data = stream.validation_dataset()
+print(f"Training: {stream.train_samples} samples ({stream.steps_per_epoch} steps/epoch), "
+      f"Testing: {stream.val_samples} samples")
 
 # ============================================
 # IMPROVED MODEL FOR MORE CATEGORIES
@@ -84,15 +80,16 @@ early_stop = keras.callbacks.EarlyStopping(monitor='val_loss', patience=3, resto
 reduce_lr = keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=2)
 
 history = model.fit(
-    X_train, y_train,
-    batch_size=128,
+    train_data,
+    steps_per_epoch=stream.steps_per_epoch,
     epochs=20,  # More epochs for more categories
-    validation_data=(X_test, y_test),
+    validation_data=val_data,
+    validation_steps=stream.validation_steps,
     callbacks=[early_stop, reduce_lr],
     verbose=1
 )
 
-test_loss, test_accuracy = model.evaluate(X_test, y_test)
+test_loss, test_accuracy = model.evaluate(val_data, steps=stream.validation_steps)
 print(f"\nTest Accuracy: {test_accuracy*100:.2f}%")
 
 model.save('sketch_model.h5')
@@ -102,4 +99,22 @@ with open('categories.json', 'w') as f:
 with open('model_accuracy.txt', 'w') as f:
     f.write(str(test_accuracy))
 
+# Quantized / pruned .tflite variants with size, latency and accuracy report
+if EXPORT_VARIANTS:
+    from export_model import export_variants
+    export_variants(model, stream, prune_levels=(0.5,), baseline_accuracy=test_accuracy)
+
+# Scalable classification modes: tiny first-stage model and category prototypes
+if BUILD_CASCADE:
+    from cascade import train_fast_model, build_centroids
+    from inference import KerasBackend
+    train_fast_model(stream)
+    build_centroids(KerasBackend('sketch_model.h5'), CATEGORIES).save()
+
+# Running servers watch models/CURRENT and swap the new version in without a restart
+if PUBLISH_VERSION:
+    from model_registry import publish_version
+    version, _ = publish_version('models')
+    print(f"✅ Published model version {version}")
+
 print("✅ Model saved! Now run app.py to start the server.")
@@ -0,0 +1,431 @@
+# ============================================
+# MULTI-PROCESS INFERENCE POOL
+# Spreads PNG decode and the NumPy forward pass across N worker processes
+# so /api/predict is not limited by the GIL.
+#   - model weights are copied once into a shared-memory block; every
+#     worker builds its NumpyBackend over views of that block
+#   - requests travel through a shared-memory slot ring: the caller writes
+#     the payload into a free slot, only the slot number crosses the
+#     process boundary, and the worker writes probabilities back in place
+#   - each worker has its own task and result pipes; a slot goes to the
+#     worker with the fewest requests in flight
+#   - workers drain several queued slots at once and run them as one batch
+#   - a batch holds at most max_request_slots slots at a time, so one big
+#     /api/predict/batch cannot take the ring from single predictions
+#   - PNGs too large for a slot are decoded in the caller and sent as a
+#     28x28 bitmap instead
+#   - a worker that dies is replaced; requests sent to it fail with
+#     WorkerDied instead of waiting forever
+# Workers are forked, so this only targets POSIX platforms.
+# ============================================
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from canvas_decode import decode_png_bytes
+from inference import NumpyBackend
+
+KIND_BITMAP = 0
+KIND_PNG = 1
+BITMAP_BYTES = 28 * 28
+
+# Set in the parent only while a pool worker is being forked, so at-fork
+# hooks (see app.restart_after_fork) can tell pool workers apart
+_forking_pool_worker = False
+
+
+class WorkerDied(RuntimeError):
+    pass
+
+
+class PoolSaturated(RuntimeError):
+    # Every ring slot stayed busy for the whole submit timeout
+    pass
+
+
+def forking_pool_worker():
+    return _forking_pool_worker
+
+
+def parse_cpu_affinity(value, num_workers):
+    """'' -> no pinning, 'auto' -> worker i on CPU i, '0,2,4' -> explicit list."""
+    value = (value or '').strip()
+    if not value or not hasattr(os, 'sched_setaffinity'):
+        return [None] * num_workers
+    if value == 'auto':
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = [int(c) for c in value.split(',') if c.strip()]
+    return [cpus[i % len(cpus)] for i in range(num_workers)]
+
+
+# ============================================
+# SHARED MEMORY HELPERS
+# ============================================
+class SharedArrays:
+    """Several named numpy arrays packed into one SharedMemory block."""
+
+    def __init__(self, shm, layout, owner):
+        self.shm = shm
+        self.layout = layout
+        self.owner = owner
+        self.arrays = {
+            name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            for name, (dtype, shape, offset) in layout.items()
+        }
+
+    @classmethod
+    def create(cls, specs, initial=None):
+        # specs: {name: (dtype, shape)}; offsets are 64-byte aligned
+        layout, offset = {}, 0
+        for name, (dtype, shape) in specs.items():
+            offset = (offset + 63) // 64 * 64
+            layout[name] = (np.dtype(dtype).str, tuple(shape), offset)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        shared = cls(shm, layout, owner=True)
+        for name, value in (initial or {}).items():
+            shared.arrays[name][...] = value
+        return shared
+
+    @classmethod
+    def attach(cls, name, layout):
+        return cls(shared_memory.SharedMemory(name=name), layout, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    def close(self):
+        self.arrays = {}
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def share_backend_weights(backend):
+    specs = {name: (array.dtype, array.shape) for name, array in backend.weights.items()}
+    return SharedArrays.create(specs, backend.weights)
+
+
+# ============================================
+# WORKER PROCESS
+# ============================================
+def _worker_main(worker_id, cpu, spec_json, weights_ref, ring_ref, tasks, results, max_batch):
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)  # one BLAS thread per pinned worker
+    except ImportError:
+        pass
+
+    weights = SharedArrays.attach(*weights_ref)
+    ring = SharedArrays.attach(*ring_ref)
+    backend = NumpyBackend.from_arrays(json.loads(spec_json), weights.arrays)
+    payload, lengths, kinds, probs = (ring.arrays[k] for k in ('payload', 'length', 'kind', 'probs'))
+
+    running = True
+    while running:
+        try:
+            slot = tasks.recv()
+        except EOFError:
+            break
+        if slot is None:
+            break
+        slots = [slot]
+        while len(slots) < max_batch and tasks.poll():
+            slot = tasks.recv()
+            if slot is None:
+                running = False
+                break
+            slots.append(slot)
+
+        done, bitmaps, replies = [], [], []
+        for slot in slots:
+            try:
+                data = payload[slot, :lengths[slot]]
+                if kinds[slot] == KIND_PNG:
+                    bitmaps.append(decode_png_bytes(data.tobytes()))
+                else:
+                    bitmaps.append(data.reshape(28, 28))
+                done.append(slot)
+            except Exception as e:
+                replies.append((slot, f"Invalid image data: {e}"))
+
+        if done:
+            try:
+                x = np.stack(bitmaps).reshape(-1, 28, 28, 1).astype(np.float32) / 255.0
+                probs[done] = backend.predict(x)
+                replies.extend((slot, None) for slot in done)
+            except Exception as e:
+                replies.extend((slot, str(e)) for slot in done)
+        results.send(replies)
+
+    weights.close()
+    ring.close()
+
+
+# ============================================
+# POOL (lives in the serving process)
+# ============================================
+class InferencePool:
+    def __init__(self, backend, num_workers=2, slots=128, max_payload=256 * 1024,
+                 max_batch=32, cpu_affinity='', result_timeout=10.0, max_request_slots=None):
+        self.num_workers = num_workers
+        self.num_slots = slots
+        self.max_request_slots = max(1, min(slots, max_request_slots or slots // 4))
+        self.max_payload = max(max_payload, BITMAP_BYTES)
+        self.num_classes = backend.num_classes
+        self.result_timeout = result_timeout
+
+        self.weights = share_backend_weights(backend)
+        self.ring = SharedArrays.create({
+            'payload': (np.uint8, (slots, self.max_payload)),
+            'length': (np.int32, (slots,)),
+            'kind': (np.int8, (slots,)),
+            'probs': (np.float32, (slots, self.num_classes)),
+        })
+        self._payload = self.ring.arrays['payload']
+        self._lengths = self.ring.arrays['length']
+        self._kinds = self.ring.arrays['kind']
+        self._probs = self.ring.arrays['probs']
+
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        # Guarded by _lock: which worker each slot went to, and its load
+        self._lock = threading.Lock()
+        self._futures = [None] * slots
+        self._assigned = [None] * slots
+        self._in_flight = [0] * num_workers
+        # Workers being replaced; submissions skip them until they are back
+        self._down = set()
+        self._worker_up = threading.Condition(self._lock)
+        self.respawns = 0
+
+        self._ctx = mp.get_context('fork')
+        self._spec_json = json.dumps(backend.spec)
+        self._max_batch = max_batch
+        self.cpus = parse_cpu_affinity(cpu_affinity, num_workers)
+        self._procs, self._tasks, self._results = [None] * num_workers, [None] * num_workers, [None] * num_workers
+        for worker_id in range(num_workers):
+            self._procs[worker_id], self._tasks[worker_id], self._results[worker_id] = self._start_worker(worker_id)
+
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name='inference-pool-results', daemon=True)
+        self._dispatcher.start()
+
+    def _start_worker(self, worker_id):
+        global _forking_pool_worker
+        task_reader, task_writer = self._ctx.Pipe(duplex=False)
+        result_reader, result_writer = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.cpus[worker_id], self._spec_json, (self.weights.name, self.weights.layout),
+                  (self.ring.name, self.ring.layout), task_reader, result_writer, self._max_batch),
+            name=f'inference-worker-{worker_id}', daemon=True)
+        _forking_pool_worker = True
+        try:
+            proc.start()
+        finally:
+            _forking_pool_worker = False
+        # Only the worker holds these ends now, so its death reads as EOF here
+        task_reader.close()
+        result_writer.close()
+        return proc, task_writer, result_reader
+
+    # --------------------------------------------
+    # Submission
+    # --------------------------------------------
+    def _submit(self, kind, data, timeout=None):
+        if self._closed:
+            raise RuntimeError("InferencePool is closed")
+        if len(data) > self.max_payload:
+            raise ValueError(f"Payload of {len(data)} bytes exceeds the {self.max_payload} byte slot size")
+        try:
+            slot = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolSaturated("Inference pool is saturated")
+        self._payload[slot, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self._lengths[slot] = len(data)
+        self._kinds[slot] = kind
+        future = Future()
+        with self._lock:
+            while len(self._down) == self.num_workers:
+                self._worker_up.wait()
+            worker_id = min((w for w in range(self.num_workers) if w not in self._down),
+                            key=self._in_flight.__getitem__)
+            self._futures[slot] = future
+            self._assigned[slot] = worker_id
+            self._in_flight[worker_id] += 1
+            self._tasks[worker_id].send(slot)
+        return future
+
+    def submit_bitmap(self, bitmap, timeout=None):
+        bitmap = np.ascontiguousarray(bitmap, dtype=np.uint8)
+        if bitmap.size != BITMAP_BYTES:
+            raise ValueError(f"Bitmap must have {BITMAP_BYTES} pixels")
+        return self._submit(KIND_BITMAP, bitmap.tobytes(), timeout)
+
+    def submit_png(self, png_bytes, timeout=None):
+        if len(png_bytes) > self.max_payload:
+            # Too big for a slot: decode here and send the bitmap instead
+            try:
+                bitmap = decode_png_bytes(png_bytes)
+            except Exception as e:
+                raise ValueError(f"Invalid image data: {e}")
+            return self.submit_bitmap(bitmap, timeout)
+        return self._submit(KIND_PNG, png_bytes, timeout)
+
+    def predict_bitmaps(self, bitmaps, timeout=None):
+        # One deadline covers the slot waits and the results of the whole
+        # batch; a slot is only taken once an earlier one has been answered
+        deadline = time.monotonic() + (self.result_timeout if timeout is None else timeout)
+        remaining = lambda: max(0.0, deadline - time.monotonic())
+        results = [None] * len(bitmaps)
+        pending = deque()
+        for i, bitmap in enumerate(bitmaps):
+            if len(pending) >= self.max_request_slots:
+                j, future = pending.popleft()
+                results[j] = future.result(timeout=remaining())
+            pending.append((i, self.submit_bitmap(bitmap, remaining())))
+        for j, future in pending:
+            results[j] = future.result(timeout=remaining())
+        return np.stack(results)
+
+    # --------------------------------------------
+    # Result dispatch
+    # --------------------------------------------
+    def _release(self, slot):
+        with self._lock:
+            future = self._futures[slot]
+            self._in_flight[self._assigned[slot]] -= 1
+            self._futures[slot] = None
+            self._assigned[slot] = None
+        return future
+
+    def _dispatch(self):
+        while not self._closed:
+            readers = {conn: worker_id for worker_id, conn in enumerate(self._results)}
+            for conn in wait(list(readers), timeout=1.0):
+                try:
+                    replies = conn.recv()
+                except (EOFError, OSError):
+                    if not self._closed:
+                        self._replace_worker(readers[conn])
+                    continue
+                for slot, error in replies:
+                    if error is None:
+                        result = self._probs[slot].copy()
+                    future = self._release(slot)
+                    self._free.put(slot)
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(ValueError(error))
+
+    def _replace_worker(self, worker_id):
+        proc = self._procs[worker_id]
+        proc.join(timeout=5)
+        self._results[worker_id].close()
+        with self._lock:
+            self._down.add(worker_id)
+            self._tasks[worker_id].close()
+            lost = [slot for slot, owner in enumerate(self._assigned) if owner == worker_id]
+        # Fork without holding _lock, so submissions to the other workers
+        # are not held up for the length of a fork
+        started = None
+        try:
+            started = self._start_worker(worker_id)
+        finally:
+            with self._lock:
+                if started is not None:
+                    self._procs[worker_id], self._tasks[worker_id], self._results[worker_id] = started
+                    self.respawns += 1
+                self._down.discard(worker_id)
+                self._worker_up.notify_all()
+        print(f"⚠️  Inference worker {worker_id} exited with code {proc.exitcode}; "
+              f"restarted it and failed {len(lost)} requests")
+        # Anything it was sent is gone with it
+        for slot in lost:
+            future = self._release(slot)
+            self._free.put(slot)
+            future.set_exception(WorkerDied(f"Inference worker {worker_id} exited with code {proc.exitcode}"))
+
+    def stats(self):
+        return {
+            'workers': self.num_workers,
+            'alive': sum(p.is_alive() for p in self._procs),
+            'respawns': self.respawns,
+            'cpu_affinity': self.cpus,
+            'slots': self.num_slots,
+            'max_request_slots': self.max_request_slots,
+            'free_slots': self._free.qsize(),
+            'shared_weights_bytes': self.weights.nbytes,
+            'ring_bytes': self.ring.nbytes,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._dispatcher.join(timeout=5)
+        with self._lock:
+            for conn in self._tasks:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for conn in self._tasks + self._results:
+            conn.close()
+        self.weights.close()
+        self.ring.close()
+
+
+# ============================================
+# SCALING CHECK
+#   python worker_pool.py --weights sketch_model.npz --max-workers 8
+# ============================================
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure inference pool throughput per worker count")
+    parser.add_argument('--weights', default='sketch_model.npz')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--images', type=int, default=4096)
+    parser.add_argument('--affinity', default='auto')
+    args = parser.parse_args()
+
+    backend = NumpyBackend(args.weights)
+    bitmaps = np.random.default_rng(0).integers(0, 256, (args.images, 28, 28), dtype=np.uint8)
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        pool = InferencePool(backend, num_workers=workers, cpu_affinity=args.affinity)
+        pool.predict_bitmaps(bitmaps[:64])  # warm up
+        started = time.perf_counter()
+        pool.predict_bitmaps(bitmaps)
+        rate = args.images / (time.perf_counter() - started)
+        pool.close()
+        baseline = baseline or rate
+        print(f"{workers:>2} workers: {rate:>9.0f} images/s  ({rate / baseline:.2f}x)")